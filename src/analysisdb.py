@@ -0,0 +1,157 @@
+"""! @brief     Persistent database of analysed positions
+
+    Evaluations and best moves of the full strength engines (the evaluation
+    engine, its background analysis and batch.py) are stored in SQLite,
+    keyed by the Zobrist hash of the position, so club games repeating the
+    same openings get their evaluations and hints from disk instead of
+    searching again. The AI engine plays at a limited strength and never
+    writes to the database.
+
+    The database runs in WAL mode, so any number of readers (the boards, the
+    batch workers) work next to one writer without blocking each other. Every
+    thread gets its own connection. A position is only replaced by a search
+    at the same or a greater depth.
+
+    Scores are white positive, as Stockfish.get_evaluation.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+import chess
+import chess.polyglot
+
+ADB_BUSY_TIMEOUT = 5000     # ms to wait for the write lock of another process
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    key INTEGER PRIMARY KEY,    -- Zobrist hash as signed 64 bit
+    fen TEXT NOT NULL,          -- Position part of the FEN, guards against hash collisions
+    depth INTEGER NOT NULL,
+    score_type TEXT NOT NULL,   -- "cp" or "mate"
+    score INTEGER NOT NULL,
+    best TEXT,                  -- Best move in UCI, NULL for evaluation only entries
+    pv TEXT,                    -- Space separated UCI moves
+    updated REAL NOT NULL
+)
+"""
+
+_UPSERT = """
+INSERT INTO positions (key, fen, depth, score_type, score, best, pv, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(key) DO UPDATE SET fen = excluded.fen, depth = excluded.depth, score_type = excluded.score_type,
+    score = excluded.score, best = COALESCE(excluded.best, positions.best), pv = COALESCE(excluded.pv, positions.pv),
+    updated = excluded.updated
+WHERE excluded.depth >= positions.depth OR excluded.fen != positions.fen
+"""
+
+
+def _key(board: chess.Board) -> int:
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= 1 << 63 else key     # SQLite integers are signed
+
+
+def _fen(board: chess.Board) -> str:
+    return board.fen().rsplit(" ", 2)[0]    # Without the move counters, they don't change the analysis
+
+
+class AnalysisDatabase:
+
+    """! @brief     Positions with their depth, evaluation, best move and PV """
+
+    def __init__(self, path: str):
+
+        """! The Contructor
+
+        @param  path    SQLite file, created if missing.
+        """
+
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        self._local = threading.local()
+        self._connection()  # Fail early on a bad path
+
+    def _connection(self) -> sqlite3.Connection:
+
+        """! Connection of the calling thread """
+
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=ADB_BUSY_TIMEOUT / 1000, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")    # WAL stays consistent, only the last commits may be lost on power loss
+            connection.execute(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def lookup(self, board: chess.Board, depth: int, need_move: bool = False) -> Optional[dict]:
+
+        """! Find a position analysed at least as deep as asked for
+
+        @param  board       The position.
+        @param  depth       Min depth of the stored analysis.
+        @param  need_move   Only accept entries with a best move.
+
+        @return             {"depth", "evaluation", "best", "pv"} or None.
+        """
+
+        row = self._connection().execute(
+            "SELECT fen, depth, score_type, score, best, pv FROM positions WHERE key = ?", (_key(board),)).fetchone()
+
+        if row is None or row[0] != _fen(board) or row[1] < depth or (need_move and row[4] is None):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return {"depth": row[1], "evaluation": {"type": row[2], "value": row[3]}, "best": row[4],
+                "pv": row[5].split() if row[5] else []}
+
+    def store(self, board: chess.Board, depth: int, evaluation: dict, best: Optional[str] = None,
+              pv: Optional[List[str]] = None):
+
+        """! Store an analysis, kept only if it is at least as deep as the stored one
+
+        @param  board       The position.
+        @param  depth       Depth of the search.
+        @param  evaluation  White positive {"type", "value"}.
+        @param  best        Best move in UCI or None.
+        @param  pv          Principal variation in UCI or None.
+        """
+
+        if not evaluation:
+            return
+
+        try:
+            self._connection().execute(_UPSERT, (_key(board), _fen(board), depth, evaluation["type"], evaluation["value"],
+                                                 best, " ".join(pv) if pv else None, time.time()))
+        except sqlite3.OperationalError as err:     # Locked longer than the busy timeout, the entry is just lost
+            print(f"analysis db: {err}")
+
+    def count(self) -> int:
+
+        """! Number of stored positions (not __len__, an empty database is still in use) """
+
+        return self._connection().execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+
+
+def open_analysis_db(path: str) -> Optional[AnalysisDatabase]:
+
+    """! Open the database if its directory exists
+
+    @param  path    SQLite file, "" to disable.
+
+    @return         AnalysisDatabase or None.
+    """
+
+    if not path or not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        return None
+
+    try:
+        return AnalysisDatabase(path)
+    except sqlite3.Error as err:
+        print(f"analysis db: {path}: {err}")
+        return None
@@ -0,0 +1,330 @@
+"""! @brief     Batch analysis of stored games
+
+    Analyses every position of every game in a directory with a pool of engine
+    processes, one per worker, so a whole club evening is reviewed on all CPU
+    cores. A game is the unit of work: the worker keeps its engine (and hash
+    table) for the whole game and the main process appends the per move
+    records as each game finishes.
+
+    Input files:
+
+        *.pgn                       One or more games, the mainline is analysed
+        *.txt, *.moves, *.uci       One game per line, moves in UCI or SAN
+
+    Output is JSON lines, one record per move followed by one record per game:
+
+        {"game": "club/2021.pgn:3", "ply": 12, "move": "d1h5", "san": "Qh5", "best": "g1f3",
+         "eval": {"type": "cp", "value": -180}, "loss": 230, "blunder": false}
+        {"game": "club/2021.pgn:3", "done": true, "positions": 81, "blunders": 2}
+
+    Evaluations are white positive, loss is in centipawns for the moving side.
+    An interrupted run is resumed by running it again on the same output file.
+
+    With --db the positions are looked up in and stored to the analysis
+    database the board uses (see analysisdb.py), positions analysed deep
+    enough before are not searched again.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import chess
+import chess.pgn
+
+from analysisdb import AnalysisDatabase, open_analysis_db
+from stockfish import Stockfish
+
+BATCH_MATE_CP = 10000               # Centipawn value of a mate, shorter mates score higher
+BATCH_BLUNDER_CP = 300              # Default eval loss for a blunder
+BATCH_MOVE_LIST_EXTENSIONS = (".txt", ".moves", ".uci")
+BATCH_RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+_engine: Optional[Stockfish] = None
+_limits: dict = {}
+_db: Optional[AnalysisDatabase] = None
+
+
+def parser():
+    """! @brief     Parser function to get all the arguments """
+
+    cores = os.cpu_count() or 1
+
+    args = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                   description="Analyse stored games with one engine per core")
+
+    args.add_argument("games", type=str,
+                      help="directory with pgn/move list files")
+    args.add_argument("-o", "--output", type=str, default="analysis.jsonl",
+                      help="json lines output file, resumed if it exists")
+    args.add_argument("-i", "--input", type=str, default="stockfish",
+                      help="path to engine")
+    args.add_argument("--threads", type=int, default=1,
+                      help="engine threads per worker")
+    args.add_argument("--workers", type=int, default=0,
+                      help="number of engine processes (0 for cores / threads)")
+    args.add_argument("--hash", type=int, default=256,
+                      help="total hash in MB, split between the workers")
+    args.add_argument("--depth", type=int, default=12,
+                      help="search depth per position")
+    args.add_argument("--movetime", type=int, default=None,
+                      help="think time per position in ms (instead of depth)")
+    args.add_argument("--nodes", type=int, default=None,
+                      help="nodes per position (instead of depth)")
+    args.add_argument("--blunder", type=int, default=BATCH_BLUNDER_CP,
+                      help="eval loss in centipawns to flag a move as a blunder")
+    args.add_argument("--engine_timeout", type=float, default=30,
+                      help="seconds without engine output before the engine is restarted")
+    args.add_argument("--db", type=str, default="",
+                      help="analysis database to read and extend, e.g. the board's analysis.db")
+
+    args = args.parse_args()
+    if args.workers <= 0:
+        args.workers = max(cores // args.threads, 1)
+
+    return args
+
+
+def parse_move_list(text: str) -> Tuple[str, List[str]]:
+
+    """! Parse a line of moves in UCI or SAN, move numbers and results are skipped
+
+    @param  text    The moves, e.g. "1. e4 e5 2. Nf3" or "e2e4 e7e5 g1f3".
+
+    @return         (start fen, moves in UCI).
+    """
+
+    board = chess.Board()
+    for token in text.split():
+        if token in BATCH_RESULTS or token.rstrip(".").isdigit() or token.endswith("..."):
+            continue
+        try:
+            move = chess.Move.from_uci(token)
+            if move not in board.legal_moves:
+                raise ValueError(token)
+        except ValueError:
+            move = board.parse_san(token.split(".")[-1])
+        board.push(move)
+
+    return chess.STARTING_FEN, [move.uci() for move in board.move_stack]
+
+
+def load_games(directory: str) -> Iterator[Tuple[str, str, List[str]]]:
+
+    """! Read all games below a directory, in file name order
+
+    @param  directory   Directory with pgn/move list files.
+
+    @return             Iterator of (game id, start fen, moves in UCI).
+    """
+
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, directory)
+            extension = os.path.splitext(name)[1].lower()
+
+            if extension == ".pgn":
+                with open(path, errors="replace") as pgn:
+                    index = 0
+                    while True:
+                        game = chess.pgn.read_game(pgn)
+                        if game is None:
+                            break
+                        index += 1
+                        if game.errors:
+                            print(f"{relative}:{index}: skipped, {game.errors[0]}")
+                            continue
+                        yield f"{relative}:{index}", game.board().fen(), [move.uci() for move in game.mainline_moves()]
+
+            elif extension in BATCH_MOVE_LIST_EXTENSIONS:
+                with open(path, errors="replace") as move_list:
+                    for index, line in enumerate(move_list, 1):
+                        if not line.strip():
+                            continue
+                        try:
+                            fen, moves = parse_move_list(line)
+                        except ValueError as err:
+                            print(f"{relative}:{index}: skipped, {err}")
+                            continue
+                        yield f"{relative}:{index}", fen, moves
+
+
+def resume(output_path: str) -> set:
+
+    """! Find the finished games in an earlier output and cut off a partly written game
+
+    @param  output_path     The output file.
+
+    @return                 Set of finished game ids.
+    """
+
+    finished = set()
+    if not os.path.isfile(output_path):
+        return finished
+
+    complete = 0
+    with open(output_path, "rb") as output:
+        for line in output:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record.get("done"):
+                finished.add(record["game"])
+                complete = output.tell()
+
+    with open(output_path, "r+b") as output:
+        output.truncate(complete)
+
+    return finished
+
+
+def _init_worker(path: str, threads: int, hash_mb: int, limits: dict, timeout: float, db_path: str):
+
+    """! Start the worker's engine, it is kept for all the games the worker gets """
+
+    global _engine, _limits, _db
+    _engine = Stockfish(path, parameters={"Threads": threads, "Hash": hash_mb}, timeout=timeout)
+    _limits = limits
+    _db = open_analysis_db(db_path)
+
+
+def _score_cp(evaluation: dict, white_to_move: bool) -> int:
+
+    """! Single white positive centipawn value of an evaluation, mates mapped outside the normal range """
+
+    if evaluation["type"] == "mate":
+        value = evaluation["value"]
+        if value == 0:  # The side to move is mated
+            return -BATCH_MATE_CP if white_to_move else BATCH_MATE_CP
+        return BATCH_MATE_CP - abs(value) if value > 0 else -BATCH_MATE_CP + abs(value)
+    return evaluation["value"]
+
+
+def _evaluate(board: chess.Board) -> Tuple[dict, Optional[str]]:
+
+    """! Evaluate a position on the worker's engine
+
+    @return     (evaluation white positive, best move or None).
+    """
+
+    if board.is_checkmate():
+        return {"type": "mate", "value": 0}, None
+    if board.is_game_over():
+        return {"type": "cp", "value": 0}, None
+
+    # Only depth limited searches can be compared with the stored depth
+    if _db and "depth" in _limits:
+        entry = _db.lookup(board, _limits["depth"], need_move=True)
+        if entry is not None:
+            return entry["evaluation"], entry["best"]
+
+    # Positions are sent as FEN without ucinewgame, so the hash carries over between moves
+    _engine.set_fen_position(board.fen(), False)
+    multiplier = 1 if board.turn == chess.WHITE else -1
+    evaluation, best_move, depth, pv = {"type": "cp", "value": 0}, None, 0, None
+    for info in _engine.iter_search(**_limits):
+        if info.multipv == 1 and info.score_type is not None:
+            evaluation = {"type": info.score_type, "value": info.score * multiplier}
+            if info.pv:
+                best_move, depth, pv = info.pv[0], info.depth or 0, info.pv
+
+    if _db and best_move is not None:
+        _db.store(board, depth, evaluation, best_move, pv)
+
+    return evaluation, best_move
+
+
+def analyse_game(game: Tuple[str, str, List[str]], blunder_cp: int) -> Tuple[str, List[dict], int]:
+
+    """! Analyse every position of a game, runs in a worker
+
+    @param  game        (game id, start fen, moves in UCI).
+    @param  blunder_cp  Eval loss to flag a move as a blunder.
+
+    @return             (game id, move records, number of positions).
+    """
+
+    game_id, fen, moves = game
+    board = chess.Board(fen)
+    _engine.set_fen_position(fen)  # New game, clear the hash
+
+    evaluation, best_move = _evaluate(board)
+    records = []
+    for ply, uci in enumerate(moves, board.ply() + 1):
+        move = chess.Move.from_uci(uci)
+        san = board.san(move)
+        mover = 1 if board.turn == chess.WHITE else -1
+        before = _score_cp(evaluation, board.turn == chess.WHITE)
+
+        board.push(move)
+        evaluation_after, best_after = _evaluate(board)
+        after = _score_cp(evaluation_after, board.turn == chess.WHITE)
+
+        loss = max((before - after) * mover, 0)
+        records.append({"game": game_id, "ply": ply, "move": uci, "san": san, "best": best_move,
+                        "eval": evaluation_after, "loss": loss, "blunder": loss >= blunder_cp})
+        evaluation, best_move = evaluation_after, best_after
+
+    return game_id, records, len(moves) + 1
+
+
+def run(args):
+
+    """! Analyse all the games and write the results """
+
+    if args.movetime:
+        limits = {"movetime": args.movetime}
+    elif args.nodes:
+        limits = {"nodes": args.nodes}
+    else:
+        limits = {"depth": args.depth}
+
+    finished = resume(args.output)
+    games = [game for game in load_games(args.games) if game[0] not in finished]
+    hash_mb = max(args.hash // args.workers, 1)
+    print(f"{len(games)} games to analyse ({len(finished)} already done), "
+          f"{args.workers} workers x {args.threads} threads, {hash_mb} MB hash each")
+    if not games:
+        return
+
+    start = time.monotonic()
+    positions = 0
+    blunders = 0
+    initargs = (args.input, args.threads, hash_mb, limits, args.engine_timeout, args.db)
+    with open(args.output, "a") as output, \
+            multiprocessing.Pool(args.workers, _init_worker, initargs) as pool:
+        tasks = pool.imap_unordered(_analyse_task, [(game, args.blunder) for game in games])
+        for count, (game_id, records, game_positions) in enumerate(tasks, 1):
+            game_blunders = sum(record["blunder"] for record in records)
+            for record in records:
+                output.write(json.dumps(record) + "\n")
+            output.write(json.dumps({"game": game_id, "done": True, "positions": game_positions,
+                                     "blunders": game_blunders}) + "\n")
+            output.flush()
+
+            positions += game_positions
+            blunders += game_blunders
+            elapsed = time.monotonic() - start
+            print(f"{count}/{len(games)} {game_id}: {game_blunders} blunders, "
+                  f"{positions / elapsed:.1f} positions/s")
+
+    elapsed = time.monotonic() - start
+    rate = positions / elapsed if elapsed else 0.0
+    print(f"{positions} positions in {elapsed:.1f} s ({rate:.1f} positions/s), {blunders} blunders")
+
+
+def _analyse_task(task: Tuple[Tuple[str, str, List[str]], int]) -> Tuple[str, List[dict], int]:
+    return analyse_game(*task)
+
+
+if __name__ == "__main__":
+
+    """! @brief    Main function """
+
+    run(parser())
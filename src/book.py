@@ -0,0 +1,166 @@
+"""! @brief     Polyglot opening book lookup
+
+    The book file is memory mapped and searched with a binary search on the
+    Zobrist key of the position, so a lookup costs a handful of page reads and
+    no engine time. Entries are 16 bytes, big endian and sorted by key:
+
+        key (uint64) | move (uint16) | weight (uint16) | learn (uint32)
+"""
+
+import mmap
+import os
+import random
+import struct
+from typing import List, Optional, Tuple
+
+import chess
+import chess.polyglot
+
+BOOK_ENTRY_SIZE = 16
+BOOK_ENTRY_STRUCT = struct.Struct(">QHHI")
+BOOK_KEY_STRUCT = struct.Struct(">Q")
+
+BOOK_PROMOTION_PIECES = ["", "n", "b", "r", "q"]
+
+BOOK_MAX_EXPONENT = 6       # Power of the weights at the highest difficulty
+
+# Polyglot encodes castling as "king takes own rook"
+BOOK_CASTLING_MOVES = {
+    "e1h1": "e1g1",
+    "e1a1": "e1c1",
+    "e8h8": "e8g8",
+    "e8a8": "e8c8",
+}
+
+
+class PolyglotBook:
+
+    """! @brief     Memory mapped Polyglot (.bin) opening book """
+
+    def __init__(self, path: str, max_ply: int = 30, difficulty_max: int = 8):
+
+        """! The Contructor
+
+        @param  path            Path to the Polyglot .bin file.
+        @param  max_ply         Do not look up positions after this many plies.
+        @param  difficulty_max  The highest difficulty, used to scale the move choice.
+        """
+
+        self.path = path
+        self.max_ply = max_ply
+        self.difficulty_max = difficulty_max
+
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._entries = size // BOOK_ENTRY_SIZE
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def __len__(self):
+        return self._entries
+
+    def _key_at(self, index: int) -> int:
+        return BOOK_KEY_STRUCT.unpack_from(self._mmap, index * BOOK_ENTRY_SIZE)[0]
+
+    def _lower_bound(self, key: int) -> int:
+
+        """! Binary search for the first entry with a key not less than key """
+
+        low, high = 0, self._entries
+        while low < high:
+            mid = (low + high) // 2
+            if self._key_at(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    @staticmethod
+    def _decode_move(board: chess.Board, raw_move: int) -> str:
+
+        """! Convert a Polyglot move into a UCI move string
+
+        @param  board       The position the move is played from.
+        @param  raw_move    The 16 bit Polyglot move.
+
+        @return             Move in UCI notation e.g. 'e2e4' or 'g7g8q'.
+        """
+
+        to_square = raw_move & 0x3f
+        from_square = (raw_move >> 6) & 0x3f
+        promotion = (raw_move >> 12) & 0x7
+
+        move = chess.square_name(from_square) + chess.square_name(to_square) + BOOK_PROMOTION_PIECES[promotion]
+
+        if move in BOOK_CASTLING_MOVES and board.piece_type_at(from_square) == chess.KING:
+            move = BOOK_CASTLING_MOVES[move]
+
+        return move
+
+    def entries(self, board: chess.Board) -> List[Tuple[str, int]]:
+
+        """! Find all book moves for a position
+
+        @param  board   The position to look up.
+
+        @return         List of (move, weight) tuples, empty if out of book.
+        """
+
+        if self._mmap is None:
+            return []
+
+        key = chess.polyglot.zobrist_hash(board)
+        found = []
+
+        index = self._lower_bound(key)
+        while index < self._entries:
+            entry_key, raw_move, weight, _ = BOOK_ENTRY_STRUCT.unpack_from(self._mmap, index * BOOK_ENTRY_SIZE)
+            if entry_key != key:
+                break
+            move = self._decode_move(board, raw_move)
+            # Guard against Zobrist collisions and broken books
+            if chess.Move.from_uci(move) in board.legal_moves:
+                found.append((move, weight))
+            index += 1
+
+        return found
+
+    def get_move(self, moves: List[str], difficulty: int, start_fen: str = chess.STARTING_FEN) -> Optional[str]:
+
+        """! Pick a book move for the position after the given moves
+
+        The weights are raised to a power that grows with the difficulty, so
+        the lowest difficulty picks uniformly between all book moves and the
+        highest one plays a move with twice the weight of another 64 times as
+        often (BOOK_MAX_EXPONENT), i.e. almost always the main line.
+
+        @param  moves       List of moves done so far in UCI notation.
+        @param  difficulty  The current play difficulty.
+        @param  start_fen   The position the moves are played from.
+
+        @return             Move in UCI notation or None if out of book.
+        """
+
+        if len(moves) >= self.max_ply:
+            return None
+
+        board = chess.Board(start_fen)
+        for move in moves:
+            board.push_uci(move)
+
+        found = self.entries(board)
+        if not found:
+            return None
+
+        exponent = BOOK_MAX_EXPONENT * difficulty / self.difficulty_max
+        weights = [max(weight, 1) ** exponent for _, weight in found]
+
+        return random.choices([move for move, _ in found], weights=weights)[0]
+
+    def close(self):
+
+        """! Release the memory map and the file """
+
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
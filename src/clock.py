@@ -0,0 +1,117 @@
+"""! @brief     Chess clock for both players
+
+    The clock is driven by confirmed moves: when a move is accepted the mover's
+    clock stops, the increment is added and the opponent's clock starts. The
+    remaining times are handed to the AI engine as wtime/btime/winc/binc.
+"""
+
+import time
+
+
+class ChessClock:
+
+    """! @brief     Two sided chess clock measured with a monotonic timer """
+
+    def __init__(self, initial_ms: int, increment_ms: int = 0):
+
+        """! The Contructor
+
+        @param  initial_ms      Starting time for each player in milliseconds.
+        @param  increment_ms    Time added after each move in milliseconds.
+        """
+
+        self.initial_ms = initial_ms
+        self.increment_ms = increment_ms
+        self.reset()
+
+    def reset(self):
+
+        """! Reset both clocks to the starting time and stop them """
+
+        self.white_ms = self.initial_ms
+        self.black_ms = self.initial_ms
+        self.white_to_move = True
+        self.running = False
+        self._timestamp = 0.0
+
+    def _elapsed_ms(self) -> int:
+        return int((time.monotonic() - self._timestamp) * 1000) if self.running else 0
+
+    def _stop(self):
+
+        """! Charge the running clock with the time used so far """
+
+        if self.running:
+            if self.white_to_move:
+                self.white_ms -= self._elapsed_ms()
+            else:
+                self.black_ms -= self._elapsed_ms()
+        self._timestamp = time.monotonic()
+
+    def start(self, white_to_move: bool = True):
+
+        """! Start the clock for the side to move
+
+        @param  white_to_move   True if white is to move.
+        """
+
+        self._stop()
+        self.white_to_move = white_to_move
+        self.running = True
+
+    def press(self):
+
+        """! A move was confirmed, hand the clock over to the opponent """
+
+        self._stop()
+        if self.white_to_move:
+            self.white_ms += self.increment_ms
+        else:
+            self.black_ms += self.increment_ms
+        self.white_to_move = not self.white_to_move
+
+    def set_turn(self, white_to_move: bool):
+
+        """! Switch the running side without an increment, e.g. after an undo
+
+        @param  white_to_move   True if white is to move.
+        """
+
+        self._stop()
+        self.white_to_move = white_to_move
+
+    def remaining(self, white: bool) -> int:
+
+        """! Remaining time for a player
+
+        @param  white   True for white, False for black.
+
+        @return         Remaining time in milliseconds (never below zero).
+        """
+
+        if white:
+            remaining = self.white_ms - (self._elapsed_ms() if self.white_to_move else 0)
+        else:
+            remaining = self.black_ms - (0 if self.white_to_move else self._elapsed_ms())
+
+        return max(remaining, 0)
+
+    def is_flagged(self) -> bool:
+
+        """! Check if the side to move has run out of time """
+
+        return self.remaining(self.white_to_move) == 0
+
+    def go_params(self) -> dict:
+
+        """! Clock state in the form used by the UCI go command
+
+        @return     Dictionary with wtime, btime, winc and binc.
+        """
+
+        return {
+            "wtime": self.remaining(True),
+            "btime": self.remaining(False),
+            "winc": self.increment_ms,
+            "binc": self.increment_ms,
+        }
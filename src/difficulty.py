@@ -0,0 +1,41 @@
+"""! @brief     Difficulty settings of the AI engine
+
+    The board has difficulty 0 to 8, selected with the white/black buttons.
+    Difficulty 0 is Minic's random mover (Level 0), the others limit the
+    strength with UCI_Elo. The mapping lives here so the board and the
+    self-play calibration (selfplay.py) use the same settings.
+"""
+
+DIFFICULTY_MIN = 0
+DIFFICULTY_MAX = 8
+DIFFICULTY_RANDOM_LEVEL = 0     # Minic level used for difficulty 0
+DIFFICULTY_FULL_LEVEL = 100     # Minic level at full strength (its default)
+
+
+def difficulty_elo(difficulty: int) -> int:
+
+    """! Nominal Elo of a difficulty, 700 to 1400 (0 is the random mover) """
+
+    return difficulty * 100 + 600
+
+
+def difficulty_parameters(difficulty: int) -> dict:
+
+    """! UCI options for a difficulty
+
+    @param  difficulty  DIFFICULTY_MIN to DIFFICULTY_MAX.
+
+    @return             Options to update the AI engine parameters with.
+    """
+
+    if difficulty == 0:     # Use level random mover on difficulty 0
+        return {"UCI_LimitStrength": "false", "Level": DIFFICULTY_RANDOM_LEVEL}
+
+    return {"UCI_LimitStrength": "true", "UCI_Elo": difficulty_elo(difficulty)}
+
+
+def full_strength_parameters() -> dict:
+
+    """! UCI options undoing any difficulty, for an AI engine which also evaluates (--single_engine) """
+
+    return {"UCI_LimitStrength": "false", "Level": DIFFICULTY_FULL_LEVEL}
@@ -0,0 +1,225 @@
+"""! @brief     Serve a local engine binary over TCP or a Unix socket
+
+    Lets a board hand its searches to a stronger machine: run the server next
+    to the engine and start the board with the engine address instead of a
+    path, e.g. -i tcp://192.168.1.20:9000 (see SocketTransport in
+    stockfish.py).
+
+        python3 engine_server.py stockfish --tcp 0.0.0.0:9000
+        python3 engine_server.py stockfish --unix /tmp/engine.sock
+
+    Every connection gets its own engine process, which is plain UCI passed
+    through line by line. Engines are kept running when a client disconnects
+    and handed to the next connection, so reconnecting does not pay for an
+    engine start. Before that the server sets every option the engine lists
+    after "uci" back to its default and starts a new game, so the options
+    and the hash of one client don't leak to the next.
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import threading
+import time
+from typing import List
+
+SERVER_MAX_IDLE = 4             # Idle engines kept for the next connections
+
+
+def parser():
+    """! @brief     Parser function to get all the arguments """
+
+    args = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                   description="Serve a UCI engine over TCP or a Unix socket")
+
+    args.add_argument("engine", type=str,
+                      help="path to engine")
+    args.add_argument("--tcp", type=str, default="",
+                      help="host:port to listen on")
+    args.add_argument("--unix", type=str, default="",
+                      help="unix socket path to listen on")
+    args.add_argument("--max_idle", type=int, default=SERVER_MAX_IDLE,
+                      help="idle engines kept running for the next connections")
+
+    args = args.parse_args()
+    if not args.tcp and not args.unix:
+        args.tcp = "127.0.0.1:9000"
+
+    return args
+
+
+class EngineServer:
+
+    """! @brief     Accepts connections and bridges each to an engine process """
+
+    def __init__(self, path: str, max_idle: int = SERVER_MAX_IDLE):
+
+        """! The Contructor
+
+        @param  path        Path to the engine binary.
+        @param  max_idle    Idle engines kept for the next connections.
+        """
+
+        self.path = path
+        self.max_idle = max_idle
+        self.connections = 0
+        self._idle: List[subprocess.Popen] = []
+        self._lock = threading.Lock()
+
+    def _get_engine(self) -> subprocess.Popen:
+
+        """! An idle engine, or a new one """
+
+        with self._lock:
+            while self._idle:
+                engine = self._idle.pop()
+                if engine.poll() is None:
+                    return engine
+
+        return subprocess.Popen(self.path, universal_newlines=True, bufsize=1,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def _put_engine(self, engine: subprocess.Popen):
+
+        """! Keep an engine for the next connection, or stop it if there are enough """
+
+        with self._lock:
+            if engine.poll() is None and len(self._idle) < self.max_idle:
+                self._idle.append(engine)
+                return
+
+        engine.kill()
+        engine.wait()
+
+    def serve(self, listener: socket.socket):
+
+        """! Accept connections until interrupted, one thread per connection """
+
+        while True:
+            connection, address = listener.accept()
+            if connection.family != socket.AF_UNIX:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections += 1
+            threading.Thread(target=self.session, args=(connection, address or "unix"), daemon=True).start()
+
+    def session(self, connection: socket.socket, address):
+
+        """! Pass UCI between a client and an engine until the client leaves
+
+        @info   The engine's output is forwarded by a second thread. When the client is gone
+                the engine is stopped, and its output is skipped up to the answer of one more
+                isready, so the next client starts on a quiet engine with its options reset.
+        """
+
+        engine = self._get_engine()
+        start = time.monotonic()
+        state = {"closed": False, "isready": 0}
+        forwarder = threading.Thread(target=self._forward, args=(engine, connection, state), daemon=True)
+        forwarder.start()
+        print(f"{address}: connected, engine pid {engine.pid}")
+
+        try:
+            for line in connection.makefile("r", encoding="utf-8", newline="\n"):
+                command = line.strip()
+                if command == "quit":   # The engine is kept for the next client
+                    break
+                if command == "isready":
+                    state["isready"] += 1
+                engine.stdin.write(f"{command}\n")
+                engine.stdin.flush()
+        except (OSError, ValueError):
+            pass
+        finally:
+            state["closed"] = True
+            try:
+                engine.stdin.write("stop\nisready\n")
+                engine.stdin.flush()
+            except OSError:
+                pass
+            forwarder.join()
+            connection.close()
+            try:
+                self._reset(engine)
+            except OSError:
+                pass
+            self._put_engine(engine)
+            print(f"{address}: disconnected after {time.monotonic() - start:.1f} s")
+
+    @staticmethod
+    def _reset(engine: subprocess.Popen):
+
+        """! Set the options of an engine back to the defaults it lists and start a new game """
+
+        engine.stdin.write("uci\n")
+        engine.stdin.flush()
+        defaults = []
+        for line in engine.stdout:
+            if line.startswith("uciok"):
+                break
+            if line.startswith("option name ") and " default" in line:   # Buttons have no default
+                name = line[len("option name "):line.index(" type ")]
+                default = line.split(" default", 1)[1].split(" min ")[0].split(" var ")[0].strip()
+                defaults.append(f"setoption name {name} value {default}\n")
+
+        engine.stdin.write("".join(defaults) + "ucinewgame\nisready\n")
+        engine.stdin.flush()
+        for line in engine.stdout:
+            if line.startswith("readyok"):
+                break
+
+    @staticmethod
+    def _forward(engine: subprocess.Popen, connection: socket.socket, state: dict):
+
+        """! Send the engine's output to the client, then drain it after the client is gone """
+
+        readyok = 0
+        for line in engine.stdout:
+            if line.startswith("readyok"):
+                readyok += 1
+                if state["closed"] and readyok > state["isready"]:
+                    return  # The answer to the isready sent after the client left
+            if not state["closed"]:
+                try:
+                    connection.sendall(line.encode())
+                except OSError:
+                    state["closed"] = True
+
+        # The engine exited, end the session
+        state["closed"] = True
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def listen(args) -> socket.socket:
+
+    """! Open the listening socket """
+
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.remove(args.unix)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(args.unix)
+    else:
+        host, _, port = args.tcp.rpartition(":")
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, int(port)))
+
+    listener.listen()
+    return listener
+
+
+if __name__ == "__main__":
+
+    """! @brief    Main function """
+
+    args = parser()
+    listener = listen(args)
+    print(f"serving {args.engine} on {args.unix or args.tcp}")
+    try:
+        EngineServer(args.engine, args.max_idle).serve(listener)
+    except KeyboardInterrupt:
+        pass
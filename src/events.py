@@ -0,0 +1,94 @@
+"""! @brief     Input event bus
+
+    Buttons and fields post events from the GPIO callback threads, engines
+    post from their output reader threads, and the game loop takes them out
+    in the order they happened. The bus is an unbounded deque, whose append
+    and popleft are atomic, so posting never blocks and the bus itself never
+    drops or reorders an event. The game takes one event per loop iteration
+    and discards it if the current state has no use for it (logged with
+    --debug), e.g. a press of a button which means nothing in that state.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Optional
+
+EVENT_BUTTON = "button"     # source: button pin
+EVENT_FIELD = "field"       # source: field interrupt pin of a row pair
+EVENT_ENGINE = "engine"     # source: the engine which finished a search
+
+
+class Event:
+
+    """! @brief     One input event with its monotonic timestamp """
+
+    __slots__ = ("kind", "source", "time", "data")
+
+    def __init__(self, kind: str, source: Any, data: Any = None):
+        self.kind = kind
+        self.source = source
+        self.time = time.monotonic()
+        self.data = data
+
+    def __repr__(self) -> str:
+        return f"Event({self.kind}, {self.source}, {self.time:.3f})"
+
+
+class EventBus:
+
+    """! @brief     Ordered, thread-safe queue of input events """
+
+    def __init__(self):
+
+        """! The Contructor """
+
+        self._events = deque()
+        self._posted = threading.Event()
+
+    def post(self, kind: str, source: Any, data: Any = None):
+
+        """! Add an event, safe to call from any thread
+
+        @param  kind    EVENT_BUTTON, EVENT_FIELD or EVENT_ENGINE.
+        @param  source  Pin or engine the event came from.
+        @param  data    Optional payload.
+        """
+
+        self._events.append(Event(kind, source, data))
+        self._posted.set()
+
+    def next(self) -> Optional[Event]:
+
+        """! Take the oldest event
+
+        @return     The event, or None if the bus is empty.
+        """
+
+        try:
+            return self._events.popleft()
+        except IndexError:
+            self._posted.clear()
+            return None
+
+    def wait(self, timeout: float) -> bool:
+
+        """! Wait for an event to be posted
+
+        @param  timeout     Max seconds to wait.
+
+        @return             True if an event is waiting.
+        """
+
+        if self._events:
+            return True
+        return self._posted.wait(timeout)
+
+    def clear(self):
+
+        """! Drop all queued events, e.g. the presses of a reset """
+
+        self._events.clear()
+
+    def __len__(self) -> int:
+        return len(self._events)
@@ -0,0 +1,187 @@
+"""! @brief     Live state streaming for spectator displays
+
+    The game publishes its state (FSM state, occupancy mask, move list and
+    evaluation) every loop iteration. Publishing only compares the values
+    with the last ones and queues a delta when something changed, the HTTP
+    server runs in its own threads so slow spectators never block the board.
+
+    Endpoints (Server-Sent Events and JSON):
+
+        /events[/<board>]   "snapshot" event on connect, then "delta" events
+        /state[/<board>]    current snapshot
+
+    There is no authentication, so the server only listens on localhost
+    unless the board is started with e.g. --live_bind 0.0.0.0.
+"""
+
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+LIVE_KEEPALIVE_TIME = 15        # sec
+LIVE_SUBSCRIBER_QUEUE = 256     # Max pending deltas before a subscriber is dropped
+
+
+class LiveState:
+
+    """! @brief     Published state of one board with delta fan-out to subscribers """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+        self._sequence = 0
+        self._subscribers: List[queue.Queue] = []
+
+    def publish(self, **fields):
+
+        """! Publish the current values, subscribers get only the changed ones
+
+        @param  fields  The state values, must be JSON serializable.
+        """
+
+        delta = {}
+        for key, value in fields.items():
+            if self._state.get(key) != value:
+                delta[key] = list(value) if isinstance(value, list) else value
+
+        if not delta:
+            return
+
+        with self._lock:
+            self._state.update(delta)
+            self._sequence += 1
+            message = {"seq": self._sequence, **delta}
+            for subscriber in list(self._subscribers):
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # Too slow, drop it and let the client reconnect for a new snapshot
+                    self._subscribers.remove(subscriber)
+                    subscriber.put(None)
+
+    def snapshot(self) -> dict:
+
+        """! Full state with the current sequence number """
+
+        with self._lock:
+            return {"seq": self._sequence, **self._state}
+
+    def subscribe(self):
+
+        """! Subscribe to deltas
+
+        @return     (snapshot, queue) the queue yields deltas after the snapshot, None when dropped.
+        """
+
+        subscriber = queue.Queue(LIVE_SUBSCRIBER_QUEUE)
+        with self._lock:
+            self._subscribers.append(subscriber)
+            return {"seq": self._sequence, **self._state}, subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+
+class LiveRequestHandler(BaseHTTPRequestHandler):
+
+    """! @brief     Serves snapshots and the SSE stream """
+
+    def _live_state(self, path: str):
+        boards: Dict[str, LiveState] = self.server.boards
+        name = path.strip("/").partition("/")[2]
+        if name:
+            return boards.get(name)
+        return next(iter(boards.values()), None)
+
+    def _send_json(self, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_event(self, event: str, data: dict):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+        self.wfile.flush()
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        live_state = self._live_state(path)
+
+        if live_state is None:
+            self.send_error(404)
+        elif path.startswith("/state"):
+            self._send_json(live_state.snapshot())
+        elif path.startswith("/events"):
+            self._stream(live_state)
+        else:
+            self.send_error(404)
+
+    def _stream(self, live_state: LiveState):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+        snapshot, subscriber = live_state.subscribe()
+        try:
+            self._send_event("snapshot", snapshot)
+            while True:
+                try:
+                    delta = subscriber.get(timeout=LIVE_KEEPALIVE_TIME)
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+                if delta is None:
+                    break
+                self._send_event("delta", delta)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            live_state.unsubscribe(subscriber)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LiveServer:
+
+    """! @brief     Background HTTP server for the live state of one or more boards """
+
+    def __init__(self, port: int, host: str = "127.0.0.1"):
+
+        """! The Contructor
+
+        @param  port    TCP port to listen on.
+        @param  host    Interface to bind to.
+        """
+
+        self._server = ThreadingHTTPServer((host, port), LiveRequestHandler)
+        self._server.daemon_threads = True
+        self._server.boards = {}
+        self._thread = threading.Thread(target=self._server.serve_forever, name="live-server", daemon=True)
+        self._thread.start()
+
+    def add_board(self, name: str) -> LiveState:
+
+        """! Create the published state for a board
+
+        @param  name    Board name, used in the URL.
+
+        @return         LiveState to publish to.
+        """
+
+        live_state = LiveState()
+        self._server.boards[name] = live_state
+        return live_state
+
+    def shutdown(self):
+        self._server.shutdown()
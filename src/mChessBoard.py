@@ -1,11 +1,27 @@
 import argparse
+import json
+import os
+import threading
 import time
 from signal import signal, SIGINT
 import sys
 import RPi.GPIO as GPIO
 
 from statemachine import StateMachine, State
-from stockfish import Stockfish  # https://pypi.org/project/stockfish/ edited to fit for Minic
+from stockfish import Stockfish, SearchHandle  # https://pypi.org/project/stockfish/ edited to fit for Minic
+from book import PolyglotBook
+from tablebase import open_tablebase
+from analysisdb import open_analysis_db
+from clock import ChessClock
+from scheduler import EngineScheduler
+from live import LiveServer
+from events import EventBus, EVENT_BUTTON, EVENT_ENGINE, EVENT_FIELD
+from resources import RESOURCE_POLICIES, host_resources, plan_resources, process_rss
+from difficulty import DIFFICULTY_MAX, DIFFICULTY_MIN, difficulty_parameters, full_strength_parameters
+from profiler import PROFILE_INTERVAL, SamplingProfiler
+from sensortrace import TRACE_BUTTON, TRACE_BUTTONS, TRACE_FIELD, TraceRecorder
+import chess
+import chess.polyglot
 from pcf8575 import PCF8575  # https://pypi.org/project/pcf8575/
 
 APP_TITLE = "mChessBoard"
@@ -13,29 +29,20 @@ AUTHOR = "by Mick Kirkegaard"
 VERSION = "v1.0.0"
 DATE = "Jan 01 2021 19:01"
 
-"""! @brief     Stockfish default parameters """
-
-DEFAULT_STOCKFISH_PARAMS = {
-    "Write Debug Log": "false",
-    "Contempt": 0,
-    "Min Split Depth": 0,
-    "Threads": 1,
-    "Ponder": "false",
-    "Hash": 16,
-    "MultiPV": 1,
-    "Skill Level": 20,
-    "Move Overhead": 30,
-    "Minimum Thinking Time": 20,
-    "Slow Mover": 80,
-    "UCI_Chess960": "false",
-    'UCI_LimitStrength': 'false',
-}
-
 """! @brief     Play defines """
-MCB_PLAY_DIFF_MAX = 8
-MCB_PLAY_DIFF_MIN = 0
+MCB_PLAY_DIFF_MAX = DIFFICULTY_MAX
+MCB_PLAY_DIFF_MIN = DIFFICULTY_MIN
 MCB_PLAY_AI_LED_TOGGLE_TIME = 0.5  # sec
 MCB_PLAY_CHECKMATE_LED_TOGGLE_TIME = 0.2  # sec
+MCB_ENGINE_TIMEOUT = 30  # sec, a silent engine is restarted and the query retried
+MCB_LOOP_IDLE_TIME = 0.01  # sec, max wait for input between loop iterations
+MCB_AI_EVENT_SOURCE = "ai"  # Event source of a finished hint/AI search
+MCB_RESYNC_GRACE_TIME = 1.5  # sec, a board/position mismatch must last this long before resync
+MCB_RESYNC_HISTORY = 6  # Plies back to look for a position matching the board
+MCB_RESYNC_LED_TOGGLE_TIME = 0.5  # sec
+MCB_TICK_BUDGET = 0.05  # sec, a state tick taking longer is counted as an overrun
+MCB_ENGINE_TICK_BUDGET = 0.5  # sec, budget of the states which query the engines
+MCB_SETUP_TICK_BUDGET = 1.5  # sec, setup waits a second with all LEDs on when done
 
 """! @brief     Board defines """
 MCB_I2C_PORT_NUM = 1
@@ -52,21 +59,46 @@ MCB_BUT_BLACK = 22  # Closest to BLACK side
 MCB_BUT_DEBOUNCE = 200  # Button debounce
 MCB_FIELD_DEBOUNCE = 50  # Field debounce
 
-"""! @brief     Board fields and leds"""
-pcf_row_ab = PCF8575(MCB_I2C_PORT_NUM, MCB_I2C_ROW_AB_ADDRESS)
-pcf_row_cd = PCF8575(MCB_I2C_PORT_NUM, MCB_I2C_ROW_CD_ADDRESS)
-pcf_row_ef = PCF8575(MCB_I2C_PORT_NUM, MCB_I2C_ROW_EF_ADDRESS)
-pcf_row_gh = PCF8575(MCB_I2C_PORT_NUM, MCB_I2C_ROW_GH_ADDRESS)
-pcf_leds = PCF8575(MCB_I2C_PORT_NUM, MCB_I2C_LEDS_ADDRESS)
-
 MCB_ROW_AB_IO = 6
 MCB_ROW_CD_IO = 13
 MCB_ROW_EF_IO = 19
 MCB_ROW_GH_IO = 26
 
+"""! @brief     Default board hardware configuration (overridden per board in host mode) """
+DEFAULT_BOARD_CONFIG = {
+    "name": "board",
+    "priority": 1,
+    "port": MCB_I2C_PORT_NUM,
+    "row_ab_address": MCB_I2C_ROW_AB_ADDRESS,
+    "row_cd_address": MCB_I2C_ROW_CD_ADDRESS,
+    "row_ef_address": MCB_I2C_ROW_EF_ADDRESS,
+    "row_gh_address": MCB_I2C_ROW_GH_ADDRESS,
+    "leds_address": MCB_I2C_LEDS_ADDRESS,
+    "but_white": MCB_BUT_WHITE,
+    "but_confirm": MCB_BUT_CONFIRM,
+    "but_back": MCB_BUT_BACK,
+    "but_black": MCB_BUT_BLACK,
+    "row_ab_io": MCB_ROW_AB_IO,
+    "row_cd_io": MCB_ROW_CD_IO,
+    "row_ef_io": MCB_ROW_EF_IO,
+    "row_gh_io": MCB_ROW_GH_IO,
+}
+
+MCB_EVAL_ENGINE_PATH = "/home/pi/mChessBoard/src/stockfish-12_linux_x32_armv6"
+MCB_HOST_REPORT_TIME = 60  # sec
+
 """! @brief     Global variables """
 debug_msg = "    debug: "
 
+def valid_fen(text: str) -> str:
+    """! @brief     Argument type for a FEN position """
+
+    try:
+        chess.Board(text)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(f"invalid fen: {err}")
+    return text
+
 def parser():
     """! @brief     Parser function to get all the arguments """
 
@@ -78,24 +110,106 @@ def parser():
     args = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter, description=description)
 
     args.add_argument("-i", "--input", type=str, default="/home/pi/mChessBoard/src/minic_3.04_linux_x32_armv6",
-                        help="path to ai engine")
+                        help="path to ai engine, or tcp://host:port / unix:///path of an engine_server.py")
+    args.add_argument("-b", "--book", type=str, default="/home/pi/mChessBoard/src/book.bin",
+                        help="path to polyglot opening book (skipped if missing)")
+    args.add_argument("--book_depth", type=int, default=30,
+                        help="max number of plies to look up in the opening book")
+    args.add_argument("-t", "--tablebase", type=str, default="/home/pi/mChessBoard/src/syzygy",
+                        help="path to syzygy tablebase directory (skipped if missing)")
+    args.add_argument("--tablebase_pieces", type=int, default=5,
+                        help="max number of pieces to probe the tablebase with")
+    args.add_argument("--analysis_db", type=str, default="/home/pi/mChessBoard/src/analysis.db",
+                        help="sqlite database of analysed positions, shared with batch.py (\"\" to disable)")
+    args.add_argument("--think", type=str, default="depth", choices=["depth", "movetime", "nodes", "clock"],
+                        help="how the ai engine limits its search")
+    args.add_argument("--movetime", type=int, default=2000,
+                        help="ai think time in ms for 'movetime', and hard cap for 'clock'")
+    args.add_argument("--nodes", type=int, default=20000,
+                        help="ai node budget for 'nodes'")
+    args.add_argument("--clock", type=float, default=10,
+                        help="starting time on each clock in minutes")
+    args.add_argument("--increment", type=float, default=0,
+                        help="clock increment per move in seconds")
+    args.add_argument("--host", type=str, default="",
+                        help="json config to drive several boards with a shared engine pool")
+    args.add_argument("--host_report", type=float, default=MCB_HOST_REPORT_TIME,
+                        help="seconds between engine queue reports in host mode")
+    args.add_argument("--live", type=int, default=0,
+                        help="port for the live state http/sse endpoint (0 to disable)")
+    args.add_argument("--live_bind", type=str, default="127.0.0.1",
+                        help="interface for the live state endpoint, 0.0.0.0 to serve the network (no authentication)")
+    args.add_argument("--analysis", type=int, default=0,
+                        help="number of lines for background analysis on the eval engine (0 to disable)")
+    args.add_argument("--fen", type=valid_fen, default=chess.STARTING_FEN,
+                        help="position to set up and play from, e.g. to resume a game or load a puzzle")
+    args.add_argument("--resources", type=str, default="balanced", choices=RESOURCE_POLICIES,
+                      help="how Threads/Hash are split between the ai and eval engine (see resources.py)")
+    args.add_argument("--engine_timeout", type=float, default=MCB_ENGINE_TIMEOUT,
+                        help="seconds without engine output before the engine is restarted")
     args.add_argument("-d", "--debug", action='store_true',
                         help="debug printout")
+    args.add_argument("--no_prefetch", action='store_true',
+                        help="don't compute the hint/AI move in the background before confirm is pressed")
+    args.add_argument("--single_engine", action='store_true',
+                        help="one ai engine process also evaluates, for boards with little memory")
+    args.add_argument("--profile", type=str, default="",
+                        help="sample the game loop per state and write flamegraph collapsed stacks (and a .summary) to this file on CTRL-C")
+    args.add_argument("--profile_interval", type=float, default=PROFILE_INTERVAL,
+                        help="ms between profile samples")
+    args.add_argument("--trace", type=str, default="",
+                        help="record the sensor input to this file for replay.py (.<board name> appended in host mode)")
     args.add_argument("-a", "--auto_confirm", action='store_true',
                         help="auto confirm movement of pieces")
     args.add_argument('--version', action='version', version=APP_TITLE + " " + VERSION + " " + DATE + " " + AUTHOR)
 
-    print('\n' + str(args.parse_args()) + '\n')
+    parsed = args.parse_args()
+    print('\n' + str(parsed) + '\n')
 
-    return args.parse_args()
+    if parsed.single_engine and parsed.host:
+        args.error("--single_engine is for one board, the --host engine pool is shared already")
+
+    return parsed
 
 
 class ChessBoard(StateMachine):
 
 
-    def __init__(self):
+    def __init__(self, config: dict = None):
 
-        """! The Contructor """
+        """! The Contructor 
+        
+        @param  config  Hardware configuration, keys as in DEFAULT_BOARD_CONFIG.
+        """
+
+        config = {**DEFAULT_BOARD_CONFIG, **(config or {})}
+        self.name = config["name"]
+        self.priority = config["priority"]
+
+        # Board fields and leds
+        self.pcf_row_ab = PCF8575(config["port"], config["row_ab_address"])
+        self.pcf_row_cd = PCF8575(config["port"], config["row_cd_address"])
+        self.pcf_row_ef = PCF8575(config["port"], config["row_ef_address"])
+        self.pcf_row_gh = PCF8575(config["port"], config["row_gh_address"])
+        self.pcf_leds = PCF8575(config["port"], config["leds_address"])
+
+        # Button and field interrupt pins
+        self.but_white = config["but_white"]
+        self.but_confirm = config["but_confirm"]
+        self.but_back = config["but_back"]
+        self.but_black = config["but_black"]
+        self.row_ab_io = config["row_ab_io"]
+        self.row_cd_io = config["row_cd_io"]
+        self.row_ef_io = config["row_ef_io"]
+        self.row_gh_io = config["row_gh_io"]
+
+        # Field interrupt pin -> (expander, first file), to read only the expander which changed
+        self.row_pairs = {
+            self.row_ab_io: (self.pcf_row_ab, 0),
+            self.row_cd_io: (self.pcf_row_cd, 2),
+            self.row_ef_io: (self.pcf_row_ef, 4),
+            self.row_gh_io: (self.pcf_row_gh, 6),
+        }
         
         # Initialize all fields to False
         default = [False] * 8
@@ -110,101 +224,89 @@ class ChessBoard(StateMachine):
         #self.fen_board_prev = self.fen_board_current
         #self.fen_board_history = [self.fen_board_current]
 
-        # Default board setup (False == Place piece)
-        self.setup = [False, False, True, True, True, True, False, False]
-        self.board_setup = [self.setup] * 8
+        # Occupancy mask, bit (rank * 8 + file) is set when a piece is on the field
+        self.occupancy = 0
+
+        # Input events, posted by the GPIO callbacks and the engines
+        self.bus = EventBus()
+        self.buttons_enabled = False
+        self.fields_enabled = False
 
-        # Event history
-        self.events = []
+        # Input trace, set by TraceRecorder.attach (--trace)
+        self.trace = None
 
         # Set all inputs high on init
-        pcf_row_ab.port = pcf_row_cd.port = pcf_row_ef.port = pcf_row_gh.port = [True] * 16
+        self.pcf_row_ab.port = self.pcf_row_cd.port = self.pcf_row_ef.port = self.pcf_row_gh.port = [True] * 16
 
         # Setup GPIO pin mode
         GPIO.setmode(GPIO.BCM)
 
         # Init buttons pin mode
-        GPIO.setup(MCB_BUT_WHITE, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(MCB_BUT_CONFIRM, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(MCB_BUT_BACK, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(MCB_BUT_BLACK, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.setup(self.but_white, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.setup(self.but_confirm, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.setup(self.but_back, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.setup(self.but_black, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 
         # Init fields pin mode
-        GPIO.setup(MCB_ROW_AB_IO, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(MCB_ROW_CD_IO, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(MCB_ROW_EF_IO, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(MCB_ROW_GH_IO, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.setup(self.row_ab_io, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.setup(self.row_cd_io, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.setup(self.row_ef_io, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.setup(self.row_gh_io, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+
+        # The callbacks stay registered, add/remove_*_events only enable them,
+        # so re-enabling never drops or reorders input
+        for pin in (self.but_white, self.but_confirm, self.but_back, self.but_black):
+            GPIO.add_event_detect(pin, GPIO.FALLING, callback=self._button_callback, bouncetime=MCB_BUT_DEBOUNCE)
+        for pin in self.row_pairs:
+            GPIO.add_event_detect(pin, GPIO.FALLING, callback=self._field_callback, bouncetime=MCB_FIELD_DEBOUNCE)
 
     def _button_callback(self, channel):
         
         """! Event callback to save events """
 
-        if args.debug: print(f"{debug_msg}event: {channel}")
+        if self.trace:
+            held = [not GPIO.input(getattr(self, name)) for name in TRACE_BUTTONS] # The reset check reads them
+            self.trace.write(TRACE_BUTTON, channel, sum(1 << i for i, down in enumerate(held) if down))
 
-    def event_detected(self, channel):
+        if self.buttons_enabled:
+            self.bus.post(EVENT_BUTTON, channel)
+            if args.debug: print(f"{debug_msg}event: {channel}")
 
-        """! My own event detected method, since the GPIO.RPi sucks """
+    def _field_callback(self, channel):
 
-        if channel in self.events:
-            self.events.remove(channel)
-            return True
+        """! Event callback for the field interrupts """
 
-        return False
+        if self.trace:
+            self.trace.write(TRACE_FIELD, channel, 0)
+
+        if self.fields_enabled:
+            self.bus.post(EVENT_FIELD, channel)
 
     def add_button_events(self):
 
         """! Add events to all buttons """
-        
-        # Remove the events before adding them again
-        self.remove_button_events()
-
-        # Small delay
-        #time.sleep(0.5)
 
-        # Add button events
-        #GPIO.add_event_detect(MCB_BUT_WHITE, GPIO.FALLING, bouncetime=MCB_BUT_DEBOUNCE)
-        #GPIO.add_event_detect(MCB_BUT_CONFIRM, GPIO.FALLING, bouncetime=MCB_BUT_DEBOUNCE)
-        #GPIO.add_event_detect(MCB_BUT_BACK, GPIO.FALLING, bouncetime=MCB_BUT_DEBOUNCE)
-        #GPIO.add_event_detect(MCB_BUT_BLACK, GPIO.FALLING, bouncetime=MCB_BUT_DEBOUNCE)
-
-        # Checker
-        GPIO.add_event_detect(MCB_BUT_WHITE, GPIO.FALLING, callback=self._button_callback, bouncetime=MCB_BUT_DEBOUNCE)
-        GPIO.add_event_detect(MCB_BUT_CONFIRM, GPIO.FALLING, callback=self._button_callback, bouncetime=MCB_BUT_DEBOUNCE)
-        GPIO.add_event_detect(MCB_BUT_BACK, GPIO.FALLING, callback=self._button_callback, bouncetime=MCB_BUT_DEBOUNCE)
-        GPIO.add_event_detect(MCB_BUT_BLACK, GPIO.FALLING, callback=self._button_callback, bouncetime=MCB_BUT_DEBOUNCE)
+        self.buttons_enabled = True
 
     def remove_button_events(self):
 
-        """! Remove events from all buttons """
+        """! Remove events from all buttons, presses are ignored until they are added again """
 
-        GPIO.remove_event_detect(MCB_BUT_WHITE)
-        GPIO.remove_event_detect(MCB_BUT_CONFIRM)
-        GPIO.remove_event_detect(MCB_BUT_BACK)
-        GPIO.remove_event_detect(MCB_BUT_BLACK)
+        self.buttons_enabled = False
 
 
     def add_field_events(self):
 
         """! Add events to all chess fields """
 
-        # Remove the events before adding them again
-        self.remove_field_events()
-
-        # Add field events
-        GPIO.add_event_detect(MCB_ROW_AB_IO, GPIO.FALLING, bouncetime=MCB_FIELD_DEBOUNCE)
-        GPIO.add_event_detect(MCB_ROW_CD_IO, GPIO.FALLING, bouncetime=MCB_FIELD_DEBOUNCE)
-        GPIO.add_event_detect(MCB_ROW_EF_IO, GPIO.FALLING, bouncetime=MCB_FIELD_DEBOUNCE)
-        GPIO.add_event_detect(MCB_ROW_GH_IO, GPIO.FALLING, bouncetime=MCB_FIELD_DEBOUNCE)
+        self.fields_enabled = True
 
 
     def remove_field_events(self):
 
-        """! Remove events from all chess fields """
+        """! Remove events from all chess fields, changes are ignored until they are added again """
 
-        GPIO.remove_event_detect(MCB_ROW_AB_IO)
-        GPIO.remove_event_detect(MCB_ROW_CD_IO)
-        GPIO.remove_event_detect(MCB_ROW_EF_IO)
-        GPIO.remove_event_detect(MCB_ROW_GH_IO)
+        self.fields_enabled = False
 
 
     def startup_leds(self, delay):
@@ -254,18 +356,55 @@ class ChessBoard(StateMachine):
         """! Read all the chess fields and save the current value """
 
         # Read the PCF8575 boards (this is done with the assumption that a1 = p00 etc. reason for reversion)
-        self.a = [i for i in pcf_row_ab.port][8:][::-1]
-        self.b = [i for i in pcf_row_ab.port][:8][::-1]
-        self.c = [i for i in pcf_row_cd.port][8:][::-1]
-        self.d = [i for i in pcf_row_cd.port][:8][::-1]
-        self.e = [i for i in pcf_row_ef.port][8:][::-1]
-        self.f = [i for i in pcf_row_ef.port][:8][::-1]
-        self.g = [i for i in pcf_row_gh.port][8:][::-1]
-        self.h = [i for i in pcf_row_gh.port][:8][::-1]
+        self.a = [i for i in self.pcf_row_ab.port][8:][::-1]
+        self.b = [i for i in self.pcf_row_ab.port][:8][::-1]
+        self.c = [i for i in self.pcf_row_cd.port][8:][::-1]
+        self.d = [i for i in self.pcf_row_cd.port][:8][::-1]
+        self.e = [i for i in self.pcf_row_ef.port][8:][::-1]
+        self.f = [i for i in self.pcf_row_ef.port][:8][::-1]
+        self.g = [i for i in self.pcf_row_gh.port][8:][::-1]
+        self.h = [i for i in self.pcf_row_gh.port][:8][::-1]
 
         # Update current board
         self.board_current = [self.a, self.b, self.c, self.d, self.e, self.f, self.g, self.h]
 
+        # Update occupancy mask (False == piece on the field)
+        occupancy = 0
+        for file, column in enumerate(self.board_current):
+            for rank, free in enumerate(column):
+                if not free:
+                    occupancy |= 1 << (rank * 8 + file)
+        self.occupancy = occupancy
+
+
+    def read_row(self, io: int):
+
+        """! Read the two files of one field interrupt and update the occupancy incrementally
+
+        @param  io  The field interrupt pin which fired.
+
+        @return     Mask of the fields which changed.
+        """
+
+        pcf, file = self.row_pairs[io]
+        port = [i for i in pcf.port] # The port reads a pin per index and takes no slices, so take a snapshot
+
+        # Same order as read_fields, copied so board_prev keeps the old files
+        self.board_current = list(self.board_current)
+        self.board_current[file] = port[8:][::-1]
+        self.board_current[file + 1] = port[:8][::-1]
+        self.a, self.b, self.c, self.d, self.e, self.f, self.g, self.h = self.board_current
+
+        occupancy = self.occupancy & ~(chess.BB_FILES[file] | chess.BB_FILES[file + 1])
+        for column in (file, file + 1):
+            for rank, free in enumerate(self.board_current[column]):
+                if not free:
+                    occupancy |= 1 << (rank * 8 + column)
+
+        changed = occupancy ^ self.occupancy
+        self.occupancy = occupancy
+        return changed
+
 
     def get_field_event(self):
 
@@ -289,7 +428,7 @@ class ChessBoard(StateMachine):
                     if args.debug: print(f"{debug_msg}field changed: {field_value} -> [{self.board_current[letter][digit]}]")
 
         if field_value != "":
-            board.board_prev = board.board_current
+            self.board_prev = self.board_current
 
         return field_value
 
@@ -464,24 +603,42 @@ class ChessBoard(StateMachine):
         return False
 
 
-    def set_setup_leds(self):
+    def set_setup_leds(self, mismatch: int, target: int, toggle: bool):
 
-        """! Setup/missing piece led indicators """
+        """! Setup/missing piece led indicators
 
-        # Read all fields
-        self.read_fields()
+        The file and rank LEDs can only show one field, so the first wrong field
+        is lit: steady to place a piece there, flashing to remove the piece.
+
+        @param  mismatch    Mask of the fields which differ from the setup.
+        @param  target      Occupancy mask of the setup.
+        @param  toggle      Flash phase.
+        """
+
+        if not mismatch:
+            self.set_leds("")
+            return
+
+        field = chess.lsb(mismatch)
+        place = target & (1 << field)
+        self.set_leds(chess.square_name(field) if place or toggle else "")
 
-        # Declare a string for holding the chars to indicate which a-h rows are missing a piece
-        setup_leds = ""
-        setup_leds = setup_leds + "a" if board.a == board.setup else setup_leds.replace("a", "")
-        setup_leds = setup_leds + "b" if board.b == board.setup else setup_leds.replace("b", "")
-        setup_leds = setup_leds + "c" if board.c == board.setup else setup_leds.replace("c", "")
-        setup_leds = setup_leds + "d" if board.d == board.setup else setup_leds.replace("d", "")
-        setup_leds = setup_leds + "e" if board.e == board.setup else setup_leds.replace("e", "")
-        setup_leds = setup_leds + "f" if board.f == board.setup else setup_leds.replace("f", "")
-        setup_leds = setup_leds + "g" if board.g == board.setup else setup_leds.replace("g", "")
-        setup_leds = setup_leds + "h" if board.h == board.setup else setup_leds.replace("h", "")
-        board.set_leds(setup_leds)
+
+    def set_preview_leds(self, field: str, destinations: int, step: int):
+
+        """! Legal destinations of a lifted piece
+
+        The file and rank LEDs can only show one field, so the destinations are
+        lit one at a time, the next one every step. A piece which can't move
+        (or a piece of the other side, lifted to take it) lights its own field.
+
+        @param  field           The lifted field, e.g. "e2".
+        @param  destinations    Square mask of the destinations.
+        @param  step            Number of steps since the piece was lifted.
+        """
+
+        squares = list(chess.SquareSet(destinations))
+        self.set_leds(chess.square_name(squares[step % len(squares)]) if squares else field)
 
 
     def set_leds(self, led: str):
@@ -510,7 +667,17 @@ class ChessBoard(StateMachine):
                     port[pin] = False
 
         # Finally set the leds
-        pcf_leds.port = port
+        self.pcf_leds.port = port
+
+
+    def set_square_leds(self, squares: int):
+
+        """! Light the file and rank of every square in a mask
+
+        @param  squares     Square mask, bit (rank * 8 + file) as the occupancy mask.
+        """
+
+        self.set_leds("".join(chess.square_name(square) for square in chess.SquareSet(squares)))
 
 
     def set_difficulty_leds(self, difficulty: int):
@@ -587,6 +754,23 @@ class ChessBoard(StateMachine):
         print(f"+---+---+---+---+---+---+---+---+     {sf[544:577]}")
 
 
+class StateHandler:
+
+    """! @brief     Callbacks and tick statistics of one FSM state """
+
+    __slots__ = ("on_tick", "on_enter", "on_exit", "budget", "ticks", "total", "worst", "overruns")
+
+    def __init__(self, on_tick, on_enter, on_exit, budget: float):
+        self.on_tick = on_tick
+        self.on_enter = on_enter
+        self.on_exit = on_exit
+        self.budget = budget
+        self.ticks = 0              ### Ticks run
+        self.total = 0.0            ### Seconds spent in ticks
+        self.worst = 0.0            ### Longest tick in seconds
+        self.overruns = 0           ### Ticks over the budget
+
+
 class ChessBoardFsm(StateMachine):
 
     """! @brief     Finite State Machine Class """
@@ -602,591 +786,1319 @@ class ChessBoardFsm(StateMachine):
     checkmate = State("Checkmate")
     pawn_promotion = State("PawnPromotion")
     undo_move = State('Undo')
+    resync = State('Resync')
 
     # Initialize all transitions allowed
-    go_to_init = difficulty.to(init) | setup.to(init) | human_move.to(init) | ai_move.to(init) | checkmate.to(init) | pawn_promotion.to(init) | undo_move.to(init) | mode.to(init)
+    go_to_init = difficulty.to(init) | setup.to(init) | human_move.to(init) | ai_move.to(init) | checkmate.to(init) | pawn_promotion.to(init) | undo_move.to(init) | mode.to(init) | resync.to(init)
     go_to_mode = init.to(mode)
     go_to_human_color = mode.to(human_color)
     go_to_difficulty = human_color.to(difficulty)
     go_to_setup = difficulty.to(setup)
     go_to_ai_move = setup.to(ai_move) | human_move.to(ai_move) | pawn_promotion.to(ai_move)
-    go_to_human_move = setup.to(human_move) | ai_move.to(human_move) | undo_move.to(human_move) | pawn_promotion.to(human_move)
+    go_to_human_move = setup.to(human_move) | ai_move.to(human_move) | undo_move.to(human_move) | pawn_promotion.to(human_move) | resync.to(human_move)
     go_to_checkmate = human_move.to(checkmate) | ai_move.to(checkmate)
     go_to_pawn_promotion = human_move.to(pawn_promotion) | ai_move.to(pawn_promotion)
     go_to_undo_move = human_move.to(undo_move) | ai_move.to(undo_move)
+    go_to_resync = human_move.to(resync)
 
+    def __init__(self):
 
-def signal_handler(sig, frame):
+        """! The Contructor """
 
-    """! @brief    Exit function """
+        super().__init__()
+        self.handlers = {}          ### State id -> StateHandler
+        self.active = None          ### State whose handler ran last
+        self.prev_state = None      ### State before the current one
 
-    print(' SIGINT or CTRL-C detected. Exiting gracefully')
-    GPIO.cleanup()
-    board.set_leds("")
-    sys.exit(0)
+    def add_handler(self, state: State, on_tick, on_enter=None, on_exit=None, budget: float = MCB_TICK_BUDGET):
 
+        """! @brief    Register the callbacks of a state
 
-if __name__ == "__main__":
+        @param state        The state.
+        @param on_tick      Called every loop iteration while in the state.
+        @param on_enter     Called once when the state is entered, or None.
+        @param on_exit      Called once when the state is left, or None.
+        @param budget       Seconds a tick may take before it counts as an overrun.
+        """
 
-    """! @brief    Main function """
+        self.handlers[state.identifier] = StateHandler(on_tick, on_enter, on_exit, budget)
 
-    # CTRL+C handler
-    signal(SIGINT, signal_handler)
+    def dispatch(self):
 
-    # Create a FSM object
-    fsm = ChessBoardFsm()
+        """! @brief    Run the handler of the current state
 
-    # Create a Board object
-    board = ChessBoard()
+        @info   A state change since the last dispatch runs on_exit of the old state and on_enter
+                of the new one first. If on_enter changes the state again, the tick is left for
+                the next dispatch, which enters that state.
+        """
 
-    # Parse arguments
-    args = parser()
+        state = self.current_state
+        if state is not self.active:
+            if self.active is not None and self.handlers[self.active.identifier].on_exit:
+                self.handlers[self.active.identifier].on_exit()
+            print(f"STATE: {state.identifier}")
+            self.prev_state = self.active
+            self.active = state
+            handler = self.handlers[state.identifier]
+            if handler.on_enter:
+                handler.on_enter()
+                if self.current_state is not state:
+                    return
 
-    # Flags & Variables
-    initial = True
-    first_entry = True
-    prev_state = None
-    current_state = None
-
-    # Movement global variables and flags
-    move_ai = ""                ### Move made by AI Engine
-    move_human = ""             ### Move made by Human
-    move_undo = ""              ### Move made by Undo
-    move_promotion = ""         ### Move made by Promotion
-    moves = []                  ### List of moves for engine
-    play_difficulty = 1         ### Default difficulty
-
-    mode_setting = 0            ### Default mode setting 0: Human vs AI, 1: Human vs. Human
-    mode_human_color = 'white'  ### Default Human color
-
-    # Evaluation Engine Setup
-    stockfish = None
-    stockfish_param = {
-        "Write Debug Log": "false",
-        "Contempt": 0,
-        "Min Split Depth": 0,
-        "Threads": 1,
-        "Ponder": "false",
-        "Hash": 16,
-        "MultiPV": 1,
-        "Skill Level": 20,
-        "Move Overhead": 30,
-        "Minimum Thinking Time": 20,
-        "Slow Mover": 80,
-        "UCI_Chess960": "false",
-    }
-
-    # AI Engine setup
-    ai = None
-    ai_parameters = {
-        "Write Debug Log": "false",
-        "Contempt": 0,
-        "Min Split Depth": 0,
-        "Threads": 1,
-        "Ponder": "false",
-        "Hash": 16,
-        "MultiPV": 1,
-        "Skill Level": 20,
-        "Move Overhead": 30,
-        "Minimum Thinking Time": 20,
-        "Slow Mover": 80,
-        "UCI_Chess960": "false",
-    }
-
-    # Main loop
-    while True:
+        handler = self.handlers[state.identifier]
+        start = time.perf_counter()
+        handler.on_tick()
+        elapsed = time.perf_counter() - start
 
-        # Set flag if the state has changed
-        first_entry = initial or (current_state != fsm.current_state)
+        handler.ticks += 1
+        handler.total += elapsed
+        handler.worst = max(handler.worst, elapsed)
+        if elapsed > handler.budget:
+            handler.overruns += 1
+            if args.debug: print(f"{debug_msg}{state.identifier} tick took {elapsed * 1000:.1f} ms "
+                                 f"(budget {handler.budget * 1000:.0f} ms)")
 
-        if first_entry:
-            prev_state = current_state
-            current_state = fsm.current_state    
+    def report(self) -> str:
 
-        if fsm.is_init:
+        """! @brief    Tick time per state, for finding the states that stall the loop """
 
-            """! @brief Init the chess board """
+        lines = ["state            ticks   mean ms   worst ms   overruns"]
+        for identifier, handler in self.handlers.items():
+            if handler.ticks:
+                lines.append(f"{identifier:15} {handler.ticks:6} {handler.total / handler.ticks * 1000:9.2f} "
+                             f"{handler.worst * 1000:10.2f} {handler.overruns:10}")
 
-            if first_entry:
+        return "\n".join(lines)
 
-                print(f"STATE: {fsm.current_state.identifier}")
-                
-                move_ai = "" # Reset AI move instance
-                move_human = "" # Reset Human move instance
-                moves = [] # Reset moves list
-                board.add_button_events() # Add button events (delays the setup init)
-                board.startup_leds(0.05) # Run the LEDs in a startup sequence
 
-            fsm.go_to_mode() # Set next state
+class LegalMoveIndex:
 
-        elif fsm.is_mode:
+    """! @brief     Legal moves of a position indexed by square, built once per ply
 
-            if first_entry:
+    Answers the questions the board asks while a piece is moved without an
+    engine query: where can the lifted piece go, and is a move legal.
+    """
 
-                print(f"STATE: {fsm.current_state.identifier}")
+    __slots__ = ("moves", "destinations")
 
-                mode_setting = 0 # Reset mode
+    def __init__(self, position: chess.Board):
 
-                board.set_leds('4') # Set LED indicator
-            
-            if mode_setting == 1:
-                
-                if (GPIO.event_detected(MCB_BUT_BLACK) or GPIO.event_detected(MCB_BUT_WHITE)):
+        """! The Contructor
+
+        @param  position    The current position.
+        """
 
-                    if args.debug: print(f"{debug_msg}human vs ai")
-                    mode_setting = 0    # Human vs AI
-                    board.set_leds('4') # Set LED indicator
+        self.moves = set()          ### Legal moves in UCI
+        self.destinations = {}      ### From square -> mask of the squares it can move to
 
-                elif GPIO.event_detected(MCB_BUT_CONFIRM):
+        for move in position.legal_moves:
+            self.moves.add(move.uci())
+            self.destinations[move.from_square] = self.destinations.get(move.from_square, 0) | chess.BB_SQUARES[move.to_square]
 
-                    fsm.go_to_difficulty() # Change state
+    def preview(self, field: str) -> int:
 
-            elif mode_setting == 0:
+        """! Squares to show when a piece is lifted
 
-                if (GPIO.event_detected(MCB_BUT_BLACK) or GPIO.event_detected(MCB_BUT_WHITE)):
+        @param  field   The lifted field, e.g. "e2".
+        @return         Mask of the squares the piece can move to, 0 for a piece which can't move.
+        """
 
-                    if args.debug: print(f"{debug_msg}human vs human")
-                    mode_setting = 1    # Human vs Human
-                    board.set_leds('5') # Set LED indicator
+        return self.destinations.get(chess.parse_square(field), 0)
 
-                elif GPIO.event_detected(MCB_BUT_CONFIRM):
-                    
-                    fsm.go_to_human_color() # Change state
+    def is_legal(self, move: str) -> bool:
 
-        elif fsm.is_human_color:
+        """! Check a move in UCI, e.g. "e2e4" or "e7e8q" """
 
-            if first_entry:
+        return move in self.moves
 
-                print(f"STATE: {fsm.current_state.identifier}")
-                mode_human_color = 'white' # Reset color    
-                board.set_leds('1234') # Set LED indicator to white
-            
-            if mode_human_color == 'white':
-                
-                if GPIO.event_detected(MCB_BUT_BLACK) or GPIO.event_detected(MCB_BUT_WHITE):
 
-                    mode_human_color = 'black' # Human is black
-                    board.set_leds('5678') # Set LED indicator to black
+class EngineRole:
 
-                elif GPIO.event_detected(MCB_BUT_CONFIRM):
+    """! @brief     The AI or evaluation role of an engine serving both (--single_engine)
 
-                    fsm.go_to_difficulty() # Change state
+    Searches and evaluations switch the engine to the options of the role
+    first, other calls go straight to the engine. The engine only sends the
+    options which differ from its current ones, so searches in the same role
+    cost nothing and a switch a setoption or two.
+    """
 
-            elif mode_human_color == 'black':
-                
-                if GPIO.event_detected(MCB_BUT_BLACK) or GPIO.event_detected(MCB_BUT_WHITE):
+    SEARCHES = frozenset(("start_search", "iter_search", "get_best_move", "get_best_move_time",
+                          "get_best_move_nodes", "get_best_move_clock", "get_evaluation", "get_top_moves",
+                          "is_move_correct", "start_analysis"))
 
-                    mode_human_color = 'white' # Human white
-                    board.set_leds('1234') # Set LED indicator to white
+    def __init__(self, engine: Stockfish, parameters: dict):
 
-                elif GPIO.event_detected(MCB_BUT_CONFIRM):
+        """! The Contructor
 
-                    fsm.go_to_difficulty() # Change state
+        @param  engine      The shared engine.
+        @param  parameters  Strength options of the role.
+        """
 
-        elif fsm.is_difficulty:
+        self.engine = engine
+        self.parameters = parameters
 
-            """! @brief Set the difficulty of the AI """
+    def __getattr__(self, name):
+        if name in self.SEARCHES:
+            self.engine.update_engine_parameters(self.parameters)
+        return getattr(self.engine, name)
 
-            if first_entry:
 
-                print(f"STATE: {fsm.current_state.identifier}")
+class ChessGame:
 
-                board.set_difficulty_leds(play_difficulty) # Set LEDs to default difficulty
-            
-            if GPIO.event_detected(MCB_BUT_CONFIRM):
+    """! @brief     A game on one board, driving the board through the FSM """
 
-                if args.debug: print(f"{debug_msg}confirm ({play_difficulty})")
+    def __init__(self, board: ChessBoard, engine_factory, book=None, tablebase=None, live=None, resources=None,
+                 analysis_db=None):
 
-                board.set_leds("12345678abcdefgh") # Turn on all LEDs
+        """! The Contructor
 
-                if play_difficulty == 0:    # Use level random mover on difficulty 0
-                    if args.debug: print(f"{debug_msg}using Level: {play_difficulty}")
-                    ai_parameters.update({"UCI_LimitStrength": "false"})
-                    ai_parameters.update({"Level": play_difficulty})
-                else:   # Use a ELO rating
-                    if args.debug: print(f"{debug_msg}using ELO rating: {play_difficulty * 100 + 600}")
-                    ai_parameters.update({"UCI_LimitStrength": "true"})
-                    ai_parameters.update({"UCI_Elo": play_difficulty * 100 + 600})       # 700 to 2800 (limit here is 1500, enough for me)
+        @param  board           The board to play on.
+        @param  engine_factory  Called with (path, parameters) to create an engine.
+        @param  book            Shared opening book or None.
+        @param  tablebase       Shared endgame tablebase or None.
+        @param  live            LiveState to publish the game to, or None.
+        @param  resources       Engine Threads/Hash from plan_resources, or None for the fixed settings.
+        @param  analysis_db     Shared AnalysisDatabase or None.
+        """
 
-                # Initiate ai engine
-                ai = Stockfish(args.input, parameters=ai_parameters)
-                if args.debug: print(f"{debug_msg} {ai.get_parameters()}")
+        # Create a FSM object
+        self.fsm = ChessBoardFsm()
+        self.start_fen = args.fen        ### Position the game is set up and played from
+        self.board = board
+        self.engine_factory = engine_factory
+        self.book = book
+        self.tablebase = tablebase
+        self.analysis_db = analysis_db
+        self.live = live
+        self.resources = resources or plan_resources("fixed", 0, 0)    ### Threads/Hash of the "ai" and "eval" engines
+
+        # State handlers, the states which query the engines get a larger budget
+        fsm = self.fsm
+        fsm.add_handler(fsm.init, self.tick_init, self.enter_init)
+        fsm.add_handler(fsm.mode, self.tick_mode, self.enter_mode)
+        fsm.add_handler(fsm.human_color, self.tick_human_color, self.enter_human_color)
+        fsm.add_handler(fsm.difficulty, self.tick_difficulty, self.enter_difficulty, budget=MCB_ENGINE_TICK_BUDGET)
+        fsm.add_handler(fsm.setup, self.tick_setup, self.enter_setup, budget=MCB_SETUP_TICK_BUDGET)
+        fsm.add_handler(fsm.human_move, self.tick_human_move, self.enter_human_move, self.cancel_search,
+                        budget=MCB_ENGINE_TICK_BUDGET)
+        fsm.add_handler(fsm.ai_move, self.tick_ai_move, self.enter_ai_move, budget=MCB_ENGINE_TICK_BUDGET)
+        fsm.add_handler(fsm.pawn_promotion, self.tick_pawn_promotion, self.enter_pawn_promotion,
+                        budget=MCB_ENGINE_TICK_BUDGET)
+        fsm.add_handler(fsm.undo_move, self.tick_undo_move, self.enter_undo_move, budget=MCB_ENGINE_TICK_BUDGET)
+        fsm.add_handler(fsm.resync, self.tick_resync, self.enter_resync, budget=MCB_ENGINE_TICK_BUDGET)
+        fsm.add_handler(fsm.checkmate, self.tick_checkmate, self.enter_checkmate)
+
+        # Movement variables and flags
+        self.move_ai = ""                ### Move made by AI Engine
+        self.move_human = ""             ### Move made by Human
+        self.move_undo = ""              ### Move made by Undo
+        self.move_promotion = ""         ### Move made by Promotion
+        self.search = None               ### Outstanding hint/AI search
+        self.prefetch = None             ### Hint/AI search started in the background when the position was set
+        self.prefetch_key = None         ### Zobrist hash of the position the prefetch is for
+        self.legal = LegalMoveIndex(self.get_position([])) ### Legal moves of the current position
+        self.event = None                ### Input event of this iteration
+        self.preview = 0                 ### Destinations of the lifted piece
+        self.preview_step = 0            ### Destination of the preview on the LEDs
+        self.events_discarded = 0        ### Events no state had a use for
+        self.moves = []                  ### List of moves for engine
+        self.play_difficulty = 1         ### Default difficulty
+        self.evaluation = None           ### Latest evaluation
+        self.analysis = None             ### Background analysis of the eval engine
+        self.analysis_stored = 0         ### Analysis depth of the current position written to the analysis db
+        self.expected_occupancy = int(self.get_position([]).occupied) ### Occupancy of the current position
+        self.mismatch_since = None       ### Time the board started to disagree with the position
+        self.mismatch_ignored = None     ### Occupancy the player chose to keep playing with
+        self.resync_moves = None         ### Moves matching the board, offered in resync
+        self.setup_target = 0            ### Occupancy of the start position
+        self.setup_mismatch = 0          ### Fields which differ from the start position
+
+        self.mode_setting = 0            ### Default mode setting 0: Human vs AI, 1: Human vs. Human
+        self.mode_human_color = 'white'  ### Default Human color
+
+        # Engines are started when a role is first needed, see engine()
+        self.engines = {}                ### Started engines by role, "ai" and "eval"
+        self.engine_processes = []       ### The distinct engines (one with --single_engine)
+        self.ai_parameters = difficulty_parameters(self.play_difficulty) ### Strength options of the AI
+        self.ai_depth = 2                ### Search depth of the AI (--think depth)
+        self.eval_depth = 2              ### Search depth of the evaluation engine
+
+        # Chess clock setup (measured from confirmed moves)
+        self.clock = ChessClock(int(args.clock * 60000), int(args.increment * 1000))
+
+    def get_position(self, moves: list):
+
+        """! @brief    Build the position after the given moves
+
+        @param moves    List of moves done so far.
+        @return         python-chess board of the position
+        """
 
-                # Init. eval engine
-                stockfish = Stockfish("/home/pi/mChessBoard/src/stockfish-12_linux_x32_armv6", parameters=DEFAULT_STOCKFISH_PARAMS)
-                if args.debug: print(f"{debug_msg} {stockfish.get_parameters()}")
+        position = chess.Board(self.start_fen)
+        for move in moves:
+            position.push_uci(move)
 
-                board.set_leds("")
-                
-                fsm.go_to_setup()
+        return position
 
-            elif GPIO.event_detected(MCB_BUT_BLACK):
+    @property
+    def ai(self):
 
-                # Increment difficulty
-                if play_difficulty < MCB_PLAY_DIFF_MAX:
-                    play_difficulty = play_difficulty + 1
-                if args.debug: print(f"{debug_msg}difficulty up: {play_difficulty}")
-                board.set_difficulty_leds(play_difficulty)
+        """! @brief    The AI engine, started on first use """
 
-            elif GPIO.event_detected(MCB_BUT_WHITE):
+        engine = self.engines.get("ai")
+        return engine if engine is not None else self.engine("ai")
 
-                # Decrement difficulty
-                if play_difficulty > MCB_PLAY_DIFF_MIN:
-                    play_difficulty = play_difficulty - 1
-                if args.debug: print(f"{debug_msg}difficulty down: {play_difficulty}")
-                board.set_difficulty_leds(play_difficulty)
+    @property
+    def stockfish(self):
 
-        elif fsm.is_setup:
+        """! @brief    The evaluation engine, started on first use """
 
-            """! @brief     Setting up the board 
-            
-            @info   Turn on LEDs for columns which is correctly setup
-            """
+        engine = self.engines.get("eval")
+        return engine if engine is not None else self.engine("eval")
 
-            if first_entry:
+    def engine(self, role: str):
 
-                print(f"STATE: {fsm.current_state.identifier}")
+        """! @brief    Start the engine of a role, set to the current position
 
-                board.add_button_events()   # Add button int. events
-                board.add_field_events()    # Add field int. events
-                board.set_setup_leds()      # Turn on initial setup LEDs
+        @param role     "ai" or "eval".
+        @return         The engine, an EngineRole of the shared engine with --single_engine
+        """
 
-            # React on field events
-            if GPIO.event_detected(MCB_ROW_AB_IO) or GPIO.event_detected(MCB_ROW_CD_IO) or \
-               GPIO.event_detected(MCB_ROW_EF_IO) or GPIO.event_detected(MCB_ROW_GH_IO):
-                board.set_setup_leds()
+        new = None
+        if args.single_engine:
+            parameters = self.ai_parameters if role == "ai" else full_strength_parameters()
+            if not self.engine_processes:
+                # Threads/Hash of both engines, so a role switch never resizes the hash
+                resources = {name: self.resources["ai"][name] + self.resources["eval"][name] for name in ("Threads", "Hash")}
+                new = self.engine_factory(args.input, {**resources, **parameters})
+                self.engine_processes.append(new)
+            engine = EngineRole(self.engine_processes[0], parameters)
+        else:
+            if role == "ai":
+                engine = new = self.engine_factory(args.input, {**self.resources["ai"], **self.ai_parameters})
+            else:
+                engine = new = self.engine_factory(MCB_EVAL_ENGINE_PATH, self.resources["eval"])
+            self.engine_processes.append(new)
+
+        if new is not None:
+            new.set_position(self.moves, None if self.start_fen == chess.STARTING_FEN else self.start_fen)
+            new.set_depth(self.eval_depth) # The AI searches pass their own depth
+            if role == "ai" or args.single_engine: # The shared engine runs the AI searches too
+                new.add_best_move_listener(self.search_finished)
+            if args.debug: print(f"{debug_msg}{role} engine started: {new.get_parameters()}")
+
+        if role == "eval" and args.analysis and not args.single_engine and isinstance(engine, Stockfish):
+            self.analysis = engine.start_analysis(args.analysis)
+
+        self.engines[role] = engine
+        return engine
+
+    def stop_engines(self):
+
+        """! @brief    Report the memory the game used and stop its engines """
+
+        if self.engine_processes:
+            roles = {} # Engine pid -> roles it served, remote and pooled engines have none
+            for role, engine in self.engines.items():
+                pid = getattr(getattr(engine, "transport", None), "pid", None)
+                if pid is not None:
+                    roles.setdefault(pid, []).append(role)
+            rss = [f"board {(process_rss(os.getpid()) or 0) // 1024} MB"]
+            rss += [f"{'+'.join(names)} {(process_rss(pid) or 0) // 1024} MB" for pid, names in roles.items()]
+            print(f"RSS: {', '.join(rss)}")
+
+        self.cancel_prefetch()
+        self.cancel_search()
+        for engine in self.engine_processes:
+            engine.close() # Searches and the analysis refer to the engine, it would outlive the game
+        self.analysis = None
+        self.engines = {}
+        self.engine_processes = []
+
+    def set_position(self):
+
+        """! @brief    Send the moves to the started engines and update the expected occupancy """
+
+        fen = None if self.start_fen == chess.STARTING_FEN else self.start_fen
+        self.cancel_prefetch() # The position changes, so the background hint is stale
+        for engine in self.engine_processes:
+            engine.set_position(self.moves, fen)
+        if args.analysis and not args.single_engine and "eval" not in self.engines:
+            self.engine("eval") # The background analysis runs from the start of the game
+        position = self.get_position(self.moves)
+        self.legal = LegalMoveIndex(position)
+        self.expected_occupancy = int(position.occupied)
+        self.mismatch_ignored = None
+        self.analysis_stored = 0
+
+        # Think while the player does, so confirm only waits for the rest of the search
+        if not args.no_prefetch and not args.single_engine and not position.is_game_over() and \
+           (self.mode_setting == 0 or "ai" in self.engines):
+            self.prefetch_key = chess.polyglot.zobrist_hash(position)
+            self.prefetch = self.start_best_move(self.moves)
+
+    def find_resync(self, occupancy: int):
+
+        """! @brief    Find the moves the board is showing, if it is a missed move or a take back
+
+        @param occupancy    Occupancy mask read from the board.
+        @return             List of moves matching the board, or None.
+        """
 
-            # If board is setup correctly
-            elif board.board_current == board.board_setup:
-                
-                if args.debug: print(f"{debug_msg}board is set up")
-                
-                board.set_leds("abcdefgh12345678") # Turn on all LEDs
-                board.board_prev = board.board_current # Set previous board to current board
-                board.board_history = [] # Reset undo history
-                board.board_history.append(board.board_current)
-                time.sleep(1) # Wait a sec
-                board.set_leds("") # Turn off the LEDs
-                
-                fsm.go_to_human_move() # Change state
+        position = self.get_position(self.moves)
 
-            elif GPIO.event_detected(MCB_BUT_BACK):
+        # One legal move ahead, i.e. a move the sensors did not follow (queen for promotions)
+        matches = []
+        for move in position.legal_moves:
+            if move.promotion not in (None, chess.QUEEN):
+                continue
+            position.push(move)
+            if position.occupied == occupancy:
+                matches.append(move.uci())
+            position.pop()
+        if len(matches) == 1:
+            return self.moves + matches
 
-                fsm.go_to_difficulty() # Change state
+        # A recent position, i.e. moves taken back on the board
+        for ply in range(1, min(MCB_RESYNC_HISTORY, len(self.moves)) + 1):
+            position.pop()
+            if position.occupied == occupancy:
+                return self.moves[:-ply]
 
-        elif fsm.is_human_move:
+        return None
 
-            """! @brief     Handle Human moves 
-            
-            @info   Indicate movements and get confirm signals if auto confirm is disabled.
-            """
+    def get_evaluation(self, moves: list):
 
-            if first_entry:
+        """! @brief    Evaluate the position, from the tablebase or the analysis db if possible
 
-                print(f"STATE: {fsm.current_state.identifier}")
+        @param moves    List of moves done so far.
+        @return         Evaluation dictionary like Stockfish.get_evaluation
+        """
 
-                board.add_field_events() # Re-enable event from the fields
-                board.add_button_events() # Re-enable event from the buttons
-                human_move_field = "" # Reset human move field
-                toggle = True # Reset toggle flag
-                timer = time.time() # Start timer #TODO
+        evaluation = None
+        if self.tablebase:
+            evaluation = self.tablebase.get_evaluation(self.get_position(moves))
+            if evaluation is not None and args.debug: print(f"{debug_msg}tablebase evaluation: {evaluation}")
 
-            if (len(move_human) == 4) and (time.time() > (timer + MCB_PLAY_AI_LED_TOGGLE_TIME)):
+        if evaluation is None and self.analysis_db:
+            entry = self.analysis_db.lookup(self.get_position(moves), self.eval_depth)
+            if entry is not None:
+                evaluation = entry["evaluation"]
+                if args.debug: print(f"{debug_msg}analysis db evaluation: {evaluation} (depth {entry['depth']})")
 
-                toggle = not toggle # Toggle, toggle flag
-                timer = time.time() # Take a new timestamp
-                board.set_move_led(toggle, move_human) # Toggle the move LEDs
+        if evaluation is None:
+            evaluation = self.stockfish.get_evaluation()
+            if self.analysis_db: # The eval engine plays at full strength, so its results are worth keeping
+                self.analysis_db.store(self.get_position(moves), self.eval_depth, evaluation)
 
-            # Handle events on fields.
-            if GPIO.event_detected(MCB_ROW_AB_IO) or GPIO.event_detected(MCB_ROW_CD_IO) or \
-               GPIO.event_detected(MCB_ROW_EF_IO) or GPIO.event_detected(MCB_ROW_GH_IO):
-                
-                human_move_field = board.get_field_event() # Get the specific field event (single field change)
-                if args.debug: print(f"{debug_msg}event - field changed: {human_move_field}")
-
-                # If first event and not an empty event
-                if len(move_human) == 0 and human_move_field != "":
-                    board.set_leds(human_move_field) # Set the single field led
-                    move_human = human_move_field # Setup first field in the move
-                # Else if second event and not the same field
-                elif len(move_human) == 2 and human_move_field != "" and human_move_field != move_human:
-                    
-                    move_human_opposite = human_move_field + move_human # Save an opposite representation
-                    move_human += human_move_field # Add the new field to the human move
-
-                    # Check for incorrectness (also check for pawn promotion)
-                    if not stockfish.is_move_correct(move_human) and not stockfish.is_move_correct(move_human+'q'):
-                        move_human = ""
-                        board.set_leds("")
-                    # Check for correctness opposite if fields are obtained in opposite direction (could be pawn promotion)
-                    elif stockfish.is_move_correct(move_human_opposite) or stockfish.is_move_correct(move_human_opposite+'q'):
-                        move_human = move_human_opposite
-                
-                if args.debug: print(f"{debug_msg}human move: {move_human}")
-
-            # If black or white is pressed to confirm move, or auto_confirm is active
-            elif (GPIO.event_detected(MCB_BUT_BLACK) or GPIO.event_detected(MCB_BUT_WHITE) or \
-                 args.auto_confirm) and len(move_human) == 4:
-
-                if args.debug: print(f"{debug_msg}event - confirm human move: {move_human}")
-                board.read_fields() # Read and update fields
-                if board.is_move_done(move_human, moves):
-                    if stockfish.is_move_correct(move_human):
-                        if args.debug: print(f"{debug_msg}stockfish - move correct")
-                        board.set_move_done_leds(move_human) # Set the field LEDs
-                        moves.append(move_human) # Add the move to the moves list
-                        stockfish.set_position(moves) # Set position in Stockfish
-                        ai.set_position(moves) # Set position in AI
-                        move_human = "" # Reset human move
-                        if args.debug: board.full_display(stockfish.get_board_visual())
-                        if stockfish.get_evaluation() == {"type": "mate", "value": 0}: # Evaluate if there is a checkmate
-                            fsm.go_to_checkmate() # Change state
-                        board.board_history.append(board.board_current) # Add the current board to the undo history list
-                    
-                    # Check for pawn promotion
-                    elif stockfish.is_move_correct(move_human+'q'):
-                        fsm.go_to_pawn_promotion()
-                else:
-                    if args.debug: 
-                        board.display()
-                        print(f"{debug_msg}move not done")
+        self.evaluation = evaluation
+        return evaluation
 
-            elif GPIO.event_detected(MCB_BUT_CONFIRM):
-                print(f"{debug_msg}event - hint/ai move")
-                board.set_leds("") # Turn off LEDs for indication
-                board.remove_field_events()
-                move_ai = ai.get_best_move()
-                fsm.go_to_ai_move()
+    def is_checkmate(self) -> bool:
 
-            elif GPIO.event_detected(MCB_BUT_BACK):
-                if args.debug: print(f"{debug_msg}event - undo")
-                if args.debug: board.full_display(stockfish.get_board_visual())
-                fsm.go_to_undo_move()
+        """! @brief    Check the position after a confirmed move for checkmate
 
-        elif fsm.is_ai_move:
+        @info   With --analysis the evaluation comes from the analysis lines in tick, so the check
+                is done on the position instead of with a query which would restart the analysis.
+        @return         True if the side to move is checkmated
+        """
 
-            """! @brief     Handle AI moves 
-            
-            @info   Indicate movements and get confirm signals.
-            """
-
-            if first_entry:
-                print(f"STATE: {fsm.current_state.identifier}")
-                board.add_field_events() # Re-enable event from the fields
-                board.add_button_events() # Re-enable event from the buttons
-                timer = time.time()
-                toggle = True
-
-            # Handle the led flash indicator timing
-            if time.time() > timer + MCB_PLAY_AI_LED_TOGGLE_TIME:
-                toggle = not toggle
-                board.set_move_led(toggle, move_ai)
-                timer = time.time()
-
-            # Confirm AI/hint move
-            if args.auto_confirm: board.read_fields()
-
-            if GPIO.event_detected(MCB_BUT_BLACK) or GPIO.event_detected(MCB_BUT_WHITE) or (args.auto_confirm and board.is_move_done(move_ai, moves)):
-
-                if args.debug: print(f"{debug_msg}event - confirm ai move: {move_ai}")
-                if len(move_ai) == 5:
-                    fsm.go_to_pawn_promotion()
-                elif board.is_move_done(move_ai, moves):
-                    board.board_prev = board.board_current
-                    if stockfish.is_move_correct(move_ai):
-                        board.set_move_done_leds(move_ai)
-                        moves.append(move_ai)
-                        stockfish.set_position(moves)
-                        ai.set_position(moves)
-                        move_ai = ""
-                        if args.debug: board.full_display(stockfish.get_board_visual())
-                        if stockfish.get_evaluation() == {"type": "mate", "value": 0}:
-                            fsm.go_to_checkmate()
-                        else:
-                            fsm.go_to_human_move()
-                        board.board_history.append(board.board_current)
-                else:
-                    if args.debug: board.display()
+        if self.analysis:
+            checkmate = self.get_position(self.moves).is_checkmate()
+            if checkmate:
+                self.evaluation = {"type": "mate", "value": 0} # The analysis has no lines in a mate
+            return checkmate
 
-            elif GPIO.event_detected(MCB_BUT_BACK):
-                if args.debug: print(f"{debug_msg}event - undo")
-                if args.debug: board.full_display(stockfish.get_board_visual())
-                fsm.go_to_undo_move()
+        return self.get_evaluation(self.moves) == {"type": "mate", "value": 0}
 
-        elif fsm.is_pawn_promotion:
+    def start_best_move(self, moves: list):
 
-            """! @brief     Handle undo moves. 
-            
-            @info   Indicate movements and get confirm signals.
-            """
-
-            if first_entry:
-                print(f"STATE: {fsm.current_state.identifier}")
-                if prev_state.value == 'human_move':
-                    if args.debug: print(f"{debug_msg}from human move state: {move_human}")
-                    move_promotion = move_human
-                    move_human_flag = True
-                    promotion_loop = 0
-                elif prev_state.value == 'ai_move':
-                    if args.debug: print(f"{debug_msg}from ai move state: {move_ai}")
-                    move_promotion = move_ai
-                    move_human_flag = False
-                    promotion_loop = -1
-                else:
-                    fsm.go_to_human_move() # Change state
-                timer = time.time()
-
-            # Handle the led flash indicator timing
-            if (time.time() > timer + MCB_PLAY_AI_LED_TOGGLE_TIME):
-                toggle = not toggle
-                move_promotion = board.set_promotion_menu_led(toggle, move_promotion, promotion_loop)
-                timer = time.time()
-            
-            if GPIO.event_detected(MCB_BUT_BLACK) and move_human_flag:
-
-                if promotion_loop < 3: promotion_loop += 1 # Increment promotion
-                else: promotion_loop = 0
-                if args.debug: print(f"{debug_msg}promotion : {promotion_loop}")
-
-            elif GPIO.event_detected(MCB_BUT_WHITE) and move_human_flag:
-
-                if promotion_loop > 0: promotion_loop -= 1 # Decrement promotion
-                else: promotion_loop = 3
-                if args.debug: print(f"{debug_msg}promotion : {promotion_loop}")
-
-            elif GPIO.event_detected(MCB_BUT_CONFIRM):
-
-                if args.debug: print(f"{debug_msg}q: 0, b: 1, k:2, r:3")
-                if args.debug: print(f"{debug_msg}choice: {promotion_loop}")
-
-                board.read_fields() # Read and update fields
-                if board.is_move_done(move_promotion[:4], moves):
-                    if stockfish.is_move_correct(move_promotion):
-                            if args.debug: print(f"{debug_msg}stockfish - move correct")
-                            board.set_move_done_leds(move_promotion[:4]) # Set the field LEDs
-                            moves.append(move_promotion) # Add the move to the moves list
-                            stockfish.set_position(moves) # Set position in Stockfish
-                            ai.set_position(moves) # Set position in AI
-                            move_human = "" # Reset human move
-                            move_ai = "" # Reset ai move
-                            if args.debug: board.full_display(stockfish.get_board_visual())
-                            if stockfish.get_evaluation() == {"type": "mate", "value": 0}: # Evaluate if there is a checkmate
-                                fsm.go_to_checkmate() # Change state
-                            else:
-                                fsm.go_to_human_move() # Change state
-                            board.board_history.append(board.board_current) # Add the current board to the undo history list
-                            
-                else:
-                    if args.debug: board.display()
+        """! @brief    Start the hint/AI move from the book, the tablebase or the AI engine
 
-            elif GPIO.event_detected(MCB_BUT_BACK):
-                if args.debug: print(f"{debug_msg}event - undo")
-                if args.debug: board.full_display(stockfish.get_board_visual())
-                fsm.go_to_undo_move()
+        @param moves    List of moves done so far.
+        @return         SearchHandle, already done for book and tablebase moves
+        """
 
+        if self.book:
+            move = self.book.get_move(moves, self.play_difficulty, self.start_fen)
+            if move is not None:
+                if args.debug: print(f"{debug_msg}book move: {move}")
+                return SearchHandle(best_move=move)
+
+        if self.tablebase:
+            move = self.tablebase.best_move(self.get_position(moves))
+            if move is not None:
+                if args.debug: print(f"{debug_msg}tablebase move: {move}")
+                return SearchHandle(best_move=move)
+
+        # Human vs Human hints come from the background analysis once it is deep enough
+        if self.mode_setting == 1 and self.analysis and self.analysis.lines and self.analysis.depth >= self.ai_depth:
+            if args.debug: print(f"{debug_msg}analysis move: {self.analysis.lines[0]['Move']} (depth {self.analysis.depth})")
+            return SearchHandle(best_move=self.analysis.lines[0]["Move"])
+
+        # Human vs Human hints from earlier full strength analysis, the AI opponent keeps its difficulty
+        if self.mode_setting == 1 and self.analysis_db:
+            entry = self.analysis_db.lookup(self.get_position(moves), self.ai_depth, need_move=True)
+            if entry is not None:
+                if args.debug: print(f"{debug_msg}analysis db move: {entry['best']} (depth {entry['depth']})")
+                return SearchHandle(best_move=entry["best"])
+
+        if args.think == "movetime":
+            return self.ai.start_search(movetime=args.movetime)
+        if args.think == "nodes":
+            return self.ai.start_search(nodes=args.nodes)
+        if args.think == "clock":
+            if args.debug: print(f"{debug_msg}clock: {self.clock.go_params()}")
+            return self.ai.start_search(**self.clock.go_params(), movetime=args.movetime)
+
+        return self.ai.start_search(depth=self.ai_depth)
+
+    def take_prefetch(self):
+
+        """! @brief    Take the background hint/AI search if it is for the current position
+
+        @return         SearchHandle (done or still running), or None if there is none for this position
+        """
 
-        elif fsm.is_undo_move:
+        search, key = self.prefetch, self.prefetch_key
+        self.prefetch, self.prefetch_key = None, None
+        if search is None or search.cancelled or key != chess.polyglot.zobrist_hash(self.get_position(self.moves)):
+            if search is not None: search.cancel()
+            return None
 
-            """! @brief     Handle undo moves. 
-            
-            @info   Indicate movements and get confirm signals.
-            """
-
-            if first_entry:
-                print(f"STATE: {fsm.current_state.identifier}")
-                timer = time.time()
-                toggle = True
-                move_human = ""
-                move_ai = ""
-                move_undo = ""
-
-                # Check if any moves has been made
-                if len(moves) > 0:
-                    if len(moves[-1]) >= 4:
-                        # Determine the mode to undo, and to indicate with LED flashing.
-                        move_undo = moves[-1][2] + moves[-1][3] + moves[-1][0] + moves[-1][1]
-                    else:
-                        # Cancelling a non-finished move, 
-                        # just set LEDs and change state.
-                        board.set_move_done_leds(moves[-1])
-                        fsm.go_to_human_move()
+        return search
+
+    def search_finished(self):
+
+        """! @brief    Engine listener: wake the loop when the game waits on a hint/AI search
+
+        @info   Runs on the engine's reader thread. Prefetches and cancelled searches finish
+                without an event, taking a prefetch checks if it is done.
+        """
+
+        if self.search is not None:
+            self.board.bus.post(EVENT_ENGINE, MCB_AI_EVENT_SOURCE)
+
+    def cancel_prefetch(self):
+
+        """! @brief    Cancel and forget the background hint/AI search, if any """
+
+        if self.prefetch is not None:
+            self.prefetch.cancel()
+            if args.debug: print(f"{debug_msg}prefetch discarded")
+        self.prefetch, self.prefetch_key = None, None
+
+    def cancel_search(self):
+
+        """! @brief    Cancel the outstanding hint/AI search, if any """
+
+        if self.search is not None:
+            latency = self.search.cancel()
+            if args.debug and self.search.cancelled: print(f"{debug_msg}search cancelled, idle after {latency * 1000:.1f} ms")
+            self.search = None
+
+    def run(self):
+
+        """! @brief    Main loop """
+
+        while True:
+            self.tick()
+            self.board.bus.wait(MCB_LOOP_IDLE_TIME) # Sleep until input, or the next LED/clock update
+
+    def event_detected(self, source) -> bool:
+
+        """! @brief    Consume the event of this iteration if it came from the source
+
+        @param source   Button/field pin, or MCB_AI_EVENT_SOURCE for a finished AI search.
+        @return         True if the event matched.
+        """
+
+        if self.event is not None and self.event.source == source:
+            self.event = None
+            return True
+
+        return False
+
+    def is_reset(self) -> bool:
+
+        """! @brief    Check if all four buttons are held down """
+
+        return not GPIO.input(self.board.but_white) and \
+               not GPIO.input(self.board.but_black) and \
+               not GPIO.input(self.board.but_confirm) and \
+               not GPIO.input(self.board.but_back)
+
+    def reset(self):
+
+        """! @brief    Reset the game and go back to init """
+
+        if args.debug: print(f"{debug_msg}resetting")
+        self.cancel_search()
+        self.board.set_leds("abcdefgh12345678")
+        self.board.remove_button_events()
+        self.board.remove_field_events()
+        time.sleep(2)
+        self.board.bus.clear() # Drop the presses of the reset
+        self.fsm.go_to_init()
+
+    def tick(self):
+
+        """! @brief    One iteration of the main loop """
+
+        # One event per iteration in the order they happened
+        self.event = self.board.bus.next()
+
+        # Reset (all buttons pressed), the buttons are only read when one was pressed
+        if self.event is not None and self.event.kind == EVENT_BUTTON and self.is_reset():
+            self.reset()
+        else:
+            self.fsm.dispatch()
+
+            # The state had no use for the event, e.g. a button without a function in this state
+            if self.event is not None:
+                self.events_discarded += 1
+                if args.debug: print(f"{debug_msg}event discarded in {self.fsm.active.identifier}: {self.event}")
+
+        # Process background analysis output, the best line is the current evaluation
+        if self.analysis:
+            self.stockfish.poll_analysis()
+            if self.analysis.lines:
+                line = self.analysis.lines[0]
+                self.evaluation = {"type": "cp", "value": line["Centipawn"]} if line["Mate"] is None else \
+                                  {"type": "mate", "value": line["Mate"]}
+
+                # Keep each new depth of the current position
+                if self.analysis_db and self.analysis.depth > self.analysis_stored:
+                    self.analysis_db.store(self.get_position(self.moves), self.analysis.depth, self.evaluation,
+                                           line["Move"], line["PV"])
+                    self.analysis_stored = self.analysis.depth
+
+        # Publish to spectators (only changes are sent)
+        if self.live:
+            self.live.publish(state=self.fsm.current_state.identifier, occupancy=self.board.occupancy,
+                              moves=self.moves, evaluation=self.evaluation,
+                              analysis=self.analysis.lines if self.analysis else [])
+
+    def enter_init(self):
+
+        """! @brief    Entering the init state """
+
+        self.stop_engines() # Free the memory until the next game needs them
+        self.move_ai = "" # Reset AI move instance
+        self.move_human = "" # Reset Human move instance
+        self.moves = [] # Reset moves list
+        self.expected_occupancy = int(self.get_position([]).occupied) # Occupancy of the start position
+        self.mismatch_ignored = None
+        self.clock.reset() # Reset the chess clock
+        self.board.add_button_events() # Add button events (delays the setup init)
+        self.board.startup_leds(0.05) # Run the LEDs in a startup sequence
+
+    def tick_init(self):
+
+        """! @brief Init the chess board """
+
+        self.fsm.go_to_mode() # Set next state
+
+    def enter_mode(self):
+
+        """! @brief    Entering the mode state """
+
+        self.mode_setting = 0 # Reset mode
+
+        self.board.set_leds('4') # Set LED indicator
+
+    def tick_mode(self):
+
+        """! @brief     Select Human vs AI or Human vs Human """
+
+        if self.mode_setting == 1:
+
+            if (self.event_detected(self.board.but_black) or self.event_detected(self.board.but_white)):
+
+                if args.debug: print(f"{debug_msg}human vs ai")
+                self.mode_setting = 0    # Human vs AI
+                self.board.set_leds('4') # Set LED indicator
+
+            elif self.event_detected(self.board.but_confirm):
+
+                self.fsm.go_to_difficulty() # Change state
+
+        elif self.mode_setting == 0:
+
+            if (self.event_detected(self.board.but_black) or self.event_detected(self.board.but_white)):
+
+                if args.debug: print(f"{debug_msg}human vs human")
+                self.mode_setting = 1    # Human vs Human
+                self.board.set_leds('5') # Set LED indicator
+
+            elif self.event_detected(self.board.but_confirm):
+
+                self.fsm.go_to_human_color() # Change state
+
+    def enter_human_color(self):
+
+        """! @brief    Entering the human_color state """
+
+        self.mode_human_color = 'white' # Reset color    
+        self.board.set_leds('1234') # Set LED indicator to white
+
+    def tick_human_color(self):
+
+        """! @brief     Select the color of the human player """
+
+        if self.mode_human_color == 'white':
+
+            if self.event_detected(self.board.but_black) or self.event_detected(self.board.but_white):
+
+                self.mode_human_color = 'black' # Human is black
+                self.board.set_leds('5678') # Set LED indicator to black
+
+            elif self.event_detected(self.board.but_confirm):
+
+                self.fsm.go_to_difficulty() # Change state
+
+        elif self.mode_human_color == 'black':
+
+            if self.event_detected(self.board.but_black) or self.event_detected(self.board.but_white):
+
+                self.mode_human_color = 'white' # Human white
+                self.board.set_leds('1234') # Set LED indicator to white
+
+            elif self.event_detected(self.board.but_confirm):
+
+                self.fsm.go_to_difficulty() # Change state
+
+    def enter_difficulty(self):
+
+        """! @brief    Entering the difficulty state """
+
+        self.board.set_difficulty_leds(self.play_difficulty) # Set LEDs to default difficulty
+
+    def tick_difficulty(self):
+
+        """! @brief Set the difficulty of the AI """
+
+        if self.event_detected(self.board.but_confirm):
+
+            if args.debug: print(f"{debug_msg}confirm ({self.play_difficulty})")
+
+            self.board.set_leds("12345678abcdefgh") # Turn on all LEDs
+
+            self.ai_parameters = difficulty_parameters(self.play_difficulty) # Used when the AI engine starts
+            if args.debug: print(f"{debug_msg}using difficulty {self.play_difficulty}: {self.ai_parameters}")
+
+            self.board.set_leds("")
+
+            self.fsm.go_to_setup()
+
+        elif self.event_detected(self.board.but_black):
+
+            # Increment difficulty
+            if self.play_difficulty < MCB_PLAY_DIFF_MAX:
+                self.play_difficulty = self.play_difficulty + 1
+            if args.debug: print(f"{debug_msg}difficulty up: {self.play_difficulty}")
+            self.board.set_difficulty_leds(self.play_difficulty)
+
+        elif self.event_detected(self.board.but_white):
+
+            # Decrement difficulty
+            if self.play_difficulty > MCB_PLAY_DIFF_MIN:
+                self.play_difficulty = self.play_difficulty - 1
+            if args.debug: print(f"{debug_msg}difficulty down: {self.play_difficulty}")
+            self.board.set_difficulty_leds(self.play_difficulty)
+
+    def enter_setup(self):
+
+        """! @brief    Entering the setup state """
+
+        self.board.add_button_events()   # Add button int. events
+        self.board.add_field_events()    # Add field int. events
+        self.board.read_fields()
+        self.setup_target = int(self.get_position([]).occupied)
+        self.setup_mismatch = self.board.occupancy ^ self.setup_target
+        self.timer = time.time()
+        self.toggle = True
+        self.board.set_setup_leds(self.setup_mismatch, self.setup_target, self.toggle) # Turn on initial setup LEDs
+
+    def tick_setup(self):
+
+        """! @brief     Setting up the board 
+
+        @info   Light the next field to fix until the board matches the start position (--fen)
+        """
+
+        # React on field events, only the expanders which changed are read
+        changed = 0
+        for io in self.board.row_pairs:
+            if self.event_detected(io):
+                changed |= self.board.read_row(io)
+
+        if changed:
+            self.setup_mismatch ^= changed
+            self.board.set_setup_leds(self.setup_mismatch, self.setup_target, self.toggle)
+            if args.debug: print(f"{debug_msg}setup: {chess.popcount(self.setup_mismatch & self.setup_target)} missing, "
+                                 f"{chess.popcount(self.setup_mismatch & ~self.setup_target)} extra")
+
+        # Flash the field when a piece has to be removed
+        if time.time() > self.timer + MCB_PLAY_AI_LED_TOGGLE_TIME:
+            self.toggle = not self.toggle
+            self.board.set_setup_leds(self.setup_mismatch, self.setup_target, self.toggle)
+            self.timer = time.time()
+
+        # If board is setup correctly
+        if not self.setup_mismatch:
+
+            if args.debug: print(f"{debug_msg}board is set up")
+
+            self.board.set_leds("abcdefgh12345678") # Turn on all LEDs
+            self.board.board_prev = self.board.board_current # Set previous board to current board
+            self.board.board_history = [] # Reset undo history
+            self.board.board_history.append(self.board.board_current)
+            time.sleep(1) # Wait a sec
+            self.board.set_leds("") # Turn off the LEDs
+            self.set_position() # Set the start position in the engines
+            self.clock.start(self.get_position([]).turn == chess.WHITE) # Start the clock for the side to move
+
+            self.fsm.go_to_human_move() # Change state
+
+        elif self.event_detected(self.board.but_back):
+
+            self.fsm.go_to_difficulty() # Change state
+
+    def enter_human_move(self):
+
+        """! @brief    Entering the human_move state """
+
+        self.board.add_field_events() # Re-enable event from the fields
+        self.board.add_button_events() # Re-enable event from the buttons
+        self.human_move_field = "" # Reset human move field
+        self.toggle = True # Reset toggle flag
+        self.timer = time.time() # Start timer #TODO
+
+    def tick_human_move(self):
+
+        """! @brief     Handle Human moves 
+
+        @info   Indicate movements and get confirm signals if auto confirm is disabled.
+        """
+
+        if (len(self.move_human) == 4) and (time.time() > (self.timer + MCB_PLAY_AI_LED_TOGGLE_TIME)):
+
+            self.toggle = not self.toggle # Toggle, toggle flag
+            self.timer = time.time() # Take a new timestamp
+            self.board.set_move_led(self.toggle, self.move_human) # Toggle the move LEDs
+
+        # Step through the destinations of the lifted piece
+        elif len(self.move_human) == 2 and self.preview and time.time() > self.timer + MCB_PLAY_AI_LED_TOGGLE_TIME:
+            self.preview_step += 1
+            self.timer = time.time()
+            self.board.set_preview_leds(self.move_human, self.preview, self.preview_step)
+
+        # Board vs position check between moves, a single compare while they agree
+        mismatch = False
+        if self.board.occupancy == self.expected_occupancy or self.board.occupancy == self.mismatch_ignored or \
+           self.move_human or self.search is not None:
+            self.mismatch_since = None
+        elif self.mismatch_since is None:
+            self.mismatch_since = time.time()
+        else:
+            mismatch = time.time() > self.mismatch_since + MCB_RESYNC_GRACE_TIME
+
+        if mismatch:
+            if args.debug: print(f"{debug_msg}board does not match the position")
+            self.mismatch_since = None
+            self.fsm.go_to_resync() # Change state
+
+        # Hint/AI search finished, woken by the engine event (also polled when idle for hang detection)
+        elif self.search is not None and (self.event_detected(MCB_AI_EVENT_SOURCE) or self.event is None) and self.search.done():
+            self.move_ai = self.search.result()
+            info = self.search.last_info
+            if args.debug and info: print(f"{debug_msg}search: depth {info.depth}, {info.nodes} nodes, {info.nps} nps, {info.time} ms")
+            if args.debug and isinstance(self.ai, Stockfish): print(f"{debug_msg}ai engine overhead: {self.ai.search_latency}")
+            self.search = None
+            self.fsm.go_to_ai_move()
+
+        # Handle events on fields.
+        elif self.event_detected(self.board.row_ab_io) or self.event_detected(self.board.row_cd_io) or \
+           self.event_detected(self.board.row_ef_io) or self.event_detected(self.board.row_gh_io):
+
+            self.human_move_field = self.board.get_field_event() # Get the specific field event (single field change)
+            if args.debug: print(f"{debug_msg}event - field changed: {self.human_move_field}")
+
+            # If first event and not an empty event
+            if len(self.move_human) == 0 and self.human_move_field != "":
+                self.preview = self.legal.preview(self.human_move_field) # Where it can go
+                self.preview_step = 0
+                self.timer = time.time()
+                self.board.set_preview_leds(self.human_move_field, self.preview, self.preview_step)
+                self.move_human = self.human_move_field # Setup first field in the move
+            # Else if second event and not the same field
+            elif len(self.move_human) == 2 and self.human_move_field != "" and self.human_move_field != self.move_human:
+
+                self.move_human_opposite = self.human_move_field + self.move_human # Save an opposite representation
+                self.move_human += self.human_move_field # Add the new field to the human move
+
+                # Check for correctness (also pawn promotion), opposite if the taken piece was lifted first
+                if self.legal.is_legal(self.move_human) or self.legal.is_legal(self.move_human+'q'):
+                    self.board.set_leds(self.move_human)
+                elif self.legal.is_legal(self.move_human_opposite) or self.legal.is_legal(self.move_human_opposite+'q'):
+                    self.move_human = self.move_human_opposite
+                    self.board.set_leds(self.move_human)
                 else:
-                    # Cancelling unfinished first move, 
-                    # just turn off LEDs and change state.
-                    board.set_leds("") 
-                    fsm.go_to_human_move()
-
-            # Handle the led flash indicator timing
-            if (time.time() > timer + MCB_PLAY_AI_LED_TOGGLE_TIME) and (len(move_undo) == 4):
-                toggle = not toggle
-                board.set_move_led(toggle, move_undo)
-                timer = time.time()
-          
-            # Confirm Undo move
-            if GPIO.event_detected(MCB_BUT_BLACK) or GPIO.event_detected(MCB_BUT_WHITE):
-                if args.debug: print(f"{debug_msg}confirm undo move: {move_undo}")
-                if board.is_undo_move_done(): # If the undo move is done
-                    del moves[-1] # Delete last move for the engines
-                    stockfish.set_position(moves) # Set the moved for eval engine
-                    ai.set_position(moves) # Set the moved for ai engine
-                    if len(moves) > 0: # Check if the deleted move was the last one.
-                        board.set_move_done_leds(moves[-1])
+                    if args.debug: print(f"{debug_msg}illegal move: {self.move_human}")
+                    self.move_human = ""
+                    self.board.set_square_leds(self.board.occupancy ^ self.expected_occupancy) # Show what to put back
+
+            if args.debug: print(f"{debug_msg}human move: {self.move_human}")
+
+        # If black or white is pressed to confirm move, or auto_confirm is active
+        elif (self.event_detected(self.board.but_black) or self.event_detected(self.board.but_white) or \
+             args.auto_confirm) and len(self.move_human) == 4:
+
+            if args.debug: print(f"{debug_msg}event - confirm human move: {self.move_human}")
+            self.board.read_fields() # Read and update fields
+            if self.board.is_move_done(self.move_human, self.moves):
+                if self.legal.is_legal(self.move_human):
+                    if args.debug: print(f"{debug_msg}move correct")
+                    self.board.set_move_done_leds(self.move_human) # Set the field LEDs
+                    self.moves.append(self.move_human) # Add the move to the moves list
+                    self.clock.press() # Hand the clock over
+                    self.set_position() # Set position in the engines
+                    self.move_human = "" # Reset human move
+                    if args.debug: self.board.full_display(self.stockfish.get_board_visual())
+                    if self.is_checkmate(): # Evaluate if there is a checkmate
+                        self.fsm.go_to_checkmate() # Change state
+                    self.board.board_history.append(self.board.board_current) # Add the current board to the undo history list
+
+                # Check for pawn promotion
+                elif self.legal.is_legal(self.move_human+'q'):
+                    self.fsm.go_to_pawn_promotion()
+            else:
+                if args.debug: 
+                    self.board.display()
+                    print(f"{debug_msg}move not done")
+
+        elif self.event_detected(self.board.but_confirm):
+            print(f"{debug_msg}event - hint/ai move")
+            self.board.set_leds("") # Turn off LEDs for indication
+            self.board.remove_field_events()
+            self.cancel_search()
+            self.search = self.take_prefetch() # Started when the position was set, often done already
+            if self.search is None:
+                self.search = self.start_best_move(self.moves) # Finished by an engine event, so Back and reset stay responsive
+            elif args.debug: print(f"{debug_msg}prefetched search, done: {self.search.done()}")
+            if self.search.done(): # Book, tablebase and analysis moves are ready at once
+                self.board.bus.post(EVENT_ENGINE, MCB_AI_EVENT_SOURCE)
+
+        elif self.search is not None and self.event_detected(self.board.but_back):
+            if args.debug: print(f"{debug_msg}event - cancel hint/ai move")
+            self.cancel_search()
+            self.board.add_field_events() # Re-enable event from the fields
+
+        elif self.event_detected(self.board.but_back):
+            if args.debug: print(f"{debug_msg}event - undo")
+            if args.debug: self.board.full_display(self.stockfish.get_board_visual())
+            self.fsm.go_to_undo_move()
+
+    def enter_ai_move(self):
+
+        """! @brief    Entering the ai_move state """
+
+        self.board.add_field_events() # Re-enable event from the fields
+        self.board.add_button_events() # Re-enable event from the buttons
+        self.timer = time.time()
+        self.toggle = True
+
+    def tick_ai_move(self):
+
+        """! @brief     Handle AI moves 
+
+        @info   Indicate movements and get confirm signals.
+        """
+
+        # Handle the led flash indicator timing
+        if time.time() > self.timer + MCB_PLAY_AI_LED_TOGGLE_TIME:
+            self.toggle = not self.toggle
+            self.board.set_move_led(self.toggle, self.move_ai)
+            self.timer = time.time()
+
+        # Confirm AI/hint move
+        if args.auto_confirm: self.board.read_fields()
+
+        if self.event_detected(self.board.but_black) or self.event_detected(self.board.but_white) or (args.auto_confirm and self.board.is_move_done(self.move_ai, self.moves)):
+
+            if args.debug: print(f"{debug_msg}event - confirm ai move: {self.move_ai}")
+            if len(self.move_ai) == 5:
+                self.fsm.go_to_pawn_promotion()
+            elif self.board.is_move_done(self.move_ai, self.moves):
+                self.board.board_prev = self.board.board_current
+                if self.legal.is_legal(self.move_ai):
+                    self.board.set_move_done_leds(self.move_ai)
+                    self.moves.append(self.move_ai)
+                    self.clock.press()
+                    self.set_position() # Set position in the engines
+                    self.move_ai = ""
+                    if args.debug: self.board.full_display(self.stockfish.get_board_visual())
+                    if self.is_checkmate():
+                        self.fsm.go_to_checkmate()
                     else:
-                        board.set_leds("")
-                    if args.debug: board.full_display(stockfish.get_board_visual())
-                    fsm.go_to_human_move() # Change state
-                else:
-                    if args.debug: board.display()
+                        self.fsm.go_to_human_move()
+                    self.board.board_history.append(self.board.board_current)
+            else:
+                if args.debug: self.board.display()
+
+        elif self.event_detected(self.board.but_back):
+            if args.debug: print(f"{debug_msg}event - undo")
+            if args.debug: self.board.full_display(self.stockfish.get_board_visual())
+            self.fsm.go_to_undo_move()
+
+    def enter_pawn_promotion(self):
+
+        """! @brief    Entering the pawn_promotion state """
+
+        if self.fsm.prev_state.value == 'human_move':
+            if args.debug: print(f"{debug_msg}from human move state: {self.move_human}")
+            self.move_promotion = self.move_human
+            self.move_human_flag = True
+            self.promotion_loop = 0
+        elif self.fsm.prev_state.value == 'ai_move':
+            if args.debug: print(f"{debug_msg}from ai move state: {self.move_ai}")
+            self.move_promotion = self.move_ai
+            self.move_human_flag = False
+            self.promotion_loop = -1
+        else:
+            self.fsm.go_to_human_move() # Change state
+        self.timer = time.time()
 
-            elif GPIO.event_detected(MCB_BUT_BACK):
-                if args.debug: print(f"{debug_msg}event - cancel undo")
-                board.set_move_done_leds(moves[-1])
-                fsm.go_to_human_move()
+    def tick_pawn_promotion(self):
 
-        # STATE: Checkmate
-        elif fsm.is_checkmate:
+        """! @brief     Handle undo moves. 
 
-            """! @brief     Handle checkmate. 
-            
-            @info   Flash the LEDs for indication and go to init when button is pressed.
-            """
-
-            if first_entry:
-                print(f"STATE: {fsm.current_state.identifier}")
-                timer = time.time()
-                toggle = True
-
-            if time.time() > timer + MCB_PLAY_CHECKMATE_LED_TOGGLE_TIME:
-                if toggle:
-                    board.set_leds("12345678abcdefgh")
-                    toggle = False
+        @info   Indicate movements and get confirm signals.
+        """
+
+        # Handle the led flash indicator timing
+        if (time.time() > self.timer + MCB_PLAY_AI_LED_TOGGLE_TIME):
+            self.toggle = not self.toggle
+            self.move_promotion = self.board.set_promotion_menu_led(self.toggle, self.move_promotion, self.promotion_loop)
+            self.timer = time.time()
+
+        if self.event_detected(self.board.but_black) and self.move_human_flag:
+
+            if self.promotion_loop < 3: self.promotion_loop += 1 # Increment promotion
+            else: self.promotion_loop = 0
+            if args.debug: print(f"{debug_msg}promotion : {self.promotion_loop}")
+
+        elif self.event_detected(self.board.but_white) and self.move_human_flag:
+
+            if self.promotion_loop > 0: self.promotion_loop -= 1 # Decrement promotion
+            else: self.promotion_loop = 3
+            if args.debug: print(f"{debug_msg}promotion : {self.promotion_loop}")
+
+        elif self.event_detected(self.board.but_confirm):
+
+            if args.debug: print(f"{debug_msg}q: 0, b: 1, k:2, r:3")
+            if args.debug: print(f"{debug_msg}choice: {self.promotion_loop}")
+
+            self.board.read_fields() # Read and update fields
+            if self.board.is_move_done(self.move_promotion[:4], self.moves):
+                if self.legal.is_legal(self.move_promotion):
+                        if args.debug: print(f"{debug_msg}move correct")
+                        self.board.set_move_done_leds(self.move_promotion[:4]) # Set the field LEDs
+                        self.moves.append(self.move_promotion) # Add the move to the moves list
+                        self.clock.press() # Hand the clock over
+                        self.set_position() # Set position in the engines
+                        self.move_human = "" # Reset human move
+                        self.move_ai = "" # Reset ai move
+                        if args.debug: self.board.full_display(self.stockfish.get_board_visual())
+                        if self.is_checkmate(): # Evaluate if there is a checkmate
+                            self.fsm.go_to_checkmate() # Change state
+                        else:
+                            self.fsm.go_to_human_move() # Change state
+                        self.board.board_history.append(self.board.board_current) # Add the current board to the undo history list
+
+            else:
+                if args.debug: self.board.display()
+
+        elif self.event_detected(self.board.but_back):
+            if args.debug: print(f"{debug_msg}event - undo")
+            if args.debug: self.board.full_display(self.stockfish.get_board_visual())
+            self.fsm.go_to_undo_move()
+
+    def enter_undo_move(self):
+
+        """! @brief    Entering the undo_move state """
+
+        self.timer = time.time()
+        self.toggle = True
+        self.move_human = ""
+        self.move_ai = ""
+        self.move_undo = ""
+
+        # Check if any moves has been made
+        if len(self.moves) > 0:
+            if len(self.moves[-1]) >= 4:
+                # Determine the mode to undo, and to indicate with LED flashing.
+                self.move_undo = self.moves[-1][2] + self.moves[-1][3] + self.moves[-1][0] + self.moves[-1][1]
+            else:
+                # Cancelling a non-finished move, 
+                # just set LEDs and change state.
+                self.board.set_move_done_leds(self.moves[-1])
+                self.fsm.go_to_human_move()
+        else:
+            # Cancelling unfinished first move, 
+            # just turn off LEDs and change state.
+            self.board.set_leds("") 
+            self.fsm.go_to_human_move()
+
+    def tick_undo_move(self):
+
+        """! @brief     Handle undo moves. 
+
+        @info   Indicate movements and get confirm signals.
+        """
+
+        # Handle the led flash indicator timing
+        if (time.time() > self.timer + MCB_PLAY_AI_LED_TOGGLE_TIME) and (len(self.move_undo) == 4):
+            self.toggle = not self.toggle
+            self.board.set_move_led(self.toggle, self.move_undo)
+            self.timer = time.time()
+
+        # Confirm Undo move
+        if self.event_detected(self.board.but_black) or self.event_detected(self.board.but_white):
+            if args.debug: print(f"{debug_msg}confirm undo move: {self.move_undo}")
+            if self.board.is_undo_move_done(): # If the undo move is done
+                del self.moves[-1] # Delete last move for the engines
+                self.clock.set_turn(self.get_position(self.moves).turn == chess.WHITE) # Give the clock back to the side to move
+                self.set_position() # Set position in the engines
+                if len(self.moves) > 0: # Check if the deleted move was the last one.
+                    self.board.set_move_done_leds(self.moves[-1])
                 else:
-                    board.set_leds("")
-                    toggle = True
-                timer = time.time()
-
-            if GPIO.event_detected(MCB_BUT_WHITE) or \
-               GPIO.event_detected(MCB_BUT_BLACK) or \
-               GPIO.event_detected(MCB_BUT_CONFIRM) or \
-               GPIO.event_detected(MCB_BUT_BACK):
-
-                if args.debug: print(f"{debug_msg}go to init")
-                board.remove_button_events()
-                board.remove_field_events()
-                fsm.go_to_init()
-
-        # Reset (all buttons pressed)
-        if not GPIO.input(MCB_BUT_WHITE) and \
-           not GPIO.input(MCB_BUT_BLACK) and \
-           not GPIO.input(MCB_BUT_CONFIRM) and \
-           not GPIO.input(MCB_BUT_BACK):
-
-            if args.debug: print(f"{debug_msg}resetting")
-            board.set_leds("abcdefgh12345678")
-            board.remove_button_events()
-            board.remove_field_events()
-            time.sleep(2)
-            fsm.go_to_init()
-
-        # Not initial anymore
-        initial = False
+                    self.board.set_leds("")
+                if args.debug: self.board.full_display(self.stockfish.get_board_visual())
+                self.fsm.go_to_human_move() # Change state
+            else:
+                if args.debug: self.board.display()
+
+        elif self.event_detected(self.board.but_back):
+            if args.debug: print(f"{debug_msg}event - cancel undo")
+            self.board.set_move_done_leds(self.moves[-1])
+            self.fsm.go_to_human_move()
+
+    def enter_resync(self):
+
+        """! @brief    Entering the resync state """
+
+        self.board.add_field_events() # Re-enable event from the fields
+        self.board.add_button_events() # Re-enable event from the buttons
+        self.board.read_fields()
+        self.resync_moves = self.find_resync(self.board.occupancy)
+        self.timer = time.time()
+        self.toggle = True
+        self.board.set_square_leds(self.board.occupancy ^ self.expected_occupancy)
+
+    def tick_resync(self):
+
+        """! @brief     Handle a board which does not match the position.
+
+        @info   Light the mismatched fields until the pieces are put right. If the board
+                shows a missed move or a take back the LEDs flash and confirm resyncs to it,
+                back keeps playing with the board as it is.
+        """
+
+        # Follow the pieces as they are put right
+        if self.event_detected(self.board.row_ab_io) or self.event_detected(self.board.row_cd_io) or \
+           self.event_detected(self.board.row_ef_io) or self.event_detected(self.board.row_gh_io):
+            self.board.read_fields()
+            self.resync_moves = self.find_resync(self.board.occupancy)
+            self.board.set_square_leds(self.board.occupancy ^ self.expected_occupancy)
+            if args.debug: print(f"{debug_msg}resync candidate: {self.resync_moves}")
+
+        # Flash the mismatch when confirm can resync to the board
+        if self.resync_moves is not None and time.time() > self.timer + MCB_RESYNC_LED_TOGGLE_TIME:
+            self.toggle = not self.toggle
+            self.board.set_square_leds(self.board.occupancy ^ self.expected_occupancy if self.toggle else 0)
+            self.timer = time.time()
+
+        if self.board.occupancy == self.expected_occupancy:
+            if args.debug: print(f"{debug_msg}board matches the position again")
+            self.board.board_prev = self.board.board_current
+            if self.moves: self.board.set_move_done_leds(self.moves[-1])
+            else: self.board.set_leds("")
+            self.fsm.go_to_human_move() # Change state
+
+        elif self.resync_moves is not None and self.event_detected(self.board.but_confirm):
+            if args.debug: print(f"{debug_msg}resync to: {self.resync_moves}")
+            if len(self.resync_moves) > len(self.moves):
+                self.board.board_history.append(self.board.board_current)
+            else:
+                del self.board.board_history[len(self.resync_moves) + 1:]
+            self.moves = self.resync_moves
+            self.clock.set_turn(self.get_position(self.moves).turn == chess.WHITE) # Give the clock to the side to move
+            self.set_position() # Set position in the engines
+            self.board.board_prev = self.board.board_current
+            if self.moves: self.board.set_move_done_leds(self.moves[-1])
+            else: self.board.set_leds("")
+            self.fsm.go_to_human_move() # Change state
+
+        elif self.event_detected(self.board.but_back):
+            if args.debug: print(f"{debug_msg}event - keep playing with the board as it is")
+            self.mismatch_ignored = self.board.occupancy
+            self.board.board_prev = self.board.board_current
+            self.board.set_leds("")
+            self.fsm.go_to_human_move() # Change state
+
+    def enter_checkmate(self):
+
+        """! @brief    Entering the checkmate state """
+
+        self.timer = time.time()
+        self.toggle = True
+
+    def tick_checkmate(self):
+
+        """! @brief     Handle checkmate. 
+
+        @info   Flash the LEDs for indication and go to init when button is pressed.
+        """
+
+        if time.time() > self.timer + MCB_PLAY_CHECKMATE_LED_TOGGLE_TIME:
+            if self.toggle:
+                self.board.set_leds("12345678abcdefgh")
+                self.toggle = False
+            else:
+                self.board.set_leds("")
+                self.toggle = True
+            self.timer = time.time()
+
+        if self.event_detected(self.board.but_white) or \
+           self.event_detected(self.board.but_black) or \
+           self.event_detected(self.board.but_confirm) or \
+           self.event_detected(self.board.but_back):
+
+            if args.debug: print(f"{debug_msg}go to init")
+            self.board.remove_button_events()
+            self.board.remove_field_events()
+            self.fsm.go_to_init()
+
+
+def signal_handler(sig, frame):
+
+    """! @brief    Exit function """
+
+    print(' SIGINT or CTRL-C detected. Exiting gracefully')
+    if profiler:
+        profiler.save(args.profile)
+    GPIO.cleanup()
+    for board in boards:
+        board.set_leds("")
+        if board.trace:
+            board.trace.close()
+    sys.exit(0)
+
+
+def fsm_state(game):
+
+    """! @brief    Name of the state whose handler ran last, for the profiler """
+
+    return game.fsm.active.identifier if game.fsm.active else None
+
+
+def run_host(config_path: str, book, tablebase, live_server, analysis_db, profiler):
+
+    """! @brief    Drive several boards from one process with a shared engine pool
+
+    @param config_path  JSON file with "workers" and a list of "boards" configs.
+    @param book         Shared opening book or None.
+    @param tablebase    Shared endgame tablebase or None.
+    @param live_server  LiveServer for spectators or None.
+    @param analysis_db  Shared AnalysisDatabase or None.
+    @param profiler     SamplingProfiler or None.
+    """
+
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+
+    workers = config.get("workers", os.cpu_count() or 1)
+    scheduler = EngineScheduler(workers, args.engine_timeout)
+    resources = plan_resources(args.resources, *host_resources(), share=workers)  # Every worker runs an engine pair
+    games = []
+
+    for board_config in config["boards"]:
+        board = ChessBoard(board_config)
+        boards.append(board)
+        if args.trace:
+            TraceRecorder(f"{args.trace}.{board.name}").attach(board)
+        scheduler.register(board.name, board.priority)
+
+        def engine_factory(path, parameters, name=board.name):
+            return scheduler.engine(name, path, parameters)
+
+        game = ChessGame(board, engine_factory, book, tablebase, live_server.add_board(board.name) if live_server else None,
+                         resources, analysis_db)
+        games.append((board, game))
+        thread = threading.Thread(target=game.run, name=board.name, daemon=True)
+        thread.start()
+        if profiler:
+            profiler.watch(thread, lambda game=game: fsm_state(game), board.name)
+
+    # Report the engine queue wait per board
+    while True:
+        time.sleep(args.host_report)
+        print(scheduler.report())
+        if args.debug:
+            for board, game in games:
+                print(f"{board.name}:\n{game.fsm.report()}")
+
+
+if __name__ == "__main__":
+
+    """! @brief    Main function """
+
+    # CTRL+C handler
+    boards = []
+    profiler = None
+    signal(SIGINT, signal_handler)
+
+    # Parse arguments
+    args = parser()
+
+    # Opening book setup
+    book = None
+    if os.path.isfile(args.book):
+        book = PolyglotBook(args.book, max_ply=args.book_depth, difficulty_max=MCB_PLAY_DIFF_MAX)
+        if args.debug: print(f"{debug_msg}opening book: {args.book} ({len(book)} entries)")
+
+    # Endgame tablebase setup
+    tablebase = open_tablebase(args.tablebase, args.tablebase_pieces)
+    if tablebase and args.debug: print(f"{debug_msg}tablebase: {args.tablebase}")
+
+    # Analysis database setup
+    analysis_db = open_analysis_db(args.analysis_db)
+    if analysis_db and args.debug: print(f"{debug_msg}analysis db: {args.analysis_db} ({analysis_db.count()} positions)")
+
+    # Engine resources
+    if args.debug: print(f"{debug_msg}host: {host_resources()}, {args.resources}: {plan_resources(args.resources, *host_resources())}")
+
+    # Live state endpoint setup
+    live_server = LiveServer(args.live, args.live_bind) if args.live else None
+
+    # Sampling profiler, saved by the CTRL+C handler
+    if args.profile:
+        profiler = SamplingProfiler(args.profile_interval)
+        profiler.start()
+
+    if args.host:
+        run_host(args.host, book, tablebase, live_server, analysis_db, profiler)
+    else:
+        # Create a Board object
+        boards.append(ChessBoard())
+        if args.trace:
+            TraceRecorder(args.trace).attach(boards[0])
+
+        game = ChessGame(boards[0], lambda path, parameters: Stockfish(path, parameters=parameters, timeout=args.engine_timeout), book, tablebase,
+                         live_server.add_board(boards[0].name) if live_server else None,
+                         plan_resources(args.resources, *host_resources()), analysis_db)
+        if profiler:
+            profiler.watch(threading.current_thread(), lambda: fsm_state(game))
+        game.run()
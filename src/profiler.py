@@ -0,0 +1,175 @@
+"""! @brief     Sampling profiler of the game loops, tagged by FSM state
+
+    A background thread looks at the stacks of the watched game loop threads
+    every few milliseconds (sys._current_frames) and counts each stack under
+    the FSM state the game is in. The game loop itself is not instrumented,
+    so the overhead is one short walk of a few stacks per sample, and the
+    profile shows where a sluggish board spends its time: I2C reads of the
+    expanders, GPIO, read_fields, waiting on engine output or idling on the
+    event bus.
+
+    On stop it writes the stacks in the collapsed format of flamegraph.pl
+    and speedscope, one "state;frame;...;frame count" line per stack, and
+    a per-state summary next to it:
+
+        python3 mChessBoard.py --profile /tmp/board.folded
+        flamegraph.pl /tmp/board.folded > board.svg
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Tuple
+
+PROFILE_INTERVAL = 5            # ms between samples
+PROFILE_TOP_FRAMES = 5          # Innermost frames listed per state in the summary
+
+_OWN_DIR = os.path.dirname(os.path.abspath(__file__))
+_own_files: Dict[str, bool] = {}   # File name -> is one of the board's modules
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _is_own(filename: str) -> bool:
+    own = _own_files.get(filename)
+    if own is None:
+        own = _own_files[filename] = os.path.dirname(os.path.abspath(filename)) == _OWN_DIR
+    return own
+
+
+class SamplingProfiler:
+
+    """! @brief     Samples watched threads and counts their stacks per state """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+
+        """! The Contructor
+
+        @param  interval    ms between samples.
+        """
+
+        self.interval = interval / 1000
+        self.samples = 0
+        self.started = None
+        self.elapsed = 0.0
+
+        self._watched: Dict[int, Tuple[str, Callable[[], str]]] = {}
+        self._stacks = Counter()    # "label;state;frames" -> samples
+        self._own = Counter()       # (label, state, innermost frame of the board's modules) -> samples
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, thread: threading.Thread, state: Callable[[], str], label: str = ""):
+
+        """! Sample a thread, tagged with the state it is in
+
+        @param  thread  Thread running a game loop.
+        @param  state   Returns the current state name, called from the sampler thread.
+        @param  label   Prefix of the stacks, to tell boards apart in host mode.
+        """
+
+        self._watched[thread.ident] = (label, state)
+
+    def start(self):
+
+        """! Start sampling """
+
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, (label, state) in list(self._watched.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self._sample(frame, label, state)
+            self.samples += 1
+
+    def _sample(self, frame, label: str, state: Callable[[], str]):
+
+        """! Count one stack, outermost frame first """
+
+        try:
+            tag = state() or "none"
+        except Exception:   # The game is between states
+            tag = "none"
+
+        names = []
+        own = None
+        while frame is not None:
+            code = frame.f_code
+            names.append(_frame_name(code))
+            if own is None and _is_own(code.co_filename):
+                own = names[-1]
+            frame = frame.f_back
+        names.append(tag)
+        if label:
+            names.append(label)
+
+        self._stacks[";".join(reversed(names))] += 1
+        self._own[(label, tag, own or names[0])] += 1
+
+    def stop(self):
+
+        """! Stop sampling, safe to call more than once """
+
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.elapsed = time.monotonic() - self.started
+
+    def write_collapsed(self, path: str):
+
+        """! Write the stacks in the collapsed (folded) flamegraph format
+
+        @param  path    Output file.
+        """
+
+        with open(path, "w") as output:
+            for stack, count in sorted(self._stacks.items()):
+                output.write(f"{stack} {count}\n")
+
+    def summary(self) -> str:
+
+        """! Time per state, with the innermost frames of the board's modules in each
+
+        @return     Table as text, times estimated from the sample counts.
+        """
+
+        states = Counter()
+        for (label, state, _), count in self._own.items():
+            states[(label, state)] += count
+        total = sum(states.values()) or 1
+
+        period = self.elapsed / self.samples if self.samples else self.interval    # Sampling takes time too
+        lines = [f"{self.samples} samples every {period * 1000:.1f} ms over {self.elapsed:.1f} s",
+                 f"{'state':30} {'time s':>8} {'share':>7}"]
+        for (label, state), count in states.most_common():
+            name = f"{label}/{state}" if label else state
+            lines.append(f"{name:30} {count * period:8.2f} {count / total:7.1%}")
+            frames = [(frame, n) for (l, s, frame), n in self._own.items() if (l, s) == (label, state)]
+            for frame, n in sorted(frames, key=lambda item: -item[1])[:PROFILE_TOP_FRAMES]:
+                lines.append(f"    {frame:40} {n / count:7.1%}")
+
+        return "\n".join(lines)
+
+    def save(self, path: str):
+
+        """! Stop and write the collapsed stacks to path and the summary to path.summary
+
+        @param  path    Collapsed stacks file.
+        """
+
+        self.stop()
+        self.write_collapsed(path)
+        summary = self.summary()
+        with open(f"{path}.summary", "w") as output:
+            output.write(summary + "\n")
+        print(summary)
@@ -0,0 +1,294 @@
+"""! @brief     Replay a sensor trace through the board and its FSM without hardware
+
+    Feeds a trace recorded with mChessBoard.py --trace to a ChessBoard and
+    ChessGame running on fake RPi.GPIO and pcf8575 modules, for regression
+    tests of input seen on a real board and for throughput measurements of
+    the whole input pipeline. Options after the trace are passed on to
+    mChessBoard.py, e.g. the engines:
+
+        python3 replay.py game.trace --speed 0 -e stockfish -i minic -d
+
+    --check replays a built-in setup and first move instead of a trace, a
+    quick test of the input pipeline (and the engines) without a board.
+
+    The expander ports change right after the read before the one which saw
+    the new value, so the game reads every value no later than it did when
+    recording. --speed 1 replays in real time, higher values faster, and 0
+    as fast as possible: then each press, interrupt or port change is fed as
+    soon as the previous one is handled and the AI search is done, so
+    time-based behaviour (LED flashing, the resync grace time) is squeezed.
+"""
+
+import argparse
+import sys
+import time
+import types
+from typing import Dict, List
+
+from sensortrace import TRACE_BUTTON, TRACE_BUTTONS, TRACE_EXPANDERS, TRACE_FIELD, TRACE_READ, bits_port, read_trace
+
+REPLAY_PORT = 255       # Kind of the replay steps setting an expander port
+
+
+class FakePort:
+
+    """! @brief     Port of a FakeExpander, read one pin per index like the IOPort of pcf8575
+
+    The real port reads the expander for every pin and rejects slices, so the
+    board has to take a snapshot before slicing; the replay checks it does.
+    """
+
+    def __init__(self, expander: "FakeExpander"):
+        self.expander = expander
+
+    def __getitem__(self, pin: int) -> bool:
+        assert pin in range(16), "Pin number must be an integer between 0 and 15"
+        self.expander.reads += 1
+        return self.expander.pins[pin]
+
+    def __len__(self) -> int:
+        return 16
+
+    def __iter__(self):
+        for pin in range(16):
+            yield self[pin]
+
+
+class FakeExpander:
+
+    """! @brief     PCF8575 stand-in, the port holds what the replay sets """
+
+    def __init__(self, port_num: int, address: int):
+        self.address = address
+        self.pins = [True] * 16
+        self.reads = 0      # Pin reads, each one an I2C transfer on the board
+
+    @property
+    def port(self) -> FakePort:
+        return FakePort(self)
+
+    @port.setter
+    def port(self, port: List[bool]):
+        assert isinstance(port, list) and len(port) == 16
+        self.pins = list(port)
+
+
+class FakeGpio(types.ModuleType):
+
+    """! @brief     RPi.GPIO stand-in keeping the callbacks and the button levels """
+
+    VERSION = "replay"
+    BCM = 11
+    IN = 1
+    PUD_UP = 22
+    FALLING = 32
+
+    def __init__(self):
+        super().__init__("RPi.GPIO")
+        self.callbacks = {}
+        self.held = set()   # Pins of the buttons held down
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None):
+        pass
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = callback
+
+    def input(self, pin) -> int:
+        return 0 if pin in self.held else 1
+
+    def cleanup(self):
+        pass
+
+
+def install_fakes() -> FakeGpio:
+
+    """! Put the fake hardware modules in place of RPi.GPIO and pcf8575, before mChessBoard is imported """
+
+    gpio = FakeGpio()
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = gpio
+    pcf8575 = types.ModuleType("pcf8575")
+    pcf8575.PCF8575 = FakeExpander
+    sys.modules.update({"RPi": rpi, "RPi.GPIO": gpio, "pcf8575": pcf8575})
+    return gpio
+
+
+def replay_steps(path: str) -> List[tuple]:
+
+    """! Turn the records of a trace into replay steps
+
+    @param  path    Trace file.
+
+    @return         (time, kind, source, value) in replay order, reads replaced by REPLAY_PORT steps.
+    """
+
+    _, records = read_trace(path)
+    steps = []                              # (order, step)
+    last_read: Dict[int, tuple] = {}        # Expander -> (order, time, value) of its last read
+
+    for order, (when, kind, source, value) in enumerate(records):
+        if kind != TRACE_READ:
+            steps.append((order, (when, kind, source, value)))
+            continue
+
+        previous = last_read.get(source)
+        if previous is None:
+            steps.append((-1, (0.0, REPLAY_PORT, source, value)))   # State at the start
+        elif previous[2] != value:
+            steps.append((previous[0] + 0.5, (previous[1], REPLAY_PORT, source, value)))
+        last_read[source] = (order, when, value)
+
+    return [step for _, step in sorted(steps, key=lambda item: item[0])]
+
+
+def check_steps(board) -> List[tuple]:
+
+    """! Steps of a short game, for --check: the board is set up (through read_row) and e2e4 is played
+
+    @param  board   ChessBoard, for its pins.
+
+    @return         Steps as from replay_steps.
+    """
+
+    import chess
+
+    def ports(occupancy: int) -> List[tuple]:
+        steps = []
+        for index in range(4):  # Inverse of ChessBoard.read_fields, False where a piece stands
+            file = index * 2
+            bits = 0xFFFF
+            for rank in range(8):
+                if occupancy >> (rank * 8 + file) & 1:
+                    bits &= ~(1 << (15 - rank))
+                if occupancy >> (rank * 8 + file + 1) & 1:
+                    bits &= ~(1 << (7 - rank))
+            steps.append((0.0, REPLAY_PORT, index, bits))
+        return steps
+
+    def interrupts(*pins) -> List[tuple]:
+        return [(0.0, TRACE_FIELD, pin, 0) for pin in pins]
+
+    def press(pin) -> List[tuple]:
+        held = 1 << [getattr(board, name) for name in TRACE_BUTTONS].index(pin)
+        return [(0.0, TRACE_BUTTON, pin, held)]
+
+    position = chess.Board()
+    start = int(position.occupied)
+    lifted = start & ~chess.BB_E2
+    position.push_uci("e2e4")
+
+    return ports(0) + press(board.but_confirm) * 3 + \
+        ports(start) + interrupts(*board.row_pairs) + \
+        ports(lifted) + interrupts(board.row_ef_io) + \
+        ports(int(position.occupied)) + interrupts(board.row_ef_io) + press(board.but_white)
+
+
+def settle(game):
+
+    """! Run the game until its input is handled, a new state is entered and the AI search is done """
+
+    while True:
+        game.tick()
+        if game.search is not None and not game.search.done():
+            game.board.bus.wait(0.001)
+        elif not len(game.board.bus) and game.fsm.current_state is game.fsm.active:
+            return
+
+
+def replay(steps: List[tuple], board, game, gpio: FakeGpio, speed: float, idle_time: float) -> float:
+
+    """! Feed the steps to the board and run the game along
+
+    @param  steps       From replay_steps.
+    @param  board       ChessBoard on the fake hardware.
+    @param  game        ChessGame of the board.
+    @param  gpio        The fake GPIO module.
+    @param  speed       1 for real time, 0 for as fast as possible.
+    @param  idle_time   Max wait of the game loop between ticks.
+
+    @return             Seconds the replay took.
+    """
+
+    expanders = [getattr(board, name) for name in TRACE_EXPANDERS]
+    buttons = [getattr(board, name) for name in TRACE_BUTTONS]
+    start = time.monotonic()
+
+    for when, kind, source, value in steps:
+
+        # Run the game until the step is due, a port change after an input follows its handling
+        if speed:
+            due = start + when / speed
+            while time.monotonic() < due:
+                game.tick()
+                game.board.bus.wait(min(max(due - time.monotonic(), 0), idle_time))
+        else:
+            settle(game)
+
+        if kind == REPLAY_PORT:
+            expanders[source].port = bits_port(value)
+            continue
+
+        if kind == TRACE_BUTTON:
+            gpio.held = {pin for i, pin in enumerate(buttons) if value >> i & 1}
+        gpio.callbacks[source](source)
+
+    settle(game)
+    return time.monotonic() - start
+
+
+def parser():
+    """! @brief     Parser function to get all the arguments """
+
+    args = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                   description="Replay a sensor trace without the board, other options go to mChessBoard.py")
+
+    if "--check" not in sys.argv[1:]:   # An optional trace would take the value of a board option
+        args.add_argument("trace", type=str,
+                          help="trace recorded with mChessBoard.py --trace")
+    args.add_argument("--check", action="store_true",
+                      help="replay a built-in setup and e2e4 instead of a trace, and check the result")
+    args.add_argument("--speed", type=float, default=1,
+                      help="replay speed, 1 for real time, 0 for as fast as possible")
+    args.add_argument("-e", "--eval", type=str, default="/home/pi/mChessBoard/src/stockfish-12_linux_x32_armv6",
+                      help="path to evaluation engine")
+
+    return args.parse_known_args()
+
+
+if __name__ == "__main__":
+
+    """! @brief    Main function """
+
+    args, board_args = parser()
+    gpio = install_fakes()
+
+    import mChessBoard
+    from stockfish import Stockfish
+
+    sys.argv = [mChessBoard.__file__] + board_args
+    mChessBoard.args = mChessBoard.parser()
+    mChessBoard.MCB_EVAL_ENGINE_PATH = args.eval
+
+    board = mChessBoard.ChessBoard()
+    steps = check_steps(board) if args.check else replay_steps(args.trace)
+    inputs = sum(1 for step in steps if step[1] != REPLAY_PORT)
+
+    game = mChessBoard.ChessGame(board, lambda path, parameters: Stockfish(path, parameters=parameters,
+                                                                          timeout=mChessBoard.args.engine_timeout))
+
+    elapsed = replay(steps, board, game, gpio, args.speed, mChessBoard.MCB_LOOP_IDLE_TIME)
+
+    recorded = max((step[0] for step in steps), default=0)
+    print(f"\n{inputs} inputs ({len(steps) - inputs} port changes) recorded over {recorded:.1f} s, "
+          f"replayed in {elapsed:.1f} s ({inputs / elapsed if elapsed else 0:.0f} inputs/s)")
+    print(f"state {game.fsm.current_state.identifier}, moves {' '.join(game.moves)}")
+    print(f"{sum(getattr(board, name).reads for name in TRACE_EXPANDERS)} expander pin reads")
+    print(game.fsm.report())
+
+    if args.check:
+        assert game.moves == ["e2e4"], f"check failed: moves {game.moves}"
+        print("check passed")
@@ -0,0 +1,196 @@
+"""! @brief     Threads and Hash of the engines, planned from the host
+
+    The board runs two engine processes, the AI engine which plays and gives
+    hints, and the evaluation engine which checks moves and evaluates (and
+    analyses in the background with --analysis). The planner reads the usable
+    cores and the available memory and splits Threads and Hash between the
+    two engines by a policy:
+
+        fixed       1 thread and 16 MB each, the old settings
+        balanced    Cores and hash split evenly
+        ai          The AI engine gets all but one core and 3/4 of the hash
+        eval        The evaluation engine gets all but one core and 3/4 of the hash
+
+    Only a fraction of the available memory is used for hash, the board loop,
+    the book and the tablebases need the rest.
+
+    Run as a script to benchmark the policies on this host, both engines
+    search at the same time as they do on the board:
+
+        python3 resources.py -i minic -e stockfish --movetime 2000
+"""
+
+import argparse
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from stockfish import Stockfish
+
+RESOURCE_POLICIES = ("fixed", "balanced", "ai", "eval")
+RESOURCE_FIXED = {"Threads": 1, "Hash": 16}     # Settings of the fixed policy
+RESOURCE_HASH_FRACTION = 0.25                   # Part of the available memory used for hash
+RESOURCE_HASH_MIN = 1                           # MB
+RESOURCE_HASH_MAX = 1024                        # MB per engine
+RESOURCE_MAJOR_SHARE = 0.75                     # Hash share of the favoured engine
+RESOURCE_BENCH_FENS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+
+
+def host_resources() -> Tuple[int, int]:
+
+    """! Usable cores and available memory of this host
+
+    @return     (cores, available memory in MB).
+    """
+
+    try:
+        cores = len(os.sched_getaffinity(0))   # Respects taskset/cgroup cpu pinning
+    except AttributeError:
+        cores = os.cpu_count() or 1
+
+    memory_mb = 0
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                name, value = line.split(":", 1)
+                if name == "MemAvailable":
+                    memory_mb = int(value.split()[0]) // 1024   # kB
+                    break
+                if name == "MemFree":   # Kernels before 3.14 have no MemAvailable
+                    memory_mb = int(value.split()[0]) // 1024
+    except OSError:
+        pass
+
+    return cores, memory_mb
+
+
+def process_rss(pid: int) -> Optional[int]:
+
+    """! Resident memory of a process
+
+    @param  pid     Process id.
+
+    @return         VmRSS in kB from /proc/<pid>/status, or None if the process is gone.
+    """
+
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def _hash_mb(memory_mb: float) -> int:
+
+    """! Largest power of two MB within the memory, engines size the table in powers of two anyway """
+
+    memory_mb = int(min(max(memory_mb, RESOURCE_HASH_MIN), RESOURCE_HASH_MAX))
+    return 1 << (memory_mb.bit_length() - 1)
+
+
+def plan_resources(policy: str, cores: int, memory_mb: int, share: int = 1) -> Dict[str, dict]:
+
+    """! Split Threads and Hash between the AI and evaluation engine
+
+    @param  policy      One of RESOURCE_POLICIES.
+    @param  cores       Usable cores.
+    @param  memory_mb   Available memory in MB.
+    @param  share       Number of engine pairs on the host (boards/workers), they split the host evenly.
+
+    @return             {"ai": {"Threads", "Hash"}, "eval": {"Threads", "Hash"}}.
+    """
+
+    if policy == "fixed" or memory_mb <= 0:
+        return {"ai": dict(RESOURCE_FIXED), "eval": dict(RESOURCE_FIXED)}
+
+    cores = max(cores // share, 1)
+    hash_total = memory_mb * RESOURCE_HASH_FRACTION / share
+
+    if policy == "balanced":
+        threads = {"ai": max(cores // 2, 1), "eval": max(cores // 2, 1)}
+        hash_share = {"ai": 0.5, "eval": 0.5}
+    else:
+        minor = "eval" if policy == "ai" else "ai"
+        threads = {policy: max(cores - 1, 1), minor: 1}
+        hash_share = {policy: RESOURCE_MAJOR_SHARE, minor: 1 - RESOURCE_MAJOR_SHARE}
+
+    return {engine: {"Threads": threads[engine], "Hash": _hash_mb(hash_total * hash_share[engine])}
+            for engine in ("ai", "eval")}
+
+
+def parser():
+    """! @brief     Parser function to get all the arguments """
+
+    args = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                   description="Benchmark the engine resource policies on this host")
+
+    args.add_argument("-i", "--input", type=str, default="/home/pi/mChessBoard/src/minic_3.04_linux_x32_armv6",
+                      help="path to ai engine")
+    args.add_argument("-e", "--eval", type=str, default="/home/pi/mChessBoard/src/stockfish-12_linux_x32_armv6",
+                      help="path to evaluation engine")
+    args.add_argument("--policies", type=str, default=",".join(RESOURCE_POLICIES),
+                      help="policies to compare, fixed first for the comparison")
+    args.add_argument("--movetime", type=int, default=2000,
+                      help="think time per position in ms")
+
+    return args.parse_args()
+
+
+def _search_nps(engine, movetime: int, results: list):
+
+    """! Search the bench positions, appends the nps of each search """
+
+    for fen in RESOURCE_BENCH_FENS:
+        engine.set_fen_position(fen)
+        search = engine.start_search(movetime=movetime)
+        search.result()
+        if search.last_info and search.last_info.nps:
+            results.append(search.last_info.nps)
+
+
+def benchmark(args):
+
+    """! Run both engines at once with each policy and print their nodes per second """
+
+    cores, memory_mb = host_resources()
+    print(f"{cores} cores, {memory_mb} MB available, {len(RESOURCE_BENCH_FENS)} positions, {args.movetime} ms each")
+    print("\npolicy      ai threads/hash   eval threads/hash      ai knps    eval knps   vs fixed")
+
+    baseline = None
+    for policy in args.policies.split(","):
+        plan = plan_resources(policy, cores, memory_mb)
+        engines = {"ai": Stockfish(args.input, parameters=plan["ai"]),
+                   "eval": Stockfish(args.eval, parameters=plan["eval"])}
+        results = {"ai": [], "eval": []}
+        threads = [threading.Thread(target=_search_nps, args=(engines[name], args.movetime, results[name]))
+                   for name in engines]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        knps = {name: sum(nps) / len(nps) / 1000 if nps else 0.0 for name, nps in results.items()}
+        if policy == "fixed":
+            baseline = knps     # The other policies are compared to the old settings
+        gain = f"{(knps['ai'] + knps['eval']) / (baseline['ai'] + baseline['eval']) - 1:+9.0%}" \
+            if baseline and baseline["ai"] + baseline["eval"] else ""
+        print(f"{policy:10} {plan['ai']['Threads']:6}/{plan['ai']['Hash']:<6} {plan['eval']['Threads']:10}/{plan['eval']['Hash']:<6}"
+              f" {knps['ai']:12.1f} {knps['eval']:12.1f} {gain}")
+        for engine in engines.values():
+            engine.close()  # Before the next policy's engines start
+
+
+if __name__ == "__main__":
+
+    """! @brief    Main function """
+
+    benchmark(parser())
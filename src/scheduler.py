@@ -0,0 +1,349 @@
+"""! @brief     Shared engine pool for hosting several boards in one process
+
+    Every board submits its engine queries to one EngineScheduler. A fixed
+    number of worker threads each own their engine processes and pick the
+    next job with stride scheduling, charging each board the time its jobs
+    ran, so boards get engine time in proportion to their priority and a
+    busy board cannot starve the others. The time a job waits in the queue
+    is recorded per board.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from stockfish import Stockfish
+
+
+class BoardStats:
+
+    """! @brief     Queue statistics for one board """
+
+    __slots__ = ("jobs", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.jobs = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def add(self, wait: float):
+        self.jobs += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+
+class EngineJob:
+
+    """! @brief     A query waiting for or running on an engine worker """
+
+    def __init__(self, board: str, function: Callable):
+        self.board = board
+        self.function = function
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+
+class EngineWorker:
+
+    """! @brief     Engine processes owned by one worker thread """
+
+    def __init__(self, timeout: float):
+        self._engines: Dict[tuple, Stockfish] = {}
+        self._positions: Dict[tuple, tuple] = {}   # Engine key -> (moves, fen) last set on the engine
+        self._timeout = timeout
+
+    def get(self, path: str, parameters: dict, depth: str) -> Stockfish:
+
+        """! Get the worker's engine for a binary and options, at the board's depth
+
+        @info   The engines are kept per option set rather than updated, as options a board
+                sets but another leaves out (e.g. Level) would otherwise carry over.
+
+        @param  path        Path to the engine binary.
+        @param  parameters  UCI options the board uses for this engine.
+        @param  depth       Search depth the board uses for this engine.
+
+        @return             The Stockfish instance.
+        """
+
+        key = (path, frozenset(parameters.items()))
+        engine = self._engines.get(key)
+        if engine is None:
+            engine = Stockfish(path, parameters=parameters, timeout=self._timeout)
+            self._engines[key] = engine
+        engine.set_depth(depth)
+        return engine
+
+    def set_position(self, path: str, parameters: dict, moves: List[str], fen: Optional[str]):
+
+        """! Set the position on the worker's engine for a binary and options, unless it is set already
+
+        @info   set_position starts a new game on the engine (ucinewgame and isready), which
+                clears its hash, so queries of a board on an unchanged position skip it.
+
+        @param  path        Path to the engine binary.
+        @param  parameters  UCI options of the engine.
+        @param  moves       Moves of the position.
+        @param  fen         Start position, None for the standard one.
+        """
+
+        key = (path, frozenset(parameters.items()))
+        position = (tuple(moves), fen)
+        if self._positions.get(key) != position:
+            self._engines[key].set_position(moves, fen)
+            self._positions[key] = position
+
+
+class EngineScheduler:
+
+    """! @brief     Fair, priority weighted scheduler over a pool of engine workers """
+
+    def __init__(self, workers: int = 1, engine_timeout: float = 30.0):
+
+        """! The Contructor
+
+        @param  workers         Number of worker threads (each with its own engine processes).
+        @param  engine_timeout  Seconds without engine output before an engine is restarted.
+        """
+
+        self._engine_timeout = engine_timeout
+        self._condition = threading.Condition()
+        self._queues: Dict[str, deque] = {}
+        self._priority: Dict[str, float] = {}
+        self._pass: Dict[str, float] = {}
+        self._current_pass = 0.0
+        self.stats: Dict[str, BoardStats] = {}
+
+        self._threads: List[threading.Thread] = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name=f"engine-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def register(self, board: str, priority: float = 1):
+
+        """! Register a board with the scheduler
+
+        @param  board       Unique board name.
+        @param  priority    Share of engine time relative to the other boards.
+        """
+
+        with self._condition:
+            self._queues[board] = deque()
+            self._priority[board] = float(priority)
+            self._pass[board] = self._current_pass
+            self.stats[board] = BoardStats()
+
+    def submit(self, board: str, function: Callable) -> EngineJob:
+
+        """! Queue a query for a board
+
+        @param  board       The board the query belongs to.
+        @param  function    Called by a worker with its EngineWorker.
+
+        @return             The queued job, its future holds the result.
+        """
+
+        job = EngineJob(board, function)
+        with self._condition:
+            queue = self._queues[board]
+            if not queue:
+                # An idle board joins at the current pass, it does not bank credit
+                self._pass[board] = max(self._pass[board], self._current_pass)
+            queue.append(job)
+            self._condition.notify()
+        return job
+
+    def remove(self, job: EngineJob) -> bool:
+
+        """! Remove a job which has not been started yet
+
+        @return     True if the job was still queued.
+        """
+
+        with self._condition:
+            try:
+                self._queues[job.board].remove(job)
+            except ValueError:
+                return False
+        job.future.cancel()
+        return True
+
+    def _next_job(self) -> EngineJob:
+        with self._condition:
+            while True:
+                waiting = [board for board, queue in self._queues.items() if queue]
+                if waiting:
+                    break
+                self._condition.wait()
+
+            board = min(waiting, key=lambda name: self._pass[name])
+            self._current_pass = self._pass[board]
+            job = self._queues[board].popleft()
+            self.stats[board].add(time.monotonic() - job.enqueued)
+            return job
+
+    def _work(self):
+        worker = EngineWorker(self._engine_timeout)
+        while True:
+            job = self._next_job()
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            started = time.monotonic()
+            try:
+                result = job.function(worker)
+            except Exception as err:
+                result, error = None, err
+            else:
+                error = None
+            with self._condition:   # Charge the board before its caller can queue the next job
+                self._pass[job.board] += (time.monotonic() - started) / self._priority[job.board]
+            if error is None:
+                job.future.set_result(result)
+            else:
+                job.future.set_exception(error)
+
+    def engine(self, board: str, path: str, parameters: dict, depth: int = 2) -> "PooledEngine":
+
+        """! Create an engine proxy for a board
+
+        @param  board       The board using the engine.
+        @param  path        Path to the engine binary.
+        @param  parameters  UCI options for the engine.
+        @param  depth       Search depth.
+
+        @return             PooledEngine with the same query methods as Stockfish.
+        """
+
+        return PooledEngine(self, board, path, parameters, depth)
+
+    def report(self) -> str:
+
+        """! Per board queue wait summary """
+
+        with self._condition:
+            lines = []
+            for board, stats in self.stats.items():
+                average = stats.wait_total / stats.jobs if stats.jobs else 0.0
+                lines.append(f"{board}: {stats.jobs} jobs, queued {len(self._queues[board])}, "
+                             f"wait avg {average * 1000:.1f} ms, max {stats.wait_max * 1000:.1f} ms")
+            return "\n".join(lines)
+
+
+class PooledSearch:
+
+    """! @brief     A search running on the pool, with the SearchHandle interface """
+
+    def __init__(self, scheduler: EngineScheduler, board: str):
+        self._scheduler = scheduler
+        self._lock = threading.Lock()
+        self._handle = None
+        self.cancelled = False
+        self.cancel_latency: Optional[float] = None
+        self.last_info = None
+        self.job = None
+        self.board = board
+
+    def _run(self, engine: Stockfish, limits: dict) -> Optional[str]:
+        with self._lock:
+            if self.cancelled:
+                return None
+            self._handle = engine.start_search(**limits)
+        best_move = self._handle.result()
+        self.last_info = self._handle.last_info
+        return best_move
+
+    def done(self) -> bool:
+        return self.job.future.done()
+
+    def result(self) -> Optional[str]:
+        if self.cancelled or self.job.future.cancelled():
+            return None
+        return self.job.future.result()
+
+    def cancel(self) -> float:
+        if self.done():
+            return 0.0
+        stop_time = time.monotonic()
+        with self._lock:
+            self.cancelled = True
+            if self._handle is not None:
+                self._handle._engine._put("stop")
+        if not self._scheduler.remove(self.job):
+            self.job.future.result()
+        self.cancel_latency = time.monotonic() - stop_time
+        return self.cancel_latency
+
+
+class PooledEngine:
+
+    """! @brief     Per board engine proxy running every query on the shared pool
+
+    The proxy keeps the board's position and options locally and replays them
+    on whichever worker picks up the query.
+    """
+
+    def __init__(self, scheduler: EngineScheduler, board: str, path: str, parameters: dict, depth: int = 2):
+        self._scheduler = scheduler
+        self._board = board
+        self._path = path
+        self._parameters = dict(parameters)
+        self._moves: List[str] = []
+        self._fen: Optional[str] = None
+        self._listeners: List[Callable] = []
+        self.depth = str(depth)
+
+    def _sync(self, worker: EngineWorker) -> Stockfish:
+        engine = worker.get(self._path, self._parameters, self.depth)
+        worker.set_position(self._path, self._parameters, self._moves, self._fen)
+        return engine
+
+    def _call(self, name: str, *arguments):
+        job = self._scheduler.submit(self._board, lambda worker: getattr(self._sync(worker), name)(*arguments))
+        return job.future.result()
+
+    def get_parameters(self) -> dict:
+        return self._parameters
+
+    def set_depth(self, depth_value: int = 2):
+        self.depth = str(depth_value)
+
+    def close(self):
+        pass    # The worker engines are shared, they run as long as the scheduler
+
+    def set_position(self, moves: List[str] = None, fen: Optional[str] = None):
+        self._moves = list(moves) if moves else []
+        self._fen = fen
+
+    def is_move_correct(self, move_value: str) -> bool:
+        return self._call("is_move_correct", move_value)
+
+    def get_evaluation(self) -> dict:
+        return self._call("get_evaluation")
+
+    def get_top_moves(self, num_top_moves: int = 5) -> List[dict]:
+        return self._call("get_top_moves", num_top_moves)
+
+    def get_board_visual(self) -> str:
+        return self._call("get_board_visual")
+
+    def get_fen_position(self) -> str:
+        return self._call("get_fen_position")
+
+    def get_best_move(self) -> Optional[str]:
+        return self.start_search(depth=self.depth).result()
+
+    def add_best_move_listener(self, listener: Callable):
+        self._listeners.append(listener)
+
+    def _notify(self, future: Future):
+        for listener in self._listeners:
+            listener()
+
+    def start_search(self, **limits) -> PooledSearch:
+        search = PooledSearch(self._scheduler, self._board)
+        search.job = self._scheduler.submit(self._board, lambda worker: search._run(self._sync(worker), limits))
+        search.job.future.add_done_callback(self._notify)
+        return search
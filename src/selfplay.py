@@ -0,0 +1,243 @@
+"""! @brief     Engine vs engine tournament to calibrate the difficulty settings
+
+    Plays games between the AI engine at different difficulties (see
+    difficulty.py) on a process pool, several games at once. Every worker
+    keeps one engine per difficulty. Games start from a few random plies so
+    they differ, and colours alternate between games.
+
+    The report shows the score and Elo difference per pairing and the think
+    time distribution per difficulty, so settings can be picked that are both
+    graded in strength and fast enough on the board's hardware. With -o the
+    raw games are written as JSON for further analysis.
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from itertools import combinations
+from typing import Dict, List, Tuple
+
+import chess
+
+from difficulty import DIFFICULTY_MAX, DIFFICULTY_MIN, difficulty_elo, difficulty_parameters
+from stockfish import Stockfish
+
+SELFPLAY_MAX_ELO_DIFF = 800     # Elo difference reported for a 100% score
+
+_engines: Dict[int, Stockfish] = {}
+_settings: dict = {}
+
+
+def parser():
+    """! @brief     Parser function to get all the arguments """
+
+    args = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                   description="Play the AI engine against itself at different difficulties")
+
+    args.add_argument("-i", "--input", type=str, default="/home/pi/mChessBoard/src/minic_3.04_linux_x32_armv6",
+                      help="path to ai engine")
+    args.add_argument("--difficulties", type=str, default=f"{DIFFICULTY_MIN}-{DIFFICULTY_MAX}",
+                      help="difficulties to play, e.g. 0-8 or 1,3,5")
+    args.add_argument("--pairing", choices=["adjacent", "roundrobin"], default="adjacent",
+                      help="play neighbouring difficulties only, or every pair")
+    args.add_argument("-g", "--games", type=int, default=10,
+                      help="games per pairing")
+    args.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                      help="number of games played at once")
+    args.add_argument("--think", choices=["depth", "movetime", "nodes"], default="depth",
+                      help="how the engine limits its thinking, as on the board")
+    args.add_argument("--depth", type=int, default=2,
+                      help="search depth per move")
+    args.add_argument("--movetime", type=int, default=2000,
+                      help="think time per move in ms")
+    args.add_argument("--nodes", type=int, default=20000,
+                      help="nodes per move")
+    args.add_argument("--random_plies", type=int, default=4,
+                      help="random opening plies before the engines take over")
+    args.add_argument("--max_plies", type=int, default=300,
+                      help="adjudicate a draw after this many plies")
+    args.add_argument("--seed", type=int, default=1,
+                      help="seed for the random openings")
+    args.add_argument("-o", "--output", type=str, default="",
+                      help="json file for the raw games")
+
+    return args.parse_args()
+
+
+def parse_difficulties(text: str) -> List[int]:
+
+    """! Parse "0-8" or "1,3,5" into a list of difficulties """
+
+    difficulties = set()
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        difficulties.update(range(int(first), int(last or first) + 1))
+
+    return sorted(d for d in difficulties if DIFFICULTY_MIN <= d <= DIFFICULTY_MAX)
+
+
+def _init_worker(path: str, limits: dict, max_plies: int):
+
+    """! Worker setup, engines are started on first use per difficulty """
+
+    global _settings
+    _settings = {"path": path, "limits": limits, "max_plies": max_plies}
+
+
+def _engine(difficulty: int) -> Stockfish:
+    engine = _engines.get(difficulty)
+    if engine is None:
+        engine = Stockfish(_settings["path"], parameters=difficulty_parameters(difficulty))
+        _engines[difficulty] = engine
+    return engine
+
+
+def play_game(game: Tuple[int, int, int, List[str]]) -> dict:
+
+    """! Play one game, runs in a worker
+
+    @param  game    (game number, white difficulty, black difficulty, opening moves in UCI).
+
+    @return         Dictionary with the players, result, moves and think times in ms per side.
+    """
+
+    number, white, black, opening = game
+    board = chess.Board()
+    for move in opening:
+        board.push_uci(move)
+
+    players = {chess.WHITE: white, chess.BLACK: black}
+    think_ms = {chess.WHITE: [], chess.BLACK: []}
+    for engine in {_engine(white), _engine(black)}:
+        engine.set_position([])     # ucinewgame
+
+    while not board.is_game_over(claim_draw=True) and board.ply() < _settings["max_plies"]:
+        engine = _engine(players[board.turn])
+        engine.set_position([move.uci() for move in board.move_stack])
+
+        start = time.monotonic()
+        move = engine.start_search(**_settings["limits"]).result()
+        think_ms[board.turn].append(round((time.monotonic() - start) * 1000, 1))
+
+        if move is None:
+            break
+        board.push_uci(move)
+
+    outcome = board.outcome(claim_draw=True)
+    result = outcome.result() if outcome else "1/2-1/2"    # Adjudicated at max plies
+
+    return {"game": number, "white": white, "black": black, "result": result,
+            "moves": [move.uci() for move in board.move_stack],
+            "think_white": think_ms[chess.WHITE], "think_black": think_ms[chess.BLACK]}
+
+
+def random_opening(rng: random.Random, plies: int) -> List[str]:
+
+    """! Random legal moves from the starting position """
+
+    board = chess.Board()
+    for _ in range(plies):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        board.push(rng.choice(moves))
+
+    return [move.uci() for move in board.move_stack]
+
+
+def elo_difference(score: float) -> float:
+
+    """! Elo difference from a score fraction (0 to 1) """
+
+    if score <= 0:
+        return -SELFPLAY_MAX_ELO_DIFF
+    if score >= 1:
+        return SELFPLAY_MAX_ELO_DIFF
+    return -400 * math.log10(1 / score - 1)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def report(results: List[dict], difficulties: List[int]):
+
+    """! Print score per pairing and think times per difficulty """
+
+    pairs: Dict[Tuple[int, int], List[float]] = {}
+    for game in results:
+        low, high = sorted((game["white"], game["black"]))
+        points = {"1-0": 1.0, "0-1": 0.0}.get(game["result"], 0.5)
+        if game["white"] != low:
+            points = 1.0 - points
+        pairs.setdefault((low, high), []).append(points)    # From the lower difficulty's view
+
+    print("\npairing      games   score (lower difficulty)   elo gain of higher (nominal)")
+    for (low, high), points in sorted(pairs.items()):
+        score = sum(points) / len(points)
+        print(f"{low} vs {high}  {len(points):8} {score * 100:6.1f}% {-elo_difference(score):+8.0f} "
+              f"({difficulty_elo(high) - difficulty_elo(low):+d})")
+
+    print("\ndifficulty   moves    mean     p50     p90     p99     max   (think ms)")
+    for difficulty in difficulties:
+        think = []
+        for game in results:
+            if game["white"] == difficulty:
+                think += game["think_white"]
+            if game["black"] == difficulty:
+                think += game["think_black"]
+        if think:
+            print(f"{difficulty:10} {len(think):7} {sum(think) / len(think):7.1f} {percentile(think, 0.5):7.1f} "
+                  f"{percentile(think, 0.9):7.1f} {percentile(think, 0.99):7.1f} {max(think):7.1f}")
+
+
+def run(args):
+
+    """! Play the tournament and report """
+
+    difficulties = parse_difficulties(args.difficulties)
+    if args.pairing == "adjacent":
+        pairings = list(zip(difficulties, difficulties[1:]))
+    else:
+        pairings = list(combinations(difficulties, 2))
+
+    limits = {"depth": {"depth": args.depth}, "movetime": {"movetime": args.movetime},
+              "nodes": {"nodes": args.nodes}}[args.think]
+
+    rng = random.Random(args.seed)
+    games = []
+    for low, high in pairings:
+        for index in range(args.games):
+            # Alternate colours, both colours get the same opening
+            opening = random_opening(rng, args.random_plies) if index % 2 == 0 else games[-1][3]
+            white, black = (low, high) if index % 2 == 0 else (high, low)
+            games.append((len(games) + 1, white, black, opening))
+
+    print(f"{len(games)} games, {len(pairings)} pairings, {args.workers} workers, think {limits}")
+
+    start = time.monotonic()
+    results = []
+    with multiprocessing.Pool(args.workers, _init_worker, (args.input, limits, args.max_plies)) as pool:
+        for game in pool.imap_unordered(play_game, games):
+            results.append(game)
+            print(f"{len(results)}/{len(games)} game {game['game']}: {game['white']} vs {game['black']} "
+                  f"{game['result']} ({len(game['moves'])} plies)")
+
+    print(f"\n{len(results)} games in {time.monotonic() - start:.1f} s")
+    report(results, difficulties)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(sorted(results, key=lambda game: game["game"]), output, indent=1)
+
+
+if __name__ == "__main__":
+
+    """! @brief    Main function """
+
+    run(parser())
@@ -0,0 +1,129 @@
+"""! @brief     Binary trace of the raw sensor input of a board
+
+    Records every read of the field expanders, every field interrupt and
+    every button press with its monotonic time, so input seen at a
+    tournament can be replayed later without the board (see replay.py).
+
+    The file starts with a header (magic, version, wall clock start time)
+    followed by fixed size records:
+
+        time    double      seconds since the recorder started
+        kind    uint8       TRACE_READ, TRACE_FIELD or TRACE_BUTTON
+        source  uint8       expander index (0 = files ab .. 3 = gh) or GPIO pin
+        value   uint16      port bits of a read (bit i = port[i]),
+                            held buttons of a press (bit i = TRACE_BUTTONS[i])
+"""
+
+import struct
+import threading
+import time
+from typing import Iterator, List, Tuple
+
+TRACE_MAGIC = b"MCBT"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct("<4sBd")   # magic, version, start time (epoch)
+TRACE_RECORD = struct.Struct("<dBBH")   # time, kind, source, value
+
+TRACE_READ = 0          # Read of a field expander
+TRACE_FIELD = 1         # Field interrupt
+TRACE_BUTTON = 2        # Button press
+
+TRACE_EXPANDERS = ("pcf_row_ab", "pcf_row_cd", "pcf_row_ef", "pcf_row_gh")     # ChessBoard attributes by index
+TRACE_BUTTONS = ("but_white", "but_confirm", "but_back", "but_black")           # ChessBoard attributes by bit
+
+
+def port_bits(port: List[bool]) -> int:
+    return sum(1 << i for i, high in enumerate(port) if high)
+
+
+def bits_port(bits: int) -> List[bool]:
+    return [bool(bits >> i & 1) for i in range(16)]
+
+
+class TracedExpander:
+
+    """! @brief     A field expander whose port reads are recorded """
+
+    def __init__(self, pcf, index: int, recorder: "TraceRecorder"):
+        self.pcf = pcf
+        self.index = index
+        self.recorder = recorder
+
+    @property
+    def port(self) -> List[bool]:
+        port = list(self.pcf.port)     # One snapshot, so the trace holds the values the board acts on
+        self.recorder.write(TRACE_READ, self.index, port_bits(port))
+        return port
+
+    @port.setter
+    def port(self, port: List[bool]):
+        self.pcf.port = port
+
+
+class TraceRecorder:
+
+    """! @brief     Writes the input of one board to a trace file """
+
+    def __init__(self, path: str):
+
+        """! The Contructor
+
+        @param  path    Trace file, overwritten.
+        """
+
+        self.path = path
+        self.records = 0
+        self.start = time.monotonic()
+
+        self._lock = threading.Lock()   # Presses are recorded from the GPIO callback threads
+        self._file = open(path, "wb")
+        self._file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, time.time()))
+
+    def attach(self, board):
+
+        """! Record the expander reads of a board, and its interrupts and presses
+
+        @param  board   ChessBoard, its callbacks report to board.trace.
+        """
+
+        for index, name in enumerate(TRACE_EXPANDERS):
+            setattr(board, name, TracedExpander(getattr(board, name), index, self))
+        board.row_pairs = {io: (getattr(board, TRACE_EXPANDERS[file // 2]), file)
+                           for io, (_, file) in board.row_pairs.items()}
+        board.trace = self
+
+    def write(self, kind: int, source: int, value: int):
+
+        """! Add a record, input events are flushed right away so a crash keeps them """
+
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(TRACE_RECORD.pack(time.monotonic() - self.start, kind, source, value))
+            self.records += 1
+            if kind != TRACE_READ:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_trace(path: str) -> Tuple[float, Iterator[Tuple[float, int, int, int]]]:
+
+    """! Open a trace
+
+    @param  path    Trace file.
+
+    @return         (wall clock start time, iterator of (time, kind, source, value)).
+    """
+
+    with open(path, "rb") as trace:
+        data = trace.read()
+
+    magic, version, started = TRACE_HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError(f"{path}: not a version {TRACE_VERSION} board trace")
+
+    end = TRACE_HEADER.size + (len(data) - TRACE_HEADER.size) // TRACE_RECORD.size * TRACE_RECORD.size  # A cut off last record is skipped
+    return started, TRACE_RECORD.iter_unpack(data[TRACE_HEADER.size:end])
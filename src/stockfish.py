@@ -5,16 +5,544 @@
     :license: MIT, see LICENSE for more details.
 """
 
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import socket
 import subprocess
-from typing import Any, List, Optional
+import threading
+import queue
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import copy
 
+ENGINE_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "mchessboard", "engines.json")
+ENGINE_CONNECT_TIMEOUT = 5.0  # Seconds to connect to a remote engine
+
+
+def _supervised(method: Callable) -> Callable:
+    """Restarts the engine and retries the query once if the engine crashed or hung."""
+
+    @functools.wraps(method)
+    def wrapper(self: "Stockfish", *args: Any, **kwargs: Any) -> Any:
+        try:
+            return method(self, *args, **kwargs)
+        except (BrokenPipeError, TimeoutError) as err:
+            self._recover(err)
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class InfoLine:
+    """One parsed "info" line of engine output. Fields missing from the line are None."""
+
+    __slots__ = (
+        "depth",
+        "seldepth",
+        "multipv",
+        "score_type",
+        "score",
+        "bound",
+        "pv",
+        "nodes",
+        "nps",
+        "time",
+        "hashfull",
+        "tbhits",
+    )
+
+    def __init__(self) -> None:
+        self.depth: Optional[int] = None
+        self.seldepth: Optional[int] = None
+        self.multipv: int = 1
+        self.score_type: Optional[str] = None  # "cp" or "mate", relative to the side to move
+        self.score: Optional[int] = None
+        self.bound: Optional[str] = None  # "lowerbound", "upperbound" or None for an exact score
+        self.pv: Optional[List[str]] = None
+        self.nodes: Optional[int] = None
+        self.nps: Optional[int] = None
+        self.time: Optional[int] = None
+        self.hashfull: Optional[int] = None
+        self.tbhits: Optional[int] = None
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__ if getattr(self, name) is not None)
+        return f"InfoLine({fields})"
+
+
+class BestMove:
+    """The parsed "bestmove" line ending a search."""
+
+    __slots__ = ("move", "ponder")
+
+    def __init__(self, move: Optional[str], ponder: Optional[str] = None) -> None:
+        self.move = move  # None if there are no legal moves
+        self.ponder = ponder
+
+    def __repr__(self) -> str:
+        return f"BestMove(move={self.move!r}, ponder={self.ponder!r})"
+
+
+_INFO_INT_FIELDS = frozenset(("depth", "seldepth", "multipv", "nodes", "nps", "time", "hashfull", "tbhits"))
+
+
+def parse_line(text: str) -> Any:
+    """Parses one line of engine output in a single pass over its tokens.
+
+    Args:
+        text:
+          The line, without the trailing newline.
+
+    Returns:
+        An InfoLine, a BestMove, or None for any other line (including "info string").
+    """
+    if text.startswith("bestmove"):
+        splitted_text = text.split(" ")
+        move = splitted_text[1] if len(splitted_text) > 1 and splitted_text[1] != "(none)" else None
+        ponder = splitted_text[3] if len(splitted_text) > 3 and splitted_text[2] == "ponder" else None
+        return BestMove(move, ponder)
+    if not text.startswith("info ") or text.startswith("info string"):
+        return None
+
+    info = InfoLine()
+    splitted_text = text.split(" ")
+    length = len(splitted_text)
+    n = 1
+    while n < length:
+        token = splitted_text[n]
+        if token in _INFO_INT_FIELDS and n + 1 < length:
+            setattr(info, token, int(splitted_text[n + 1]))
+            n += 2
+        elif token == "score" and n + 2 < length:
+            info.score_type = splitted_text[n + 1]
+            info.score = int(splitted_text[n + 2])
+            n += 3
+            if n < length and splitted_text[n] in ("lowerbound", "upperbound"):
+                info.bound = splitted_text[n]
+                n += 1
+        elif token == "pv":
+            info.pv = splitted_text[n + 1:]
+            break
+        elif token == "string":
+            break
+        else:
+            n += 1
+    return info
+
+
+_OPTION_FIELDS = ("name", "type", "default", "min", "max", "var")
+
+
+class EngineCapabilities:
+    """Identity and UCI options of an engine binary, parsed from its "uci" response."""
+
+    def __init__(self, name: str = "", author: str = "", options: Optional[Dict[str, dict]] = None) -> None:
+        self.name = name
+        self.author = author
+        self.options: Dict[str, dict] = options or {}  # Option name -> {"type", "default", "min", "max", "var"}
+        self._supported = {option.lower() for option in self.options}  # Option names are case insensitive
+
+    @classmethod
+    def parse(cls, lines: List[str]) -> "EngineCapabilities":
+        """Parses the "id" and "option" lines the engine sends before "uciok".
+
+        Args:
+            lines:
+              The response lines.
+
+        Returns:
+            The capabilities.
+        """
+        capabilities = cls()
+        for text in lines:
+            splitted_text = text.split(" ")
+            if splitted_text[0] == "id" and len(splitted_text) > 2:
+                setattr(capabilities, splitted_text[1], " ".join(splitted_text[2:]))
+            elif splitted_text[0] == "option":
+                # Names and values may contain spaces, so collect the tokens up to the next keyword
+                option: Dict[str, Any] = {}
+                field = None
+                for token in splitted_text[1:]:
+                    if token in _OPTION_FIELDS and not (field == "name" and token != "type"):
+                        field = token
+                        if field == "var":
+                            option.setdefault("var", []).append("")
+                    elif field == "var":
+                        option["var"][-1] = f"{option['var'][-1]} {token}".strip()
+                    elif field is not None:
+                        option[field] = f"{option.get(field, '')} {token}".strip()
+                if "name" in option:
+                    capabilities.options[option.pop("name")] = option
+        capabilities._supported = {option.lower() for option in capabilities.options}
+        return capabilities
+
+    @property
+    def major_version(self) -> Optional[int]:
+        """Major version of a Stockfish engine ("Stockfish 12" is 12), None for other engines."""
+        match = re.match(r"Stockfish (\d+)", self.name)
+        return int(match.group(1)) if match else None
+
+    def supports(self, option: str) -> bool:
+        """Returns True if the engine has the UCI option."""
+        return option.lower() in self._supported
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "author": self.author, "options": self.options}
+
+    def __repr__(self) -> str:
+        return f"EngineCapabilities(name={self.name!r}, {len(self.options)} options)"
+
+
+_binary_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def _binary_hash(path: str) -> Optional[str]:
+    """Returns the sha256 of the engine binary, or None if the path is not a file.
+
+    The hash is computed once per process for each (file, mtime, size).
+    """
+    path = shutil.which(path) or path
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _binary_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as binary:
+            for chunk in iter(lambda: binary.read(1 << 20), b""):
+                digest.update(chunk)
+        _binary_hashes[key] = digest.hexdigest()
+    return _binary_hashes[key]
+
+
+def _read_cache(cache_path: str) -> dict:
+    try:
+        with open(cache_path) as cache:
+            return json.load(cache)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(cache_path: str, binary_hash: str, capabilities: EngineCapabilities) -> None:
+    """Adds an engine to the cache file, written atomically as several processes may start engines at once."""
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        cache = _read_cache(cache_path)
+        cache[binary_hash] = capabilities.to_dict()
+        temporary = f"{cache_path}.{os.getpid()}"
+        with open(temporary, "w") as output:
+            json.dump(cache, output, indent=1)
+        os.replace(temporary, cache_path)
+    except OSError:
+        pass  # Read only file system, probe again next time
+
+
+class ProcessTransport:
+    """UCI over the stdin/stdout of an engine started as a child process."""
+
+    def __init__(self, path: str) -> None:
+        try:
+            self.process = subprocess.Popen(path, universal_newlines=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except PermissionError as err:
+            print(err)
+            print("Try 'chmod +x' your engine")
+            raise
+        self.lines = self.process.stdout  # Iterating yields the output lines until the engine exits
+        self.pid: Optional[int] = self.process.pid
+
+    def write(self, text: str) -> None:
+        if not self.process.stdin or self.process.poll() is not None:
+            raise BrokenPipeError(f"engine exited with {self.process.returncode}")
+        self.process.stdin.write(text)
+        self.process.stdin.flush()
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def close(self) -> None:
+        self.process.kill()
+        self.process.wait()
+
+
+class SocketTransport:
+    """UCI over a connection to engine_server.py, "tcp://host:port" or "unix:///path/to/socket".
+
+    The connection is kept for all the requests of the engine and only made
+    again when the engine is recovered after an error.
+    """
+
+    def __init__(self, address: str, timeout: float = ENGINE_CONNECT_TIMEOUT) -> None:
+        scheme, _, location = address.partition("://")
+        if scheme == "unix":
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(location)
+        else:
+            host, _, port = location.rpartition(":")
+            self._socket = socket.create_connection((host, int(port)), timeout)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Commands are single short lines
+        self._socket.settimeout(None)  # Reads time out in the Stockfish wrapper instead
+        self.lines = self._socket.makefile("r", encoding="utf-8", newline="\n")
+        self.pid: Optional[int] = None  # The engine runs on the server
+        self._closed = False
+
+    def write(self, text: str) -> None:
+        if self._closed:
+            raise BrokenPipeError("engine connection closed")
+        try:
+            self._socket.sendall(text.encode())
+        except OSError as err:
+            raise BrokenPipeError(f"engine connection lost: {err}") from None
+
+    def alive(self) -> bool:
+        return not self._closed
+
+    def close(self) -> None:
+        self._closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)  # Wakes the output reader
+        except OSError:
+            pass
+        self._socket.close()
+
+
+def open_transport(path: str) -> Any:
+    """Opens the transport for an engine path.
+
+    Args:
+        path:
+          Engine binary, or "tcp://host:port" / "unix:///path" of an engine_server.py.
+
+    Returns:
+        A SocketTransport or a ProcessTransport.
+    """
+    if path.startswith(("tcp://", "unix://")):
+        return SocketTransport(path)
+    return ProcessTransport(path)
+
+
+class RequestLatency:
+    """Count, average and worst of a kind of engine request, in seconds."""
+
+    __slots__ = ("count", "total", "worst", "last")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.last: Optional[float] = None
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.worst = max(self.worst, seconds)
+        self.last = seconds
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def __repr__(self) -> str:
+        return f"{self.count} requests, avg {self.average * 1000:.1f} ms, max {self.worst * 1000:.1f} ms"
+
+
+class SearchHandle:
+    """A search running on the engine which can be polled, iterated or cancelled.
+
+    Iterating over the handle yields an InfoLine for every info line until the
+    engine sends its best move.
+    """
+
+    def __init__(
+        self,
+        engine: Optional["Stockfish"] = None,
+        best_move: Optional[str] = None,
+        on_info: Optional[Callable[[InfoLine], None]] = None,
+    ) -> None:
+        """Creates a handle for a search.
+
+        Args:
+            engine:
+              The engine running the search, or None for a search that is already done
+              (e.g. a move taken from an opening book).
+            best_move:
+              The result of a search that is already done.
+            on_info:
+              Optional callback for every InfoLine of the search.
+        """
+        self._engine = engine
+        self._on_info = on_info
+        self._done = engine is None
+        self._best_move = best_move
+        self.cancelled = False
+        self.cancel_latency: Optional[float] = None
+        self.info: str = ""
+        self.last_info: Optional[InfoLine] = None  # Latest line with throughput data (nodes/nps/time)
+        self.started = time.monotonic()
+        self.command: Optional[str] = None  # The go command, resent if the engine is restarted
+        self._recovered = False
+        self._last_output = self.started
+
+    def _read(self, wait: bool = True) -> Optional[str]:
+        try:
+            if wait:
+                text = self._engine._read_line()
+            else:
+                text = self._engine._read_line_nowait()
+                if text is None:
+                    # Polled searches detect a hung engine by the time since its last output
+                    if time.monotonic() - self._last_output > self._engine.timeout:
+                        raise TimeoutError(f"no engine output for {self._engine.timeout} s")
+                    return None
+            self._last_output = time.monotonic()
+            return text
+        except (BrokenPipeError, TimeoutError) as err:
+            if self._recovered or self.command is None:
+                raise
+            # Restart the engine once and search again from the same position
+            self._recovered = True
+            self._engine._recover(err)
+            self._engine._search = self
+            self._engine._put(self.command)
+            self._last_output = time.monotonic()
+            return None
+
+    def _handle_line(self, text: str) -> Optional[InfoLine]:
+        record = parse_line(text)
+        if record is None:
+            return None
+        if record.__class__ is BestMove:
+            self._best_move = record.move
+            self._done = True
+            if not self.cancelled and self.last_info is not None and self.last_info.time is not None:
+                # Wall time the engine did not report as search time, i.e. transport and scheduling
+                overhead = time.monotonic() - self.started - self.last_info.time / 1000
+                self._engine.search_latency.add(max(overhead, 0.0))
+            self._engine.info = self.info
+            self._engine.last_search = self.last_info
+            self._engine._search = None
+            return None
+        self.info = text
+        if record.nodes is not None:
+            self.last_info = record
+        if self._on_info is not None:
+            self._on_info(record)
+        return record
+
+    def __iter__(self):
+        while not self._done:
+            text = self._read()
+            record = self._handle_line(text) if text is not None else None
+            if record is not None:
+                yield record
+
+    def done(self) -> bool:
+        """Checks if the search has finished, without blocking.
+
+        Returns:
+            True, if the engine has sent its best move.
+        """
+        while not self._done:
+            text = self._read(wait=False)
+            if text is None:
+                break
+            self._handle_line(text)
+        return self._done
+
+    def result(self) -> Optional[str]:
+        """Waits for the search to finish.
+
+        Returns:
+            A string of move in algebraic notation or None, if it's a mate now or the search was cancelled.
+        """
+        while not self._done:
+            text = self._read()
+            if text is not None:
+                self._handle_line(text)
+        return self._best_move
+
+    def cancel(self) -> float:
+        """Stops the search and drains the engine output up to the best move,
+        so the engine is ready for the next command.
+
+        Returns:
+            Seconds from sending stop until the engine was idle (0.0 if already done).
+        """
+        if self._done:
+            return 0.0
+        stop_time = time.monotonic()
+        try:
+            self._engine._put("stop")
+            self.result()
+        except (BrokenPipeError, TimeoutError):
+            # The engine is gone, the next query restarts it
+            self._done = True
+            self._engine._search = None
+        self._best_move = None
+        self.cancelled = True
+        self.cancel_latency = time.monotonic() - stop_time
+        self._engine.last_cancel_latency = self.cancel_latency
+        return self.cancel_latency
+
+
+class Analysis:
+    """Continuous analysis of the current position, updated as the depth increases."""
+
+    def __init__(self, engine: "Stockfish", num_lines: int, on_update: Optional[Callable[["Analysis"], None]] = None) -> None:
+        """Creates the analysis state.
+
+        Args:
+            engine:
+              The engine running the analysis.
+            num_lines:
+              Number of principal variations (MultiPV) to keep.
+            on_update:
+              Optional callback, called when the best lines change.
+        """
+        self._engine = engine
+        self.num_lines = num_lines
+        self.on_update = on_update
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the lines of the previous position."""
+        self.depth = 0
+        self.lines: List[dict] = []
+        self._latest: dict = {}
+
+    def _handle_info(self, info: InfoLine) -> None:
+        if info.pv is None or info.score_type is None or info.depth is None or info.multipv > self.num_lines:
+            return
+        score = info.score * (1 if self._engine._white_to_move else -1)
+        self._latest[info.multipv] = {
+            "Move": info.pv[0],
+            "Centipawn": score if info.score_type == "cp" else None,
+            "Mate": score if info.score_type == "mate" else None,
+            "Depth": info.depth,
+            "PV": info.pv,
+        }
+        if info.multipv == 1:
+            self.depth = info.depth
+        self.lines = [self._latest[n] for n in sorted(self._latest)]
+        if self.on_update is not None:
+            self.on_update(self)
+
 
 class Stockfish:
     """Integrates the Stockfish chess engine with Python."""
 
     def __init__(
-        self, path: str = "stockfish", depth: int = 2, parameters: dict = None
+        self,
+        path: str = "stockfish",
+        depth: int = 2,
+        parameters: dict = None,
+        timeout: float = 30.0,
+        capability_cache: Optional[str] = ENGINE_CACHE_PATH,
     ) -> None:
         self.default_stockfish_params = {
             "Write Debug Log": "false",
@@ -32,22 +560,33 @@ class Stockfish:
             "UCI_LimitStrength": "false",
             "UCI_Elo": 1350,
         }
-        try:
-            self.stockfish = subprocess.Popen(
-                path, universal_newlines=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE
-            )
-        except PermissionError as err:
-            print(err)
-            print("Try 'chmod +x' your engine")
+        self._path = path
+        self.timeout = timeout  # Max seconds to wait for a line of engine output
+        self.transport: Any = None  # ProcessTransport or SocketTransport, see open_transport
+        self.sync_latency = RequestLatency()  # isready round trips
+        self.search_latency = RequestLatency()  # Search wall time beyond the engine's own search time
+        self._search: Optional[SearchHandle] = None
+        self.last_cancel_latency: Optional[float] = None
+        self.analysis: Optional[Analysis] = None
+        self.last_search: Optional[InfoLine] = None  # Throughput (nodes/nps/time) of the last finished search
+        self._white_to_move = True
+        self._position_command: Optional[str] = None
+        self._listeners: List[Callable[[], None]] = []
+        self.restart_count = 0
+        self.last_recovery_time: Optional[float] = None
 
-        """
-        # This version stuff is not working when using other engines
-        self._stockfish_major_version: int = int(
-            self._read_line().split(" ")[1].split(".")[0]
-        )
-        """
+        # Capabilities of a known binary come from the cache, others are probed once by _start
+        self._capability_cache = capability_cache
+        self._binary_hash = _binary_hash(path) if capability_cache else None
+        self.capabilities: Optional[EngineCapabilities] = None
+        if self._binary_hash is not None:
+            cached = _read_cache(capability_cache).get(self._binary_hash)
+            if cached is not None:
+                self.capabilities = EngineCapabilities(**cached)
 
-        self._put("uci")
+        self._start()
+
+        self._stockfish_major_version: Optional[int] = self.capabilities.major_version
 
         self.depth = str(depth)
         self.info: str = ""
@@ -69,6 +608,22 @@ class Stockfish:
         """
         return self._parameters
 
+    @_supervised
+    def update_engine_parameters(self, parameters: dict) -> None:
+        """Updates the stockfish parameters, only sending the options that changed.
+
+        Args:
+            parameters:
+              Dictionary of the parameters to update.
+
+        Returns:
+            None
+        """
+        for name, value in parameters.items():
+            if self._parameters.get(name) != value:
+                self._set_option(name, value)
+                self._parameters[name] = value
+
     def reset_parameters(self) -> None:
         """Resets the stockfish parameters.
 
@@ -85,32 +640,145 @@ class Stockfish:
         self._is_ready()
         self.info = ""
 
+    def _start(self) -> None:
+        self.transport = open_transport(self._path)
+
+        # Engine output is read by a thread, so searches can be polled without blocking
+        self._output: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._reader = threading.Thread(
+            target=self._read_output, args=(self.transport.lines, self._output, self._listeners), daemon=True
+        )
+        self._reader.start()
+
+        self._put("uci")
+        if self.capabilities is None:
+            self.capabilities = self._probe()
+            if self._binary_hash is not None:
+                _write_cache(self._capability_cache, self._binary_hash, self.capabilities)
+
+    def _probe(self) -> EngineCapabilities:
+        """Reads the response to "uci" up to "uciok"."""
+        lines = []
+        while True:
+            text = self._read_line()
+            if text == "uciok":
+                return EngineCapabilities.parse(lines)
+            lines.append(text)
+
+    def _recover(self, error: Exception) -> None:
+        """Restarts a crashed or hung engine, reapplies the parameters and the
+        current position, so the interrupted query can be retried."""
+        start = time.monotonic()
+        print(f"Engine {self._path} failed ({error!r}), restarting")
+        self._search = None
+        if self.transport is not None:
+            self.transport.close()
+        self._start()
+        for name, value in list(self._parameters.items()):
+            self._set_option(name, value)
+        self._prepare_for_new_position(True)
+        if self._position_command is not None:
+            self._put(self._position_command)
+        self.restart_count += 1
+        self.last_recovery_time = time.monotonic() - start
+        print(f"Engine {self._path} restarted ({self.restart_count} restarts, recovered in {self.last_recovery_time:.2f} s)")
+
+    def _set_position_command(self, command: str) -> None:
+        self._position_command = command
+        self._put(command)
+
     def _put(self, command: str) -> None:
-        if not self.stockfish.stdin:
-            raise BrokenPipeError()
-        self.stockfish.stdin.write(f"{command}\n")
-        self.stockfish.stdin.flush()
+        self.transport.write(f"{command}\n")
+
+    @staticmethod
+    def _read_output(
+        lines: Any, output: "queue.Queue[Optional[str]]", listeners: List[Callable[[], None]]
+    ) -> None:
+        try:
+            for text in lines:
+                output.put(text.strip())
+                if listeners and text.startswith("bestmove"):
+                    for listener in listeners:
+                        listener()
+        except (OSError, ValueError):  # Connection reset or closed while reading
+            pass
+        output.put(None)  # The engine closed its output
+
+    def add_best_move_listener(self, listener: Callable[[], None]) -> None:
+        """Calls the listener from the output reader thread whenever a search finishes.
+
+        The best move is already queued when the listener is called, so a
+        SearchHandle polled in response is done.
+
+        Args:
+            listener:
+              Callable without arguments, it must not block.
+        """
+        self._listeners.append(listener)
 
     def _read_line(self) -> str:
-        if not self.stockfish.stdout:
-            raise BrokenPipeError()
-        return self.stockfish.stdout.readline().strip()
+        try:
+            text = self._output.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"no engine output for {self.timeout} s") from None
+        if text is None:
+            raise BrokenPipeError("engine closed its output")
+        return text
+
+    def _read_line_nowait(self) -> Optional[str]:
+        try:
+            text = self._output.get_nowait()
+        except queue.Empty:
+            return None
+        if text is None:
+            raise BrokenPipeError("engine closed its output")
+        return text
+
+    def _idle(self) -> None:
+        if self._search is not None:
+            self._search.cancel()
 
     def _set_option(self, name: str, value: Any) -> None:
+        if not self.capabilities.supports(name):
+            return  # Unknown options are at best ignored by the engine, and cost a round trip
         self._put(f"setoption name {name} value {value}")
         self._is_ready()
 
     def _is_ready(self) -> None:
+        self._idle()
+        start = time.monotonic()
         self._put("isready")
         while True:
             if self._read_line() == "readyok":
+                self.sync_latency.add(time.monotonic() - start)
                 return
 
-    def _go(self) -> None:
-        self._put(f"go depth {self.depth}")
+    @_supervised
+    def start_search(self, **limits: Any) -> SearchHandle:
+        """Starts a search on the current position without waiting for it.
+
+        An outstanding search on this engine is cancelled first.
+
+        Args:
+            limits:
+              UCI go limits, e.g. depth=10, movetime=1000, nodes=20000 or
+              wtime/btime/winc/binc. Limits set to None are left out.
+              Without any limit the configured depth is used.
 
-    def _go_time(self, time: int) -> None:
-        self._put(f"go movetime {time}")
+        Returns:
+            A SearchHandle to poll, wait for or cancel the search.
+        """
+        self._idle()
+        command = "go"
+        for name, value in limits.items():
+            if value is not None:
+                command += f" {name} {value}"
+        if command == "go":
+            command += f" depth {self.depth}"
+        self._search = SearchHandle(self)
+        self._search.command = command
+        self._put(command)
+        return self._search
 
     @staticmethod
     def _convert_move_list_to_str(moves: List[str]) -> str:
@@ -119,7 +787,8 @@ class Stockfish:
             result += f"{move} "
         return result.strip()
 
-    def set_position(self, moves: List[str] = None) -> None:
+    @_supervised
+    def set_position(self, moves: List[str] = None, fen: Optional[str] = None) -> None:
         """Sets current board position.
 
         Args:
@@ -127,12 +796,21 @@ class Stockfish:
               A list of moves to set this position on the board.
               Must be in full algebraic notation.
               example: ['e2e4', 'e7e5']
+
+            fen:
+              Optional FEN of the position the moves are played from,
+              the standard starting position if None.
         """
         self._prepare_for_new_position(True)
         if moves is None:
             moves = []
-        self._put(f"position startpos moves {self._convert_move_list_to_str(moves)}")
+        start = "startpos" if fen is None else f"fen {fen}"
+        self._set_position_command(f"position {start} moves {self._convert_move_list_to_str(moves)}")
+        white_starts = fen is None or fen.split(" ")[1] == "w"
+        self._white_to_move = white_starts ^ (len(moves) % 2 == 1)
+        self._restart_analysis()
 
+    @_supervised
     def make_moves_from_current_position(self, moves: List[str]) -> None:
         """Sets a new position by playing the moves from the current position.
 
@@ -147,16 +825,20 @@ class Stockfish:
                 "No moves sent in to the make_moves_from_current_position function."
             )
         self._prepare_for_new_position(False)
-        self._put(
+        self._set_position_command(
             f"position fen {self.get_fen_position()} moves {self._convert_move_list_to_str(moves)}"
         )
+        self._white_to_move ^= len(moves) % 2 == 1
+        self._restart_analysis()
 
+    @_supervised
     def get_board_visual(self) -> str:
         """Returns a visual representation of the current board position.
 
         Returns:
             String of visual representation of the chessboard with its pieces in current position.
         """
+        self._idle()
         self._put("d")
         board_rep = ""
         count_lines = 0
@@ -165,17 +847,19 @@ class Stockfish:
             if "+" in board_str or "|" in board_str:
                 count_lines += 1
                 board_rep += f"{board_str}\n"
-        if self._stockfish_major_version >= 12:
+        if (self._stockfish_major_version or 0) >= 12:
             board_str = self._read_line()
             board_rep += f"  {board_str}\n"
         return board_rep
 
+    @_supervised
     def get_fen_position(self) -> str:
         """Returns current board position in Forsyth–Edwards notation (FEN).
 
         Returns:
             String with current position in Forsyth–Edwards notation (FEN)
         """
+        self._idle()
         self._put("d")
         while True:
             text = self._read_line()
@@ -183,6 +867,7 @@ class Stockfish:
             if splitted_text[0] == "Fen:":
                 return " ".join(splitted_text[1:])
 
+    @_supervised
     def set_skill_level(self, skill_level: int = 20) -> None:
         """Sets current skill level of stockfish engine.
 
@@ -197,6 +882,7 @@ class Stockfish:
         self._set_option("Skill Level", skill_level)
         self._parameters.update({"Skill Level": skill_level})
 
+    @_supervised
     def set_elo_rating(self, elo_rating: int = 1350) -> None:
         """Sets current elo rating of stockfish engine, ignoring skill level.
 
@@ -210,6 +896,7 @@ class Stockfish:
         self._set_option("UCI_Elo", elo_rating)
         self._parameters.update({"UCI_Elo": elo_rating})
 
+    @_supervised
     def set_fen_position(
         self, fen_position: str, send_ucinewgame_token: bool = True
     ) -> None:
@@ -228,7 +915,22 @@ class Stockfish:
             None
         """
         self._prepare_for_new_position(send_ucinewgame_token)
-        self._put(f"position fen {fen_position}")
+        self._set_position_command(f"position fen {fen_position}")
+        self._white_to_move = fen_position.split(" ")[1] == "w"
+        self._restart_analysis()
+
+    def iter_search(self, **limits: Any) -> SearchHandle:
+        """Starts a search and returns it for iteration over its info lines.
+
+        Args:
+            limits:
+              UCI go limits as for start_search.
+
+        Returns:
+            The SearchHandle, iterating over it yields an InfoLine per info line
+            (depth, score, bound, pv, nodes, nps, time, ...) until the best move arrives.
+        """
+        return self.start_search(**limits)
 
     def get_best_move(self) -> Optional[str]:
         """Returns best move with current position on the board.
@@ -236,17 +938,7 @@ class Stockfish:
         Returns:
             A string of move in algebraic notation or None, if it's a mate now.
         """
-        self._go()
-        last_text: str = ""
-        while True:
-            text = self._read_line()
-            splitted_text = text.split(" ")
-            if splitted_text[0] == "bestmove":
-                if splitted_text[1] == "(none)":
-                    return None
-                self.info = last_text
-                return splitted_text[1]
-            last_text = text
+        return self.start_search(depth=self.depth).result()
 
     def get_best_move_time(self, time: int = 1000) -> Optional[str]:
         """Returns best move with current position on the board after a determined time
@@ -258,17 +950,46 @@ class Stockfish:
         Returns:
             A string of move in algebraic notation or None, if it's a mate now.
         """
-        self._go_time(time)
-        last_text: str = ""
-        while True:
-            text = self._read_line()
-            splitted_text = text.split(" ")
-            if splitted_text[0] == "bestmove":
-                if splitted_text[1] == "(none)":
-                    return None
-                self.info = last_text
-                return splitted_text[1]
-            last_text = text
+        return self.start_search(movetime=time).result()
+
+    def get_best_move_nodes(self, nodes: int = 20000) -> Optional[str]:
+        """Returns best move with current position on the board after searching a number of nodes
+
+        Args:
+            nodes:
+              Number of nodes for stockfish to search before returning the best move (int)
+
+        Returns:
+            A string of move in algebraic notation or None, if it's a mate now.
+        """
+        return self.start_search(nodes=nodes).result()
+
+    def get_best_move_clock(
+        self,
+        wtime: int,
+        btime: int,
+        winc: int = 0,
+        binc: int = 0,
+        movetime: Optional[int] = None,
+    ) -> Optional[str]:
+        """Returns best move with current position on the board using the engine's time management
+
+        Args:
+            wtime:
+              Remaining time on white's clock in milliseconds (int)
+            btime:
+              Remaining time on black's clock in milliseconds (int)
+            winc:
+              White increment per move in milliseconds (int)
+            binc:
+              Black increment per move in milliseconds (int)
+            movetime:
+              Optional hard cap on the thinking time in milliseconds (int)
+
+        Returns:
+            A string of move in algebraic notation or None, if it's a mate now.
+        """
+        return self.start_search(wtime=wtime, btime=btime, winc=winc, binc=binc, movetime=movetime).result()
 
     def is_move_correct(self, move_value: str) -> bool:
         """Checks new move.
@@ -280,16 +1001,9 @@ class Stockfish:
         Returns:
             True, if new move is correct, else False.
         """
-        self._put(f"go depth 1 searchmoves {move_value}")
-        while True:
-            text = self._read_line()
-            splitted_text = text.split(" ")
-            if splitted_text[0] == "bestmove":
-                if splitted_text[1] == "(none)":
-                    return False
-                else:
-                    return True
+        return self.start_search(depth=1, searchmoves=move_value).result() is not None
 
+    @_supervised
     def get_evaluation(self) -> dict:
         """Evaluates current position
 
@@ -298,26 +1012,14 @@ class Stockfish:
         """
 
         evaluation = dict()
-        fen_position = self.get_fen_position()
-        if "w" in fen_position:  # w can only be in FEN if it is whites move
-            compare = 1
-        else:  # stockfish shows advantage relative to current player, convention is to do white positive
-            compare = -1
-        self._put(f"position {fen_position}")
-        self._go()
-        while True:
-            text = self._read_line()
-            splitted_text = text.split(" ")
-            if splitted_text[0] == "info":
-                for n in range(len(splitted_text)):
-                    if splitted_text[n] == "score":
-                        evaluation = {
-                            "type": splitted_text[n + 1],
-                            "value": int(splitted_text[n + 2]) * compare,
-                        }
-            elif splitted_text[0] == "bestmove":
-                return evaluation
+        # stockfish shows advantage relative to current player, convention is to do white positive
+        compare = 1 if self._white_to_move else -1
+        for info in self.iter_search(depth=self.depth):
+            if info.score_type is not None and info.multipv == 1:
+                evaluation = {"type": info.score_type, "value": info.score * compare}
+        return evaluation
 
+    @_supervised
     def get_top_moves(self, num_top_moves: int = 5) -> List[dict]:
         """Returns info on the top moves in the position.
 
@@ -330,62 +1032,89 @@ class Stockfish:
             A list of dictionaries. In each dictionary, there are keys for Move, Centipawn, and Mate;
             the corresponding value for either the Centipawn or Mate key will be None.
             If there are no moves in the position, an empty list is returned.
+            The MultiPV setting is left at num_top_moves, so repeated calls cost one search.
         """
 
         if num_top_moves <= 0:
             raise ValueError("num_top_moves is not a positive number.")
-        old_MultiPV_value = self._parameters["MultiPV"]
-        if num_top_moves != self._parameters["MultiPV"]:
-            self._set_option("MultiPV", num_top_moves)
-            self._parameters.update({"MultiPV": num_top_moves})
-        self._go()
-        lines = []
-        while True:
-            text = self._read_line()
-            splitted_text = text.split(" ")
-            lines.append(splitted_text)
-            if splitted_text[0] == "bestmove":
-                break
-        top_moves: List[dict] = []
-        multiplier = 1 if ("w" in self.get_fen_position()) else -1
-        for current_line in reversed(lines):
-            if current_line[0] == "bestmove":
-                if current_line[1] == "(none)":
-                    top_moves = []
-                    break
-            elif (
-                ("multipv" in current_line)
-                and ("depth" in current_line)
-                and current_line[current_line.index("depth") + 1] == self.depth
-            ):
-                multiPV_number = int(current_line[current_line.index("multipv") + 1])
-                if multiPV_number <= num_top_moves:
-                    has_centipawn_value = "cp" in current_line
-                    has_mate_value = "mate" in current_line
-                    if has_centipawn_value == has_mate_value:
-                        raise RuntimeError(
-                            "Having a centipawn value and mate value should be mutually exclusive."
-                        )
-                    top_moves.insert(
-                        0,
-                        {
-                            "Move": current_line[current_line.index("pv") + 1],
-                            "Centipawn": int(current_line[current_line.index("cp") + 1])
-                            * multiplier
-                            if has_centipawn_value
-                            else None,
-                            "Mate": int(current_line[current_line.index("mate") + 1])
-                            * multiplier
-                            if has_mate_value
-                            else None,
-                        },
-                    )
-            else:
-                break
-        if old_MultiPV_value != self._parameters["MultiPV"]:
-            self._set_option("MultiPV", old_MultiPV_value)
-            self._parameters.update({"MultiPV": old_MultiPV_value})
-        return top_moves
+        self._set_multipv(num_top_moves)
+        multiplier = 1 if self._white_to_move else -1
+        latest: dict = {}
+        search = self.start_search(depth=self.depth)
+        for info in search:
+            # Only the latest line per PV index is kept
+            if info.pv and info.score_type is not None and info.multipv <= num_top_moves:
+                score = info.score * multiplier
+                latest[info.multipv] = {
+                    "Move": info.pv[0],
+                    "Centipawn": score if info.score_type == "cp" else None,
+                    "Mate": score if info.score_type == "mate" else None,
+                }
+        if search.result() is None:
+            return []
+        return [latest[n] for n in sorted(latest)]
+
+    def _set_multipv(self, num_lines: int) -> None:
+        # MultiPV is kept between queries, it is only sent when it changes
+        if self._parameters["MultiPV"] != num_lines:
+            self._set_option("MultiPV", num_lines)
+            self._parameters.update({"MultiPV": num_lines})
+
+    @_supervised
+    def start_analysis(
+        self, num_lines: int = 3, on_update: Optional[Callable[[Analysis], None]] = None
+    ) -> Analysis:
+        """Starts analysing the current position in the background with "go infinite".
+
+        Other queries pause the analysis, it is resumed by poll_analysis() and
+        restarted from scratch whenever the position is set.
+
+        Args:
+            num_lines:
+              Number of best lines (MultiPV) to keep.
+            on_update:
+              Optional callback, called when the best lines change.
+
+        Returns:
+            The Analysis holding the best lines found so far.
+        """
+        self._idle()
+        self.analysis = Analysis(self, num_lines, on_update)
+        self._resume_analysis()
+        return self.analysis
+
+    def stop_analysis(self) -> None:
+        """Stops the background analysis."""
+        self.analysis = None
+        self._idle()
+
+    @_supervised
+    def poll_analysis(self) -> Optional[Analysis]:
+        """Processes pending analysis output without blocking, and resumes the
+        analysis if another query paused it.
+
+        Returns:
+            The Analysis, or None if no analysis is running.
+        """
+        if self.analysis is None:
+            return None
+        if self._search is None:
+            self._resume_analysis()
+        else:
+            self._search.done()
+        return self.analysis
+
+    def _resume_analysis(self) -> None:
+        if self.analysis is not None and self._search is None:
+            self._set_multipv(self.analysis.num_lines)
+            self._search = SearchHandle(self, on_info=self.analysis._handle_info)
+            self._search.command = "go infinite"
+            self._put(self._search.command)
+
+    def _restart_analysis(self) -> None:
+        if self.analysis is not None:
+            self.analysis.reset()
+            self._resume_analysis()
 
     def set_depth(self, depth_value: int = 2) -> None:
         """Sets current depth of stockfish engine.
@@ -399,11 +1128,28 @@ class Stockfish:
         """Returns Stockfish engine major version.
 
         Returns:
-            Current stockfish major version
+            Current stockfish major version, None if the engine is not Stockfish
         """
 
         return self._stockfish_major_version
 
+    def close(self) -> None:
+        """Stops the search or analysis and quits the engine, safe to call more than once.
+
+        Searches and analyses refer back to the engine, so dropping the engine
+        does not end it while one of them is still around.
+        """
+
+        if getattr(self, "transport", None) is None:
+            return
+        if self.transport.alive():
+            try:
+                self._idle()
+                self._put("quit")  # A server keeps its engine for the next connection
+            except (BrokenPipeError, TimeoutError, OSError):
+                pass
+        self.transport.close()
+        self.transport = None
+
     def __del__(self) -> None:
-        self._put("quit")
-        self.stockfish.kill()
\ No newline at end of file
+        self.close()
\ No newline at end of file
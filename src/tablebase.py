@@ -0,0 +1,201 @@
+"""! @brief     Syzygy endgame tablebase probing
+
+    Positions with few pieces left have exact answers in the Syzygy tables, so
+    evaluation, hints and AI moves can be looked up instead of searched. Probe
+    results are kept in an in-memory cache keyed by the Zobrist hash.
+"""
+
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import chess
+import chess.polyglot
+import chess.syzygy
+
+TB_WIN_CP = 20000           # Centipawn score reported for a tablebase win
+TB_CACHE_SIZE = 100000      # Max number of cached probes
+
+
+class EndgameTablebase:
+
+    """! @brief     Cached Syzygy WDL/DTZ probing """
+
+    def __init__(self, directory: str, max_pieces: int = 5):
+
+        """! The Contructor
+
+        @param  directory   Directory holding the .rtbw/.rtbz files.
+        @param  max_pieces  Only probe positions with this many pieces or less.
+        """
+
+        self.directory = directory
+        self.max_pieces = max_pieces
+        self.hits = 0
+        self.misses = 0
+
+        self._tablebase = chess.syzygy.open_tablebase(directory)
+        self._cache = {}
+        self._lock = threading.Lock()   # Shared between boards in host mode
+
+    def in_range(self, board: chess.Board) -> bool:
+
+        """! Check if the position can be found in the tables
+
+        @param  board   The position to check.
+
+        @return         True if the piece count is in range and castling is gone.
+        """
+
+        return chess.popcount(board.occupied) <= self.max_pieces and not board.castling_rights
+
+    def probe(self, board: chess.Board) -> Optional[Tuple[int, int]]:
+
+        """! Probe WDL and DTZ for a position
+
+        @param  board   The position to probe.
+
+        @return         (wdl, dtz) relative to the side to move, or None if not found.
+        """
+
+        if not self.in_range(board):
+            return None
+
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                return self._cache[key]
+
+            try:
+                result = (self._tablebase.probe_wdl(board), self._tablebase.probe_dtz(board))
+            except (KeyError, IndexError):  # Missing table for this material
+                result = None
+
+            self.misses += 1
+            if len(self._cache) >= TB_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = result
+
+        return result
+
+    def _rank_moves(self, board: chess.Board) -> Optional[List[Tuple[tuple, str, int, int]]]:
+
+        """! Probe every legal move and sort them best first for the side to move
+
+        @return List of (sort key, move, wdl, dtz) with wdl/dtz for the mover, or None.
+        """
+
+        ranked = []
+        for move in board.legal_moves:
+            zeroing = board.is_zeroing(move)
+            board.push(move)
+            mate = board.is_checkmate()
+            result = (-2, 0) if mate else self.probe(board)
+            board.pop()
+
+            if result is None:
+                return None
+
+            wdl, dtz = -result[0], -result[1]   # Flip to the side to move
+            if wdl > 0:
+                key = (-wdl, not mate, not zeroing, abs(dtz))   # Mates, then zeroing moves, then fastest
+            elif wdl < 0:
+                key = (-wdl, 0, zeroing, -abs(dtz))   # Make the loss last as long as possible
+            else:
+                key = (0, 0, 0, 0)
+            ranked.append((key, move.uci(), wdl, dtz))
+
+        ranked.sort()
+        return ranked
+
+    def best_move(self, board: chess.Board) -> Optional[str]:
+
+        """! Best move from the tables
+
+        @param  board   The position to find a move for.
+
+        @return         Move in UCI notation, or None if the position is not in the tables.
+        """
+
+        if not self.in_range(board) or board.is_game_over():
+            return None
+
+        ranked = self._rank_moves(board)
+        if not ranked:
+            return None
+
+        return ranked[0][1]
+
+    @staticmethod
+    def _score(wdl: int, dtz: int) -> int:
+
+        """! Centipawn score for a WDL/DTZ pair, shorter wins scoring higher """
+
+        if wdl > 1:
+            return TB_WIN_CP - abs(dtz)
+        if wdl < -1:
+            return -TB_WIN_CP + abs(dtz)
+        return 0  # Draws, and wins/losses spoiled by the 50 move rule
+
+    def get_evaluation(self, board: chess.Board) -> Optional[dict]:
+
+        """! Evaluate the position from the tables
+
+        @param  board   The position to evaluate.
+
+        @return         Same dictionary as Stockfish.get_evaluation (white positive), or None.
+        """
+
+        if board.is_checkmate():
+            return {"type": "mate", "value": 0}
+
+        result = self.probe(board)
+        if result is None:
+            return None
+
+        multiplier = 1 if board.turn == chess.WHITE else -1
+        return {"type": "cp", "value": self._score(*result) * multiplier}
+
+    def get_top_moves(self, board: chess.Board, num_top_moves: int = 5) -> Optional[List[dict]]:
+
+        """! Top moves from the tables
+
+        @param  board           The position to look up.
+        @param  num_top_moves   The number of moves to return.
+
+        @return                 Same list as Stockfish.get_top_moves (white positive), or None.
+        """
+
+        if not self.in_range(board):
+            return None
+
+        ranked = self._rank_moves(board)
+        if ranked is None:
+            return None
+
+        multiplier = 1 if board.turn == chess.WHITE else -1
+        return [{"Move": move, "Centipawn": self._score(wdl, dtz) * multiplier, "Mate": None}
+                for _, move, wdl, dtz in ranked[:num_top_moves]]
+
+    def close(self):
+
+        """! Close the table files """
+
+        self._tablebase.close()
+
+
+def open_tablebase(directory: str, max_pieces: int = 5) -> Optional[EndgameTablebase]:
+
+    """! Open the tablebase if the directory exists
+
+    @param  directory   Directory holding the .rtbw/.rtbz files.
+    @param  max_pieces  Only probe positions with this many pieces or less.
+
+    @return             EndgameTablebase or None if the directory is missing.
+    """
+
+    if not os.path.isdir(directory):
+        return None
+
+    return EndgameTablebase(directory, max_pieces)